@@ -0,0 +1,66 @@
+"""Benchmark button press to callback latency, inline or in the thread pool
+
+Wing button edges are simulated on the fake GPIO, the latency is the time
+between the edge and the callback start.
+
+    python misc/bench_callbacks.py --presses 2000
+"""
+import argparse
+import logging
+import queue
+import time
+
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.wings import Wings
+
+
+CONFIG = {"gpio": {"left_button": 5,
+                   "right_button": 6,
+                   "moving_sensor": 26,
+                   "motor_direction_1": 19,
+                   "motor_direction_2": 13,
+                   },
+          "debounce": {"left_button": {"time": 0}},
+          }
+
+
+def percentile(values, percent: float):
+    """Nearest rank percentile of values"""
+    values = sorted(values)
+    index = max(0, int(round(percent / 100. * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presses", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.getLogger("tuxdroid").setLevel(logging.ERROR)
+    gpio = new_fake_gpio()
+    gpio.set_config_({"wings": CONFIG})
+    wings = Wings(CONFIG, calibrate=False, gpio=gpio)
+    print("{:>8}{:>12}{:>12}{:>12}".format("mode", "p50 us", "p99 us", "max us"))
+    for inline in (False, True):
+        started = queue.Queue()
+
+        def callback():
+            """Record the callback start"""
+            started.put(time.perf_counter())
+
+        wings.add_callback("left", callback, inline=inline)
+        latencies = []
+        for _ in range(args.presses):
+            edge = time.perf_counter()
+            gpio._edge(5)  # pylint: disable=W0212
+            latencies.append(started.get() - edge)
+        wings.del_callback("left", callback)
+        print("{:>8}{:>12.1f}{:>12.1f}{:>12.1f}".format(
+            "inline" if inline else "pool", percentile(latencies, 50) * 1e6,
+            percentile(latencies, 99) * 1e6, max(latencies) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Benchmark `import tuxdroid` time
+
+Each import is measured in a fresh interpreter, so module caches
+do not hide the cost paid at every robot restart.
+
+    python misc/bench_import.py --runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+MODULES = ("tuxdroid", "tuxdroid.gpio", "tuxdroid.tuxdroid", "tuxdroid.client")
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def measure(module, runs):
+    """Return import times of a module in seconds"""
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", SNIPPET.format(module=module)])
+        times.append(float(output.decode().strip()))
+    return times
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    interpreter = measure("sys", args.runs)
+    print("{:<24} {:>10} {:>10}".format("module", "median ms", "min ms"))
+    print("{:<24} {:>10.2f} {:>10.2f}".format("(interpreter baseline)",
+                                              statistics.median(interpreter) * 1000,
+                                              min(interpreter) * 1000))
+    for module in args.modules:
+        times = measure(module, args.runs)
+        print("{:<24} {:>10.2f} {:>10.2f}".format(module, statistics.median(times) * 1000,
+                                                  min(times) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark photodetector sampling against motor edge handling
+
+Fake GPIO motor edges and light samples share the scheduler thread.
+For each sampling rate, wings move while a probe timer measures how
+late scheduler timers (like motor edges) run.
+
+    python misc/bench_light_sensor.py tests/tuxdroid_test_config.yaml --rates 0 50 500 2000
+"""
+import argparse
+import logging
+import time
+
+import yaml
+
+from tuxdroid import light
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.light import FakeLight
+from tuxdroid.scheduler import get_scheduler
+from tuxdroid.tuxdroid import TuxDroid
+
+
+def percentile(values, percent: float):
+    """Nearest rank percentile of values"""
+    values = sorted(values)
+    index = max(0, int(round(percent / 100. * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config", help="yaml configuration file")
+    parser.add_argument("--rates", type=float, nargs="+", default=[0, 50, 500, 2000],
+                        help="sampling rates in Hz, 0 disables sampling")
+    parser.add_argument("--moves", type=int, default=4, help="wings moves per rate")
+    args = parser.parse_args()
+
+    with open(args.config) as fhc:
+        config = yaml.safe_load(fhc)
+    tux = TuxDroid(config, logging_level=logging.ERROR, parts=("wings", "head"),
+                   gpio=new_fake_gpio())
+    scheduler = get_scheduler()
+    source = FakeLight(0.8, noise=0.02, seed=1)
+    print("NumPy: {}".format("yes" if light.numpy is not None else "no"))
+    print("{:>8}{:>10}{:>12}{:>12}{:>12}{:>12}".format(
+        "rate Hz", "samples", "sample us", "late p50 ms", "late p99 ms", "move s"))
+    for rate in args.rates:
+        sensor = None
+        if rate:
+            sensor = light.LightSensor(source.read, period=1. / rate)
+            sensor.start()
+        lateness = []
+        probe_period = 0.005
+        expected = [scheduler.time() + probe_period]
+
+        def probe():
+            """Record timer lateness"""
+            now = scheduler.time()
+            lateness.append(now - expected[0])
+            expected[0] += probe_period
+
+        timer = scheduler.call_every(probe_period, probe)
+        start = time.perf_counter()
+        tux.wings.move(args.moves)
+        move_time = time.perf_counter() - start
+        timer.cancel()
+        sample_cost = float("nan")
+        samples = 0
+        if sensor is not None:
+            sensor.stop()
+            samples = sensor.samples
+            start = time.perf_counter()
+            for _ in range(1000):
+                sensor.sample()
+            sample_cost = (time.perf_counter() - start) / 1000
+        print("{:>8g}{:>10}{:>12.1f}{:>12.2f}{:>12.2f}{:>12.2f}".format(
+            rate, samples, sample_cost * 1e6, percentile(lateness, 50) * 1000,
+            percentile(lateness, 99) * 1000, move_time))
+    tux.stop()
+
+
+if __name__ == "__main__":
+    main()
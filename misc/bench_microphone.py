@@ -0,0 +1,78 @@
+"""Benchmark microphone voice activity detection time per block
+
+A recording (mono 16 bits wav) is processed as fast as possible, block per
+block. Without recording, a synthetic one is generated: noise with bursts
+of tones standing in for speech. The processing budget of a block is
+its duration.
+
+    python misc/bench_microphone.py --recording speech.wav --block-times 0.01 0.02 0.05
+"""
+import argparse
+import array
+import math
+import random
+import time
+import wave
+
+from tuxdroid import microphone
+from tuxdroid.microphone import VoiceDetector
+
+
+def percentile(values, percent: float):
+    """Nearest rank percentile of values"""
+    values = sorted(values)
+    index = max(0, int(round(percent / 100. * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def synthetic_recording(duration: float, rate: int, seed: int = 0):
+    """Get noise with a one second tone burst every three seconds, after one second"""
+    generator = random.Random(seed)
+    samples = array.array("h", bytes(2 * int(rate * duration)))
+    for index in range(len(samples)):
+        value = generator.gauss(0., 60.)
+        if 1. <= (index / rate) % 3. < 2.:
+            value += 8000. * math.sin(2 * math.pi * 220. * index / rate)
+        samples[index] = int(value)
+    return samples.tobytes(), rate
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="mono 16 bits wav file")
+    parser.add_argument("--duration", type=float, default=30.,
+                        help="synthetic recording duration in seconds")
+    parser.add_argument("--block-times", type=float, nargs="+", default=[0.01, 0.02, 0.05])
+    args = parser.parse_args()
+
+    if args.recording:
+        with wave.open(args.recording, "rb") as wav:
+            data, rate = wav.readframes(wav.getnframes()), wav.getframerate()
+    else:
+        data, rate = synthetic_recording(args.duration, 16000)
+    print("NumPy: {}, recording: {:.1f}s".format("yes" if microphone.numpy is not None else "no",
+                                                 len(data) / 2 / rate))
+    print("{:>8}{:>8}{:>12}{:>12}{:>12}{:>9}{:>8}".format(
+        "block ms", "blocks", "p50 us", "p99 us", "max us", "budget", "events"))
+    for block_time in args.block_times:
+        size = 2 * int(rate * block_time)
+        detector = VoiceDetector(block_time)
+        times = []
+        events = 0
+        for start in range(0, len(data) - size + 1, size):
+            block = data[start:start + size]
+            start_time = time.perf_counter()
+            if detector.process(block) is not None:
+                events += 1
+            times.append(time.perf_counter() - start_time)
+        print("{:>8.0f}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}{:>8.2f}%{:>8}".format(
+            block_time * 1000, len(times), percentile(times, 50) * 1e6,
+            percentile(times, 99) * 1e6, max(times) * 1e6,
+            100. * percentile(times, 99) / block_time, events))
+    print("Budget is the p99 processing time over the block duration")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Benchmark many simulated TuxDroids driven from one process
+
+Each robot gets its own fake GPIO backend. Measure robot creation,
+broadcast latency of fast and motor commands and the thread count.
+
+    python misc/bench_multi_robot.py tests/tuxdroid_test_config.yaml --robots 50
+"""
+import argparse
+import logging
+import statistics
+import threading
+import time
+
+import yaml
+
+from tuxdroid.manager import TuxDroidManager
+
+
+def timed(function, *args, **kwargs):
+    """Return function duration in seconds"""
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("config", help="yaml configuration file")
+    parser.add_argument("--robots", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=20, help="fast command broadcasts")
+    args = parser.parse_args()
+
+    with open(args.config) as fhc:
+        config = yaml.safe_load(fhc)
+    manager = TuxDroidManager()
+    threads = threading.active_count()
+    start = time.perf_counter()
+    for index in range(args.robots):
+        manager.create("tux{}".format(index), config, logging_level=logging.ERROR,
+                       calibrate=False)
+    print("Created {} robots in {:.1f}ms".format(args.robots,
+                                                  (time.perf_counter() - start) * 1000))
+
+    latencies = [timed(manager.broadcast, "eyes.led_on") for _ in range(args.runs)]
+    print("Broadcast eyes.led_on: median {:.2f}ms, max {:.2f}ms".format(
+        statistics.median(latencies) * 1000, max(latencies) * 1000))
+    print("Broadcast wings.up (with calibration): {:.2f}s".format(
+        timed(manager.broadcast, "wings.up")))
+    print("Broadcast wings.move 2: {:.2f}s".format(
+        timed(manager.broadcast, "wings.move", [2])))
+    print("Threads: {} before, {} after".format(threads, threading.active_count()))
+    manager.stop()
+
+
+if __name__ == "__main__":
+    main()
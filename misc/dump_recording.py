@@ -0,0 +1,27 @@
+"""Print a TuxDroid GPIO recording as text
+
+    python misc/dump_recording.py session.tuxrec
+"""
+import argparse
+
+from tuxdroid.replay import EDGE, read_recording
+
+
+def main():
+    """Print one line per recorded event"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("recording", help="recording file")
+    args = parser.parse_args()
+
+    events = read_recording(args.recording)
+    for event in events:
+        if event.kind == EDGE:
+            kind = "edge   {}".format("RISING" if event.value else "FALLING")
+        else:
+            kind = "output {}".format("HIGH" if event.value else "LOW")
+        print("{:10.4f}s  GPIO {:2d}  {}".format(event.time, event.channel, kind))
+    print("{} events".format(len(events)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,31 @@
-import RPi.GPIO as GPIO
-GPIO.setmode(GPIO.BCM)
+"""Cut all TuxDroid motors from the command line
 
-# TODO dynamize it
+Motor GPIOs are read from the configuration file, no part is built
+and nothing is moved:
 
-GPIO.setup(22, GPIO.OUT)
-GPIO.setup(23, GPIO.OUT)
-GPIO.setup(24, GPIO.OUT)
-GPIO.setup(25, GPIO.OUT)
+    python misc/emergency_stop.py config.yaml
+"""
+import argparse
 
-GPIO.output(22, GPIO.LOW)
-GPIO.output(23, GPIO.LOW)
-GPIO.output(24, GPIO.LOW)
-GPIO.output(25, GPIO.LOW)
+from tuxdroid.config import load_config
+from tuxdroid.gpio import GPIO
+from tuxdroid.safety import cut_motors, motor_pins
 
-GPIO.cleanup()
+
+def main():
+    """Set all motor GPIOs LOW"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("config", help="yaml configuration file")
+    args = parser.parse_args()
+
+    pins = motor_pins(load_config(args.config))
+    GPIO.setmode(GPIO.BCM)
+    for pin in pins:
+        GPIO.setup(pin, GPIO.OUT)
+    cut_motors(pins)
+    GPIO.cleanup()
+    print("Motors cut: GPIO {}".format(", ".join(str(pin) for pin in pins)))
+
+
+if __name__ == "__main__":
+    main()
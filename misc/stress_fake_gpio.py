@@ -0,0 +1,123 @@
+"""Stress TuxDroid components against a faulty simulated body
+
+Motors of the fake GPIO are accelerated by `--time-scale` (config timings
+are scaled the same way) and faults are injected in sensor edges.
+A watchdog stops motors which never reach their position.
+Report error rates and latency percentiles per motion.
+
+    python misc/stress_fake_gpio.py tests/tuxdroid_test_config.yaml --runs 3000 \\
+        --jitter 0.05 --bounce 0.05 --drop 0.01
+"""
+import argparse
+import collections
+import copy
+import logging
+import time
+
+from tuxdroid.config import load_config, validate
+from tuxdroid.errors import TuxDroidError
+from tuxdroid.gpio import JITTER_DISTRIBUTIONS, FakeFaults, new_fake_gpio
+from tuxdroid.tuxdroid import TuxDroid
+
+
+MOTIONS = (("wings", "up"), ("wings", "down"),
+           ("eyes", "open"), ("eyes", "close"),
+           ("mouth", "open"), ("mouth", "close"))
+
+
+def scale_config(config: dict, scale: float):
+    """Scale motion timings of a normalized config"""
+    config = copy.deepcopy(config)
+    parts = [config['wings'], config['head']['eyes'], config['head']['mouth']]
+    for part in parts:
+        part['startup_time'] *= scale
+        for debounce in part['debounce'].values():
+            debounce['time'] *= scale
+    config['wings']['brake']['dead_time'] *= scale
+    config['wings']['brake']['time'] *= scale
+    config['safety']['max_motor_time'] *= scale
+    config['safety']['watchdog_interval'] = max(0.005, config['safety']['watchdog_interval'] *
+                                                scale)
+    return config
+
+
+def percentile(values, percent: float):
+    """Nearest rank percentile of values"""
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    index = max(0, int(round(percent / 100. * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def main():
+    """Run stress test"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config", help="yaml configuration file")
+    parser.add_argument("--runs", type=int, default=1000, help="number of motions")
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.,
+                        help="edge jitter, in unscaled seconds")
+    parser.add_argument("--jitter-distribution", choices=JITTER_DISTRIBUTIONS, default="gauss")
+    parser.add_argument("--bounce", type=float, default=0., help="bounce burst probability")
+    parser.add_argument("--drop", type=float, default=0., help="dropped edge probability")
+    parser.add_argument("--stuck", action="append", default=[],
+                        help="stuck sensor, like wings.moving_sensor")
+    parser.add_argument("--slow", action="append", default=[],
+                        help="slow motor, like mouth=2")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scale = args.time_scale
+    config = scale_config(validate(load_config(args.config)), scale)
+    gpio = new_fake_gpio(FakeFaults(time_scale=scale))
+    # Calibrate on a perfect body, faults are injected afterwards
+    tux = TuxDroid(config, logging_level=logging.CRITICAL, gpio=gpio)
+    watchdog = tux.start_watchdog()
+    faults = FakeFaults(jitter=args.jitter * scale,
+                        jitter_distribution=args.jitter_distribution,
+                        bounce=args.bounce, bounce_spacing=0.002 * scale, drop=args.drop,
+                        stuck=args.stuck,
+                        slow_motors={name: float(factor) for name, factor in
+                                     (slow.split("=") for slow in args.slow)},
+                        time_scale=scale, seed=args.seed)
+    gpio.set_faults_(faults)
+
+    latencies = collections.defaultdict(list)
+    errors = collections.Counter()
+    start = time.perf_counter()
+    for run in range(args.runs):
+        part, position = MOTIONS[run % len(MOTIONS)]
+        component = tux.wings if part == "wings" else getattr(tux.head, part)
+        motion_start = time.perf_counter()
+        try:
+            getattr(component, position)()
+        except TuxDroidError:
+            errors[part, position] += 1
+            watchdog.reset()
+        latencies[part, position].append(time.perf_counter() - motion_start)
+    duration = time.perf_counter() - start
+    tux.stop()
+
+    print("{} motions in {:.1f}s, faults: {}".format(args.runs, duration, faults.stats))
+    print("{:<14}{:>7}{:>9}{:>10}{:>10}{:>10}".format("motion", "runs", "errors",
+                                                      "p50 ms", "p95 ms", "p99 ms"))
+    for motion in MOTIONS:
+        values = latencies[motion]
+        print("{:<14}{:>7}{:>8.1f}%{:>10.1f}{:>10.1f}{:>10.1f}".format(
+            ".".join(motion), len(values),
+            100. * errors[motion] / max(1, len(values)),
+            percentile(values, 50) * 1000 / scale,
+            percentile(values, 95) * 1000 / scale,
+            percentile(values, 99) * 1000 / scale))
+    print("Latencies are in unscaled milliseconds")
+    for name, component in (("wings", tux.wings), ("eyes", tux.head.eyes),
+                            ("mouth", tux.head.mouth)):
+        print("Debounce rejects {}: {}".format(name, ", ".join(
+            "{} {}/{}".format(sensor, stats['rejected'], stats['accepted'] + stats['rejected'])
+            for sensor, stats in sorted(component.debounce_stats().items()))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Load test of the TuxDroid web API against the fake GPIO
+
+Start a TuxDroid on the fake GPIO, serve the web API on a random port
+and hammer it with concurrent HTTP clients and WebSocket listeners.
+
+    python misc/webapi_loadtest.py tests/tuxdroid_test_config.yaml --clients 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import yaml
+
+from tuxdroid.tuxdroid import TuxDroid
+from tuxdroid.webapi import WebAPIServer, read_websocket_frame
+
+
+REQUESTS = (("GET", "/state", None),
+            ("POST", "/command/eyes.led_on", []),
+            ("POST", "/command/eyes.led_off", []),
+            ("POST", "/command/wings.move", [2]),
+            ("POST", "/command/mouth.move", [2]),
+            )
+
+
+async def http_client(port, requests, latencies, errors):
+    """Send requests on one keep-alive connection"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for index in range(requests):
+        method, path, body = REQUESTS[index % len(REQUESTS)]
+        data = json.dumps(body).encode() if body is not None else b""
+        start = time.perf_counter()
+        writer.write("{} {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n"
+                     .format(method, path, len(data)).encode() + data)
+        status = int((await reader.readline()).split()[1])
+        headers = (await reader.readuntil(b"\r\n\r\n")).decode().lower()
+        length = int(headers.split("content-length:")[1].split("\r\n")[0])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    writer.close()
+
+
+async def websocket_client(port, events, done):
+    """Count events received on one WebSocket until done is set"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    while not done.is_set():
+        try:
+            await asyncio.wait_for(read_websocket_frame(reader), 0.1)
+        except asyncio.TimeoutError:
+            continue
+        events.append(1)
+    writer.close()
+
+
+def percentile(values, pct):
+    """Get percentile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    """Run load test"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("config", help="yaml configuration file")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--websockets", type=int, default=50)
+    args = parser.parse_args()
+
+    with open(args.config) as fhc:
+        tux = TuxDroid(yaml.safe_load(fhc))
+    loop = asyncio.get_event_loop()
+    server = WebAPIServer(tux, "127.0.0.1", 0, loop=loop)
+    loop.run_until_complete(server.start())
+
+    latencies = []
+    errors = []
+    events = []
+    done = asyncio.Event()
+
+    async def run():
+        """Run clients, then stop listeners"""
+        listeners = asyncio.gather(*[websocket_client(server.port, events, done)
+                                     for _ in range(args.websockets)])
+        await asyncio.gather(*[http_client(server.port, args.requests, latencies, errors)
+                               for _ in range(args.clients)])
+        done.set()
+        await listeners
+
+    start = time.perf_counter()
+    loop.run_until_complete(run())
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print("Requests: {} in {:.2f}s ({:.0f} req/s), errors: {}".format(
+        len(latencies), elapsed, len(latencies) / elapsed, len(errors)))
+    print("Latency p50: {:.2f}ms p95: {:.2f}ms p99: {:.2f}ms max: {:.2f}ms".format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+    print("Commands run: {commands}, coalesced: {coalesced}, events: {events}".format(
+        **server.stats))
+    print("WebSocket events received: {}".format(len(events)))
+
+    loop.run_until_complete(server.stop())
+    tux.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from tuxdroid.calibration import sensor_position
+from tuxdroid.errors import TuxDroidEyesError, TuxDroidWingsError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.head import Head
+from tuxdroid.positions import Position
+from tuxdroid.safety import cut_motors
+from tuxdroid.tuxdroid import TuxDroid
+from tuxdroid.wings import Wings
+
+
+HEAD = {"gpio": {"head_button": 12},
+        "mouth": {"gpio": {"opened_sensor": 21,
+                           "closed_sensor": 20,
+                           "motor": 16,
+                           },
+                  "calibration": "fast",
+                  },
+        "eyes": {"gpio": {"opened_sensor": 7,
+                          "closed_sensor": 8,
+                          "motor": 25,
+                          "left_led": 23,
+                          "right_led": 24,
+                          },
+                 "calibration": "fast",
+                 },
+        }
+
+WINGS = {"gpio": {"left_button": 5,
+                  "right_button": 6,
+                  "moving_sensor": 26,
+                  "motor_direction_1": 19,
+                  "motor_direction_2": 13,
+                  },
+         "calibration": "fast",
+         }
+
+
+class TestCalibration(object):
+
+    def test_calibration_sensor_position(self):
+        gpio = new_fake_gpio()
+        assert sensor_position(gpio, 7, 8) is None
+        gpio.levels[8] = gpio.HIGH
+        assert sensor_position(gpio, 7, 8) == Position.CLOSED
+        gpio.levels[7] = gpio.HIGH
+        assert sensor_position(gpio, 7, 8) is None
+        gpio.levels[8] = gpio.LOW
+        assert sensor_position(gpio, 7, 8) == Position.OPENED
+
+    def test_calibration_default(self):
+        gpio = new_fake_gpio()
+        config = {"gpio": HEAD["gpio"],
+                  "eyes": {"gpio": HEAD["eyes"]["gpio"]},
+                  "mouth": {"gpio": HEAD["mouth"]["gpio"]}}
+        gpio.set_config_({"head": config})
+        gpio.levels.update({8: gpio.HIGH, 20: gpio.HIGH})
+        # Full calibration by default, sensor levels are not trusted
+        head = Head(config, gpio=gpio)
+        assert head.eyes.position == Position.OPENED
+        assert (head.eyes.calibration.strategy, head.eyes.calibration.moves) == ("full", 2)
+
+    def test_calibration_fast_head(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"head": HEAD})
+        gpio.levels.update({8: gpio.HIGH, 21: gpio.HIGH})
+        head = Head(HEAD, gpio=gpio)
+        # Position read from the sensors, no motor started
+        assert head.eyes.position == Position.CLOSED
+        assert head.mouth.position == Position.OPENED
+        assert 25 not in gpio.outputs and 16 not in gpio.outputs
+        for part in (head.eyes, head.mouth):
+            assert part.is_calibrated and part.is_ready
+            assert (part.calibration.strategy, part.calibration.moves,
+                    part.calibration.moves_saved) == ("fast", 0, 2)
+        assert head.eyes.calibration.time < 0.1
+
+    def test_calibration_fallback(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"head": HEAD})
+        # Both eyes sensors active: ambiguous, eyes move
+        gpio.levels.update({7: gpio.HIGH, 8: gpio.HIGH})
+        head = Head(HEAD, calibrate=False, gpio=gpio)
+        head.eyes.calibrate()
+        assert head.eyes.position == Position.OPENED
+        assert (head.eyes.calibration.strategy, head.eyes.calibration.moves,
+                head.eyes.calibration.moves_saved) == ("fast", 2, 0)
+        # The fake motor left the opened sensor active
+        assert sensor_position(gpio, 7, 8) == Position.OPENED
+        # Full calibration moves whatever the sensors
+        head.eyes.calibrate("full")
+        assert (head.eyes.calibration.strategy, head.eyes.calibration.moves) == ("full", 2)
+        with pytest.raises(TuxDroidEyesError):
+            head.eyes.calibrate("slow")
+
+    def test_calibration_wings(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": WINGS})
+        fast = Wings(WINGS, gpio=gpio)
+        assert fast.position == Position.DOWN
+        assert (fast.calibration.moves, fast.calibration.moves_saved) == (2, 2)
+        fast.calibrate("full")
+        assert fast.position == Position.DOWN
+        assert (fast.calibration.moves, fast.calibration.moves_saved) == (4, 0)
+
+    def test_calibration_report(self):
+        gpio = new_fake_gpio()
+        tux = TuxDroid({"head": HEAD}, lazy=True, parts=("head",), gpio=gpio)
+        assert tux.calibration_report() == {}
+        gpio.levels.update({8: gpio.HIGH, 20: gpio.HIGH})
+        assert tux.head.is_ready
+        report = tux.calibration_report()
+        assert sorted(report) == ["eyes", "mouth"]
+        assert report["mouth"].moves_saved == 2
+
+    def test_calibration_interrupted(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": WINGS})
+        wings = Wings(WINGS, calibrate=False, gpio=gpio)
+        errors = []
+
+        def calibrate():
+            try:
+                wings.calibrate()
+            except TuxDroidWingsError as exp:
+                errors.append(exp)
+
+        thread = threading.Thread(target=calibrate)
+        thread.start()
+        time.sleep(0.2)
+        # Emergency stop while waiting for the moving sensor
+        cut_motors(wings.motor_pins, gpio)
+        wings.halt()
+        thread.join(1)
+        assert not thread.is_alive()
+        assert len(errors) == 1
+        assert not wings.is_calibrated
+        assert not wings._calibrating
@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import queue
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from tuxdroid.callbacks import Event, running_loop, wants_event
+from tuxdroid.errors import TuxDroidWingsError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.wings import Wings
+
+
+CONFIG = {"gpio": {"left_button": 5,
+                   "right_button": 6,
+                   "moving_sensor": 26,
+                   "motor_direction_1": 19,
+                   "motor_direction_2": 13,
+                   },
+          "debounce": {"left_button": {"time": 0}, "right_button": {"time": 0}},
+          }
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def method(self, event):
+        self.calls.put(("method", event))
+
+    def __call__(self):
+        self.calls.put(("call", None))
+
+    def get(self, count):
+        return sorted((self.calls.get(timeout=1) for _ in range(count)),
+                      key=lambda call: call[0])
+
+
+class TestCallbacks(object):
+
+    def test_callbacks_wants_event(self):
+        assert wants_event(lambda event: None)
+        assert wants_event(lambda *args: None)
+        assert not wants_event(lambda: None)
+        assert not wants_event(lambda event=None: None)
+        assert wants_event(Recorder().method)
+        assert not wants_event(Recorder())
+        assert wants_event(functools.partial(lambda tag, event: None, "tag"))
+
+    def test_callbacks_any_callable(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, calibrate=False, gpio=gpio)
+        recorder = Recorder()
+        wings.add_callback("left", recorder.method)
+        wings.add_callback("left", recorder)
+        wings.add_callback("right", functools.partial(recorder.calls.put, ("partial", None)))
+        assert recorder.method in wings._left_callbacks
+        with pytest.raises(TuxDroidWingsError):
+            wings.add_callback("left", "not callable")
+        gpio._edge(5)
+        calls = recorder.get(2)
+        assert calls[0] == ("call", None)
+        event = calls[1][1]
+        assert isinstance(event, Event)
+        assert (calls[1][0], event.component, event.position, event.sequence) == \
+            ("method", "wings.left", None, 1)
+        gpio._edge(6)
+        assert recorder.get(1) == [("partial", None)]
+        # Sequence numbers are per component
+        gpio._edge(5)
+        assert recorder.get(2)[1][1].sequence == 3
+        # Mocks resolve any attribute, like `func`
+        mock = MagicMock()
+        wings.add_callback("left", mock)
+        gpio._edge(5)
+        time.sleep(0.1)
+        assert mock.called
+
+    def test_callbacks_unsubscribe(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, calibrate=False, gpio=gpio)
+        recorder = Recorder()
+        subscription = wings.add_callback("right", recorder)
+        assert subscription.active
+        assert subscription.unsubscribe() is True
+        assert not subscription.active
+        assert subscription.unsubscribe() is False
+        assert wings._right_callbacks == set()
+        gpio._edge(6)
+        with pytest.raises(queue.Empty):
+            recorder.calls.get(timeout=0.1)
+
+    def test_callbacks_coroutines(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, calibrate=False, gpio=gpio)
+        results = queue.Queue()
+
+        async def without_loop(event):
+            await asyncio.sleep(0)
+            results.put(("without_loop", event.component))
+
+        wings.add_callback("left", without_loop)
+        gpio._edge(5)
+        assert results.get(timeout=1) == ("without_loop", "wings.left")
+        wings.del_callback("left", without_loop)
+
+        assert running_loop() is None
+
+        async def main():
+            loop = asyncio.get_event_loop()
+            assert running_loop() is loop
+            done = asyncio.Event()
+
+            async def in_loop():
+                results.put(("in_loop", asyncio.get_event_loop() is loop))
+                done.set()
+
+            wings.add_callback("right", in_loop)
+            await loop.run_in_executor(None, gpio._edge, 6)
+            await asyncio.wait_for(done.wait(), 1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(main())
+        finally:
+            loop.close()
+        assert results.get(timeout=1) == ("in_loop", True)
+
+    def test_callbacks_inline(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, calibrate=False, gpio=gpio)
+        calls = []
+        wings.add_callback("left", lambda: calls.append(("pool", threading.get_ident())))
+        wings.add_callback("left", lambda event: calls.append(("inline", threading.get_ident())),
+                           inline=True)
+        gpio._edge(5)
+        # Done before the edge handler returns, in its thread, before pooled callbacks
+        assert calls[0] == ("inline", threading.get_ident())
+        time.sleep(0.1)
+        assert calls[1][0] == "pool"
+        assert calls[1][1] != threading.get_ident()
+        stats = wings.callback_stats()["left"]
+        assert [(item["inline"], item["calls"], item["overruns"]) for item in stats] == \
+            [(True, 1, 0)]
+        # Failing inline callbacks do not break the edge handler
+        wings.add_callback("right", lambda: 1 / 0, inline=True)
+        gpio._edge(6)
+        with pytest.raises(TuxDroidWingsError):
+            wings.add_callback("right", asyncio.sleep, inline=True)
+
+    def test_callbacks_inline_demotion(self):
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, calibrate=False, gpio=gpio)
+        wings._callbacks.inline_budget = 0.001
+        threads = queue.Queue()
+
+        def slow():
+            time.sleep(0.005)
+            threads.put(threading.get_ident())
+
+        wings.add_callback("right", slow, inline=True)
+        for _ in range(3):
+            gpio._edge(6)
+            assert threads.get_nowait() == threading.get_ident()
+        stats = wings.callback_stats()["right"][0]
+        assert (stats["overruns"], stats["demoted"], stats["inline"]) == (3, True, False)
+        assert stats["max_time"] >= 0.005
+        # Now run by the thread pool
+        gpio._edge(6)
+        assert threads.get(timeout=1) != threading.get_ident()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from tuxdroid.config import validate, load_config
+from tuxdroid.errors import TuxDroidError, TuxDroidWingsError, TuxDroidHeadError, \
+    TuxDroidMouthError
+
+
+class TestConfig(object):
+
+    def test_config_validate(self):
+        config = load_config("tests/tuxdroid_test_config.yaml")
+        normalized = validate(config)
+        assert normalized['wings']['debounce']['moving_sensor'] == {"algorithm": "lockout",
+                                                                    "time": 0.1}
+        assert normalized['head']['debounce']['head_button'] == {"algorithm": "stable",
+                                                                 "time": 0.02}
+        assert normalized['head']['eyes']['startup_time'] == 0.2
+        assert normalized['wings']['brake'] == {"dead_time": 0., "time": 0.03}
+        assert 'debounce' not in config['wings']
+        config['wings']['debounce'] = {"left_button": {"time": 0.05}}
+        normalized = validate(config)
+        assert normalized['wings']['debounce']['left_button'] == {"algorithm": "stable",
+                                                                  "time": 0.05}
+        assert normalized['wings']['debounce']['right_button']['time'] == 0.02
+        del config['wings']['debounce']
+        config['wings']['gpio']['left_button'] = "5"
+        assert validate(config)['wings']['gpio']['left_button'] == 5
+
+    def test_config_all_errors(self):
+        config = load_config("tests/tuxdroid_test_config.yaml")
+        config['head']['mouth']['gpio']['motor'] = 'badid'
+        config['head']['mouth']['startup_time'] = -1
+        config['head']['mouth']['debounce'] = {"closed_sensor": {"algorithm": "integrating"}}
+        del config['wings']['gpio']['moving_sensor']
+        with pytest.raises(TuxDroidMouthError) as exp:
+            validate(config)
+        message = str(exp.value)
+        assert "head.mouth.gpio.motor" in message
+        assert "head.mouth.startup_time" in message
+        assert "head.mouth.debounce.closed_sensor.algorithm" in message
+        assert "wings.gpio.moving_sensor" in message
+        # Only wings part
+        with pytest.raises(TuxDroidWingsError) as exp:
+            validate(config, parts=('wings',))
+        assert "mouth" not in str(exp.value)
+
+    def test_config_bad_sections(self):
+        with pytest.raises(TuxDroidError) as exp:
+            validate({})
+        with pytest.raises(TuxDroidHeadError) as exp:
+            validate({"gpio": {"head_button": 12}}, "head")
+        with pytest.raises(TuxDroidWingsError) as exp:
+            validate({"gpio": None}, "wings")
+        with pytest.raises(TuxDroidWingsError) as exp:
+            validate(None, "wings")
+
+    def test_config_pin_collisions(self):
+        config = load_config("tests/tuxdroid_test_config.yaml")
+        config['head']['eyes']['gpio']['left_led'] = 5
+        with pytest.raises(TuxDroidError) as exp:
+            validate(config)
+        assert "GPIO 5 used by head.eyes.gpio.left_led, wings.gpio.left_button" \
+            in str(exp.value)
+        # No collision in one part
+        validate(config, parts=('head',))
+
+    def test_config_cache(self):
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, "config.yaml")
+        shutil.copy("tests/tuxdroid_test_config.yaml", path)
+        config = load_config(path, cache=True)
+        assert os.path.exists(os.path.join(folder, ".config.yaml.cache"))
+        assert load_config(path, cache=True) == config
+        # Cache is invalidated when the file changes
+        with open(path, "a") as fhc:
+            fhc.write("extra: 1\n")
+        assert load_config(path, cache=True)['extra'] == 1
+        shutil.rmtree(folder)
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import time
+
+import pytest
+import yaml
+
+from tuxdroid.tuxdroid import TuxDroid
+from tuxdroid.daemon import TuxDroidDaemon, format_error
+from tuxdroid.client import TuxDroidClient
+from tuxdroid.errors import TuxDroidCommandError, TuxDroidWingsError
+from tuxdroid.gpio import new_fake_gpio
+
+
+class TestDaemon(object):
+
+    def test_daemon_01(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            tux = TuxDroid(yaml.safe_load(fhc))
+        address = os.path.join(tempfile.mkdtemp(), "tuxdroid.sock")
+        daemon = TuxDroidDaemon(tux, address)
+        daemon.start()
+        client = TuxDroidClient(address)
+
+        # Simple commands
+        assert client.execute("eyes.led_on", "left", timeout=5) is None
+        assert tux.head.eyes.led_left == True
+        state = client.state(timeout=5)
+        assert state["wings"] == "DOWN"
+        assert state["led_left"] == True
+
+        # Pipelined commands
+        with client.pipeline() as pipe:
+            led_off = pipe.call("eyes.led_off")
+            wings_up = pipe.call("wings.up")
+            bad = pipe.call("bad.command")
+            bad_args = pipe.call("eyes.led_on", 1, 2, 3)
+            bad_cmd = pipe.call(["eyes.led_on"])
+        assert led_off.result(5) is None
+        assert wings_up.result(10) is None
+        assert tux.wings.position == "UP"
+        with pytest.raises(TuxDroidCommandError) as exp:
+            bad.result(5)
+        with pytest.raises(TuxDroidCommandError) as exp:
+            bad_args.result(5)
+        with pytest.raises(TuxDroidCommandError) as exp:
+            bad_cmd.result(5)
+        assert "should be a string" in str(exp.value)
+
+        # Events
+        events = []
+        client.add_event_callback(events.append)
+        tux.head._button_detected(tux.head._head_button)
+        for _ in range(50):
+            if events:
+                break
+            time.sleep(0.1)
+        assert events == ["head.button"]
+        client.del_event_callback(events.append)
+
+        client.close()
+        with pytest.raises(TuxDroidCommandError) as exp:
+            client.call("state")
+        daemon.shutdown()
+        assert not os.path.exists(address)
+        tux.stop()
+
+    def test_daemon_wings_only(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            tux = TuxDroid(yaml.safe_load(fhc), lazy=True, parts=("wings",), calibrate=False)
+        address = os.path.join(tempfile.mkdtemp(), "tuxdroid.sock")
+        daemon = TuxDroidDaemon(tux, address)
+        daemon.start()
+        client = TuxDroidClient(address)
+        events = []
+        client.add_event_callback(events.append)
+        # Lazy parts are not built to subscribe
+        assert tux._wings is None
+        assert client.execute("thermal", timeout=5) == {}
+        # Events of parts built later are sent
+        tux.wings._button_detected(tux.wings._left_button)
+        for _ in range(50):
+            if events:
+                break
+            time.sleep(0.1)
+        assert events == ["wings.left"]
+        client.close()
+        daemon.shutdown()
+        tux.stop()
+
+    def test_daemon_remote_stop(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            tux = TuxDroid(yaml.safe_load(fhc), lazy=True, calibrate=False, gpio=new_fake_gpio())
+        cleanups = []
+        tux.gpio.cleanup = lambda: cleanups.append(True)
+        address = os.path.join(tempfile.mkdtemp(), "tuxdroid.sock")
+        daemon = TuxDroidDaemon(tux, address)
+        daemon.start()
+        client = TuxDroidClient(address)
+        client.execute("wings.start", timeout=5)
+        assert tux.wings.is_moving
+        # A client stops the motors, not the robot shared with other clients
+        client.execute("stop", timeout=5)
+        assert not tux.wings.is_moving
+        assert tux._head is None
+        assert cleanups == []
+        assert client.execute("wings.start", timeout=5) is None
+        client.close()
+        daemon.shutdown()
+        tux.stop()
+        assert cleanups == [True]
+
+    def test_daemon_format_error(self):
+        assert format_error(TuxDroidWingsError("Bad `%s`", "side")) == "Bad `side`"
+        assert format_error(TuxDroidWingsError("Bad side")) == "Bad side"
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from tuxdroid.debounce import Debouncer, DebouncerSet
+from tuxdroid.errors import TuxDroidError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.wings import Wings
+
+
+class TestDebounce(object):
+
+    def test_debounce_lockout(self):
+        debouncer = Debouncer(None, "lockout", 0.1)
+        edges = (0, 0.01, 0.05, 0.09, 0.1, 0.15, 0.3)
+        assert [debouncer.accept(edge) for edge in edges] == \
+            [True, False, False, False, True, False, True]
+        stats = debouncer.stats()
+        assert stats['accepted'] == 3
+        assert stats['rejected'] == 4
+        assert stats['shortest_interval'] == pytest.approx(0.01)
+        assert stats['longest_rejected_interval'] == pytest.approx(0.09)
+
+    def test_debounce_stable(self):
+        debouncer = Debouncer(None, "stable", 0.02)
+        # A long bounce burst only gives one edge
+        edges = (0, 0.015, 0.03, 0.045, 0.1, 0.11, 0.2)
+        assert [debouncer.accept(edge) for edge in edges] == \
+            [True, False, False, False, True, False, True]
+        assert debouncer.stats()['rejected_ratio'] == pytest.approx(4 / 7)
+        debouncer.reset()
+        assert debouncer.stats()['accepted'] == 0
+        assert debouncer.accept(0.115)
+
+    def test_debounce_callback(self):
+        calls = []
+        clock = iter((1, 1.001, 2)).__next__
+        debouncer = Debouncer(calls.append, "lockout", 0.02, clock=clock)
+        for _ in range(3):
+            debouncer(17)
+        assert calls == [17, 17]
+
+    def test_debounce_bad_algorithm(self):
+        with pytest.raises(TuxDroidError):
+            Debouncer(None, "integrating")
+
+    def test_debounce_release(self):
+        levels = []
+        debouncer = Debouncer(None, "stable", 0.02, pressed=lambda: levels[-1])
+        assert debouncer.accept(0)
+        levels.append(True)
+        debouncer.settle()
+        # Release bounces after a hold
+        assert [debouncer.accept(edge) for edge in (0.5, 0.505, 0.51)] == [False] * 3
+        levels.append(False)
+        assert debouncer.settle() is False
+        assert debouncer.accept(0.7)
+        levels.append(True)
+        debouncer.settle()
+        # Press after a release without bounces
+        assert not debouncer.accept(1.2)
+        assert debouncer.settle() is True
+        stats = debouncer.stats()
+        assert (stats['accepted'], stats['rejected'], stats['releases']) == (3, 3, 1)
+
+    def test_debounce_double_press(self):
+        config = {"gpio": {"left_button": 5, "right_button": 6, "moving_sensor": 26,
+                           "motor_direction_1": 19, "motor_direction_2": 13}}
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": config})
+        wings = Wings(config, calibrate=False, gpio=gpio)
+        presses = []
+        wings._button_detected = presses.append
+        wings._set_callbacks()
+
+        def bounces(level):
+            gpio.levels[5] = level
+            for _ in range(3):
+                gpio._edge(5)
+            time.sleep(0.06)
+
+        # Press, release and press again within a double press time
+        gpio.levels[5] = gpio.HIGH
+        gpio._edge(5)
+        # Delivered right away
+        assert presses == [5]
+        bounces(gpio.HIGH)
+        bounces(gpio.LOW)
+        bounces(gpio.HIGH)
+        assert presses == [5, 5]
+        assert wings.debounce_stats()["left_button"]["releases"] == 1
+
+    def test_debounce_set(self):
+        debouncers = DebouncerSet({"left_button": {"algorithm": "lockout", "time": 0.25}})
+        debouncer = debouncers.add("left_button", None)
+        assert (debouncer.algorithm, debouncer.bounce_time) == ("lockout", 0.25)
+        debouncer.accept(1)
+        assert debouncers.stats()["left_button"]["accepted"] == 1
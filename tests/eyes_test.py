@@ -1,3 +1,4 @@
+from concurrent.futures import Future
 import time
 from unittest.mock import MagicMock
 
@@ -7,6 +8,7 @@ from tuxdroid.head import Head
 from tuxdroid.eyes import Eyes
 from tuxdroid.gpio import GPIO
 from tuxdroid.errors import TuxDroidEyesError
+from tuxdroid.scheduler import get_scheduler
 
 
 class TestTuxEyes(object):
@@ -120,3 +122,34 @@ class TestTuxEyes(object):
                            }}
         with pytest.raises(TuxDroidEyesError) as exp:
             Eyes(fake_head, config)
+
+    def test_tux_eyes_led_blink(self):
+        config = {"gpio": {"opened_sensor": 7,
+                           "closed_sensor": 8,
+                           "motor": 25,
+                           "left_led": 23,
+                           "right_led": 24,
+                           },
+                  }
+        eyes = Eyes(MagicMock(), config)
+        start = time.time()
+        done = eyes.led_blink(2, "left", interval=0.05, wait=False)
+        assert eyes.led_left == False
+        time.sleep(0.07)
+        assert eyes.led_left == True
+        assert done.result(1) is None
+        assert eyes.led_left == False
+        eyes.led_blink(1, interval=0.01)
+        assert time.time() - start < 0.5
+        # Waiting from the scheduler thread would deadlock
+        called = Future()
+
+        def from_scheduler():
+            try:
+                called.set_result(eyes.led_blink(1, interval=0.01))
+            except TuxDroidEyesError as exp:
+                called.set_exception(exp)
+
+        get_scheduler().call_later(0, from_scheduler)
+        with pytest.raises(TuxDroidEyesError):
+            called.result(1)
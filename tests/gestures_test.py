@@ -0,0 +1,107 @@
+import functools
+import queue
+import time
+
+import pytest
+
+from tuxdroid.callbacks import Event
+from tuxdroid.errors import TuxDroidGestureError
+from tuxdroid.gestures import GestureRecognizer
+from tuxdroid.scheduler import Scheduler
+
+
+class TestGestures(object):
+
+    def setup_method(self, method):
+        self.events = []
+        self.scheduler = Scheduler()
+        self.recognizer = GestureRecognizer(0.05, 0.15, 0.02, scheduler=self.scheduler)
+        self.held = False
+        self.recognizer.add_button("wings.left", lambda: self.held)
+        self.recognizer.add_button("wings.right", lambda: self.held)
+        self.recognizer.add_button("head")
+        for event in self.recognizer.events():
+            def callback(event=event):
+                self.events.append(event)
+            self.recognizer.add_callback(event, callback)
+
+    def teardown_method(self, method):
+        self.scheduler.shutdown()
+
+    def wait(self, delay=0.25):
+        time.sleep(delay)
+        return self.events
+
+    def test_gestures_press(self):
+        self.recognizer.press("head")
+        # Press waits for a second one
+        assert self.events == []
+        assert self.wait() == ["head.press"]
+
+    def test_gestures_double_press(self):
+        self.recognizer.press("wings.left")
+        self.recognizer.press("wings.left")
+        assert self.wait() == ["wings.left.double_press"]
+
+    def test_gestures_long_press(self):
+        self.held = True
+        self.recognizer.press("wings.right")
+        assert self.wait() == ["wings.right.long_press"]
+        # Released before the long press delay
+        self.events.clear()
+        self.recognizer.press("wings.right")
+        time.sleep(0.08)
+        self.held = False
+        assert self.wait() == ["wings.right.press"]
+
+    def test_gestures_combo(self):
+        self.recognizer.press("wings.right")
+        self.recognizer.press("wings.left")
+        assert self.wait() == ["wings.left+wings.right"]
+        # Too late for a combo
+        self.events.clear()
+        start = time.monotonic()
+        self.recognizer.press("head", start)
+        self.recognizer.press("wings.left", start + 0.03)
+        assert sorted(self.wait()) == ["head.press", "wings.left.press"]
+
+    def test_gestures_errors(self):
+        with pytest.raises(TuxDroidGestureError):
+            self.recognizer.press("tail")
+        with pytest.raises(TuxDroidGestureError):
+            self.recognizer.add_callback("head.triple_press", lambda: None)
+        with pytest.raises(TuxDroidGestureError):
+            self.recognizer.add_callback("head+tail", lambda: None)
+        with pytest.raises(TuxDroidGestureError) as exp:
+            self.recognizer.add_callback("head.press", "not callable")
+        assert str(exp.value) == "Callback `not callable` is not callable"
+        with pytest.raises(TuxDroidGestureError):
+            GestureRecognizer(0.5, 0.2)
+
+    def test_gestures_any_callable(self):
+        calls = queue.Queue()
+
+        class Listener(object):
+            def method(self, event):
+                calls.put(("method", event))
+
+        async def coroutine(event):
+            calls.put(("coroutine", event))
+
+        listener = Listener()
+        self.recognizer.add_callback("head.double_press", listener.method)
+        self.recognizer.add_callback("head.double_press",
+                                     functools.partial(calls.put, ("partial", None)))
+        subscription = self.recognizer.add_callback("head.double_press", coroutine)
+        self.recognizer.press("head")
+        self.recognizer.press("head")
+        received = dict(calls.get(timeout=1) for _ in range(3))
+        assert received["partial"] is None
+        for name in ("method", "coroutine"):
+            assert isinstance(received[name], Event)
+            assert (received[name].component, received[name].position) == \
+                ("head.double_press", None)
+        assert subscription.unsubscribe() is True
+        self.recognizer.del_callback("head.double_press", listener.method)
+        # Events of buttons added later
+        self.recognizer.add_callback("tail.press", listener.method)
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from tuxdroid.errors import TuxDroidWingsError
+from tuxdroid.gpio import FakeFaults, new_fake_gpio
+from tuxdroid.tuxdroid import TuxDroid
+
+
+CONFIG = {"wings": {"gpio": {"left_button": 5,
+                             "right_button": 6,
+                             "moving_sensor": 26,
+                             "motor_direction_1": 19,
+                             "motor_direction_2": 13,
+                             }
+                    }
+          }
+
+
+class TestFakeGPIO(object):
+
+    def run_motor(self, faults, duration=0.2):
+        gpio = new_fake_gpio(faults)
+        gpio.set_config_(CONFIG)
+        edges = []
+        gpio.add_event_detect(26, gpio.RISING, callback=lambda gpio_id: edges.append(time.time()))
+        gpio.output(19, gpio.HIGH)
+        time.sleep(duration)
+        gpio.output(19, gpio.LOW)
+        return edges
+
+    def test_fake_faults(self):
+        with pytest.raises(ValueError):
+            FakeFaults(jitter_distribution="bad")
+        # Faster motors
+        assert len(self.run_motor(FakeFaults(time_scale=0.1))) >= 4
+        # Dropped edges
+        faults = FakeFaults(drop=1., time_scale=0.1)
+        assert self.run_motor(faults) == []
+        assert faults.stats["dropped"] >= 4
+        # Stuck sensor
+        faults = FakeFaults(stuck=["wings.moving_sensor"], time_scale=0.1)
+        assert self.run_motor(faults) == []
+        assert faults.stats["stuck"] >= 4
+        # Bounce bursts
+        faults = FakeFaults(bounce=1., bounce_count=2, time_scale=0.1)
+        edges = self.run_motor(faults)
+        assert len(edges) >= 8
+        assert faults.stats["bounces"] >= 4
+        # Slow motor
+        faults = FakeFaults(slow_motors={"wings": 10.}, time_scale=0.1)
+        assert len(self.run_motor(faults)) <= 2
+
+    def test_fake_faults_jitter(self):
+        for distribution in ("gauss", "uniform", "exponential"):
+            faults = FakeFaults(jitter=0.01, jitter_distribution=distribution, seed=1)
+            delays = [faults.delay("wings", 0.1) for _ in range(100)]
+            assert min(delays) >= 0
+            assert len(set(delays)) > 1
+            # Repeatable runs
+            other = FakeFaults(jitter=0.01, jitter_distribution=distribution, seed=1)
+            assert delays == [other.delay("wings", 0.1) for _ in range(100)]
+        assert FakeFaults(seed=1).delay("wings", 0.1) == 0.1
+
+    def test_fake_faults_stuck_wings(self):
+        config = dict(CONFIG, safety={"max_motor_time": 0.3, "watchdog_interval": 0.02})
+        gpio = new_fake_gpio()
+        tux = TuxDroid(config, parts=("wings",), gpio=gpio)
+        tux.start_watchdog()
+        gpio.set_faults_(FakeFaults(stuck=["wings.moving_sensor"]))
+        # Stuck moving sensor is caught by the watchdog
+        with pytest.raises(TuxDroidWingsError):
+            tux.wings.up()
+        assert tux.watchdog.tripped
+        gpio.set_faults_(None)
+        tux.watchdog.reset()
+        tux.wings.up()
+        assert tux.wings.position == "UP"
+        tux.stop()
@@ -0,0 +1,78 @@
+import os
+import struct
+
+from tuxdroid.commands import Dispatcher
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.inputs import GPLEV0, InputMap, RegisterReader, open_register_reader
+from tuxdroid.tuxdroid import TuxDroid
+
+
+CONFIG = os.path.join(os.path.dirname(__file__), "tuxdroid_test_config.yaml")
+
+
+class InputOnlyGPIO(object):
+    """Backend without bulk read"""
+    HIGH = 1
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.reads = 0
+
+    def input(self, channel):
+        self.reads += 1
+        return self.levels.get(channel, 0)
+
+
+class TestInputs(object):
+
+    def test_inputs_fake(self):
+        gpio = new_fake_gpio()
+        tux = TuxDroid(CONFIG, lazy=True, calibrate=False, gpio=gpio)
+        gpio.levels.update({26: gpio.HIGH, 8: gpio.HIGH, 20: gpio.HIGH, 5: gpio.LOW})
+        inputs = tux.read_inputs()
+        assert inputs.names == ("wings.left_button", "wings.right_button",
+                                "wings.moving_sensor", "head.head_button",
+                                "eyes.opened_sensor", "eyes.closed_sensor",
+                                "mouth.opened_sensor", "mouth.closed_sensor")
+        assert inputs.bits == 0b10100100
+        assert inputs["eyes.closed_sensor"] is True
+        assert inputs["wings.left_button"] is False
+        assert tux.input_levels()["mouth.closed_sensor"] is True
+        assert Dispatcher(tux).call("inputs")["wings.moving_sensor"] is True
+        # Only inputs of enabled parts
+        tux = TuxDroid(CONFIG, parts=("wings",), calibrate=False, gpio=gpio)
+        assert tux.read_inputs().names == ("wings.left_button", "wings.right_button",
+                                           "wings.moving_sensor")
+
+    def test_inputs_fallbacks(self, tmpdir):
+        config = {"wings": {"gpio": {"left_button": 5, "moving_sensor": 26}},
+                  "volume": {"gpio": {"up_button": 40}}}
+        input_map = InputMap(config, ("wings",))
+        assert input_map.names == ("wings.left_button", "wings.moving_sensor",
+                                   "volume.up_button")
+        # One input call per pin
+        gpio = InputOnlyGPIO({26: 1, 40: 1})
+        assert input_map.read(gpio).bits == 0b110
+        assert gpio.reads == 3
+        # GPIO level registers, GPIO 40 is in the second register
+        path = str(tmpdir.join("gpiomem"))
+        with open(path, "wb") as fhd:
+            fhd.write(bytes(4096))
+        reader = RegisterReader(path)
+        reader._map[GPLEV0:GPLEV0 + 8] = struct.pack("<II", 1 << 5, 1 << (40 - 32))
+        gpio = InputOnlyGPIO({})
+        assert input_map.read(gpio, reader).bits == 0b101
+        assert gpio.reads == 0
+        reader.close()
+        assert open_register_reader(str(tmpdir.join("missing"))) is None
+
+    def test_inputs_remote_backend(self):
+        # Other backends are read pin by pin, even on a Raspberry Pi
+        gpio = InputOnlyGPIO({26: 1})
+        gpio.BCM = gpio.IN = gpio.OUT = gpio.PUD_UP = gpio.LOW = 0
+        gpio.setmode = gpio.setup = gpio.output = lambda *args, **kwargs: None
+        tux = TuxDroid(CONFIG, lazy=True, calibrate=False, gpio=gpio)
+        inputs = tux.read_inputs()
+        assert inputs["wings.moving_sensor"] is True
+        assert tux._register_reader is None
+        assert gpio.reads == len(inputs.names)
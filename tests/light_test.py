@@ -0,0 +1,156 @@
+import array
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from tuxdroid import light
+from tuxdroid.errors import TuxDroidEyesError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.light import FakeLight, LightSensor, RingBuffer
+from tuxdroid.tuxdroid import TuxDroid
+
+
+class TestLight(object):
+
+    @staticmethod
+    def check_ring_buffer():
+        ring = RingBuffer(4)
+        assert ring.stats()["count"] == 0
+        for value in (1., 2., 3.):
+            ring.append(value)
+        assert list(ring.values()) == [1., 2., 3.]
+        for value in (4., 5., 6.):
+            ring.append(value)
+        assert list(ring.values()) == [3., 4., 5., 6.]
+        stats = ring.stats()
+        assert stats["count"] == 4
+        assert stats["mean"] == 4.5
+        assert stats["std"] == pytest.approx(1.118, abs=0.001)
+        assert (stats["min"], stats["max"], stats["last"]) == (3., 6., 6.)
+        return ring
+
+    def test_light_ring_buffer(self, monkeypatch):
+        monkeypatch.setattr(light, "numpy", None)
+        ring = self.check_ring_buffer()
+        assert isinstance(ring._data, array.array)
+
+    def test_light_ring_buffer_numpy(self, monkeypatch):
+        numpy = pytest.importorskip("numpy")
+        monkeypatch.setattr(light, "numpy", numpy)
+        ring = self.check_ring_buffer()
+        assert isinstance(ring._data, numpy.ndarray)
+
+    def test_light_lazy_import(self):
+        # A Head without photodetector does not load the sampler nor NumPy
+        code = ("import sys; from tuxdroid.tuxdroid import TuxDroid; "
+                "from tuxdroid.gpio import new_fake_gpio; "
+                "tux = TuxDroid('tests/tuxdroid_test_config.yaml', parts=('head',), "
+                "calibrate=False, gpio=new_fake_gpio()); "
+                "assert 'tuxdroid.light' not in sys.modules; "
+                "assert 'numpy' not in sys.modules")
+        subprocess.check_call([sys.executable, "-c", code])
+
+    def test_light_events(self):
+        now = [0.]
+        source = FakeLight(0.8)
+        sensor = LightSensor(source.read, period=0.02, window=1., wave_time=0.5,
+                             clock=lambda: now[0])
+        events = []
+        done = threading.Semaphore(0)
+        for event in light.EVENTS:
+            sensor.add_callback(event, lambda event=event: (events.append(event),
+                                                            done.release()))
+        with pytest.raises(TuxDroidEyesError):
+            sensor.add_callback("bad", print)
+
+        def run(level, duration):
+            source.level = level
+            for _ in range(int(round(duration / 0.02))):
+                now[0] += 0.02
+                sensor.sample()
+
+        run(0.8, 1.)
+        assert sensor.is_dark == False
+        # Short dip, even under the dark level
+        run(0.1, 0.2)
+        run(0.8, 0.2)
+        assert done.acquire(timeout=1)
+        assert events == ["hand_wave"]
+        # Lights off
+        run(0.05, 1.)
+        assert done.acquire(timeout=1)
+        assert events[-1] == "lights_off"
+        assert sensor.is_dark == True
+        # Lights on, with hysteresis
+        run(0.22, 0.2)
+        assert sensor.is_dark == True
+        run(0.6, 0.2)
+        assert done.acquire(timeout=1)
+        assert events[-1] == "lights_on"
+        # Slow dimming is not an event
+        for level in (0.55, 0.5, 0.45, 0.4, 0.35):
+            run(level, 0.4)
+        run(0.35, 1.)
+        assert events == ["hand_wave", "lights_off", "lights_on"]
+        stats = sensor.stats()
+        assert stats["count"] == 50
+        assert stats["last"] == 0.35
+        assert stats["samples"] == sensor.samples
+
+    def test_light_event_payload(self):
+        now = [0.]
+        source = FakeLight(0.8)
+        sensor = LightSensor(source.read, period=0.02, clock=lambda: now[0])
+        events = queue.Queue()
+        subscription = sensor.add_callback("lights_off", events.put)
+        for level in (0.8, 0.05):
+            source.level = level
+            for _ in range(50):
+                now[0] += 0.02
+                sensor.sample()
+        event = events.get(timeout=1)
+        assert (event.component, event.sequence) == ("light.lights_off", 1)
+        assert subscription.unsubscribe()
+        assert not subscription.active
+
+    def test_light_eyes(self):
+        config = {"head": {"gpio": {"head_button": 12},
+                           "mouth": {"gpio": {"opened_sensor": 21,
+                                              "closed_sensor": 20,
+                                              "motor": 16,
+                                              },
+                                     },
+                           "eyes": {"gpio": {"opened_sensor": 7,
+                                             "closed_sensor": 8,
+                                             "motor": 25,
+                                             "left_led": 23,
+                                             "right_led": 24,
+                                             "photodetector": 4,
+                                             },
+                                    "light": {"period": 0.01},
+                                    },
+                           },
+                  }
+        gpio = new_fake_gpio()
+        gpio.levels[4] = gpio.HIGH
+        tux = TuxDroid(config, parts=("head",), calibrate=False, gpio=gpio)
+        sensor = tux.head.eyes.start_light_sensor()
+        assert sensor.is_running
+        time.sleep(0.1)
+        assert sensor.stats()["last"] == 1.
+        assert sensor.stats()["count"] >= 5
+        tux.stop()
+        assert not sensor.is_running
+        # No photodetector GPIO
+        del config["head"]["eyes"]["gpio"]["photodetector"]
+        tux = TuxDroid(config, parts=("head",), calibrate=False, gpio=new_fake_gpio())
+        with pytest.raises(TuxDroidEyesError):
+            tux.head.eyes.start_light_sensor()
+        sensor = tux.head.eyes.start_light_sensor(FakeLight(0.5).read)
+        time.sleep(0.05)
+        assert sensor.stats()["last"] == 0.5
+        tux.stop()
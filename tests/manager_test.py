@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+import yaml
+
+from tuxdroid.errors import TuxDroidError, TuxDroidCommandError
+from tuxdroid.manager import TuxDroidManager
+
+
+class VirtualClock(object):
+    """Monotonic clock advanced by sleeps and motor start latencies only
+
+    Each thread has its own time, the main thread moves `now`
+    """
+
+    def __init__(self):
+        self.now = 1000.
+        self._local = threading.local()
+
+    def __call__(self):
+        return getattr(self._local, "now", self.now)
+
+    def sleep_until(self, deadline):
+        self._local.now = max(deadline, self.now)
+
+    def fake_start(self, wings, latency):
+        """Replace the wings start by a motor starting after `latency`"""
+        def start():
+            self._local.now = self() + latency
+            wings.motor_started_at = self()
+        wings.start = start
+
+
+class TestManager(object):
+
+    def get_config(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            return yaml.safe_load(fhc)
+
+    def test_manager_broadcast(self):
+        manager = TuxDroidManager()
+        for name in ("tux1", "tux2", "tux3"):
+            manager.create(name, self.get_config(), calibrate=False)
+        assert manager.names == ("tux1", "tux2", "tux3")
+        assert len(manager) == 3
+        # Each robot has its own GPIO backend
+        assert manager["tux1"].gpio is not manager["tux2"].gpio
+        assert manager.broadcast("eyes.led_off") == {"tux1": None, "tux2": None, "tux3": None}
+        manager.broadcast("eyes.led_on", ["right"], names=("tux1", "tux3"))
+        state = manager.state()
+        assert state["tux1"]["led_right"] == True
+        assert state["tux2"]["led_right"] == False
+        assert manager["tux3"].gpio.outputs[24] == manager["tux3"].gpio.HIGH
+        assert manager["tux2"].gpio.outputs[24] == manager["tux2"].gpio.LOW
+        # Robots move independently
+        manager.broadcast("wings.up", names=("tux2",))
+        assert manager["tux2"].wings.position == "UP"
+        assert manager["tux1"].wings.is_calibrated == False
+        futures = manager.broadcast("wings.move", [1], names=("tux1", "tux2"), wait=False)
+        assert [future.result(10) for future in futures.values()] == [None, None]
+        manager.emergency_stop()
+        manager.stop()
+
+    def test_manager_errors(self):
+        manager = TuxDroidManager()
+        manager.create("tux1", self.get_config(), calibrate=False)
+        manager.create("head_only", self.get_config(), parts=('head',), calibrate=False)
+        with pytest.raises(TuxDroidError):
+            manager.create("tux1", self.get_config())
+        with pytest.raises(TuxDroidError):
+            manager.broadcast("eyes.led_on", names=("tux9",))
+        with pytest.raises(TuxDroidCommandError) as exp:
+            manager.broadcast("wings.stop")
+        assert "head_only" in str(exp.value)
+        assert "tux1" not in str(exp.value)
+        manager.remove("head_only")
+        with pytest.raises(TuxDroidError):
+            manager.remove("head_only")
+        manager.stop()
+
+    def test_manager_group(self):
+        clock = VirtualClock()
+        manager = TuxDroidManager(clock, clock.sleep_until)
+        for name in ("tux1", "tux2", "tux3"):
+            manager.create(name, self.get_config(), parts=('wings',), calibrate=False)
+        # tux2 motor driver is slow to start
+        for name, latency in (("tux1", 0.), ("tux2", 0.03), ("tux3", 0.001)):
+            clock.fake_start(manager[name].wings, latency)
+        report = manager.group("wings.start", delay=0.05)
+        assert set(report["offsets"]) == {"tux1", "tux2", "tux3"}
+        assert report["offsets"]["tux2"] == pytest.approx(0.03)
+        assert report["skew"] == pytest.approx(0.03)
+        # Latency is learnt and compensated: motors start at the deadline
+        assert manager.latencies()[("tux2", "wings.start")] == pytest.approx(0.03)
+        for _ in range(3):
+            clock.now += 1
+            report = manager.group("wings.start", delay=0.05)
+            assert report["skew"] == pytest.approx(0., abs=1e-9)
+            assert all(offset == pytest.approx(0., abs=1e-9)
+                       for offset in report["offsets"].values())
+        assert report["results"] == {"tux1": None, "tux2": None, "tux3": None}
+        # Commands without motor
+        clock.now += 1
+        report = manager.group("wings.stop")
+        assert report["skew"] == pytest.approx(0., abs=1e-9)
+        manager.stop()
+
+    def test_manager_group_wall_clock(self):
+        manager = TuxDroidManager()
+        for name in ("tux1", "tux2"):
+            manager.create(name, self.get_config(), parts=('wings',), calibrate=False)
+        manager.broadcast("wings.up")
+        report = manager.group("wings.start", delay=0.05)
+        assert report["results"] == {"tux1": None, "tux2": None}
+        assert all(offset >= 0 for offset in report["offsets"].values())
+        manager.broadcast("wings.stop")
+        manager.stop()
@@ -0,0 +1,129 @@
+import array
+import os
+import queue
+import random
+import threading
+import wave
+
+import pytest
+
+from tuxdroid import microphone
+from tuxdroid.errors import TuxDroidMicrophoneError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.microphone import Microphone, VoiceDetector, WavSource, block_level
+from tuxdroid.speaker import tone
+from tuxdroid.tuxdroid import TuxDroid
+
+
+def noise(duration, level=0.002, rate=16000, seed=1):
+    """Get signed 16 bits little endian noise"""
+    generator = random.Random(seed)
+    samples = array.array("h", (int(generator.gauss(0., level * 32767))
+                                for _ in range(int(rate * duration))))
+    return samples.tobytes()
+
+
+def write_recording(path, parts):
+    """Write a 16kHz mono wav file"""
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        for part in parts:
+            wav.writeframes(part)
+
+
+class TestMicrophone(object):
+
+    def test_microphone_level(self, monkeypatch):
+        data = b"".join(tone(440, 0.1, volume=0.5))
+        levels = []
+        for numpy in (microphone.numpy, None):
+            monkeypatch.setattr(microphone, "numpy", numpy)
+            assert block_level(b"") == 0.
+            levels.append(block_level(data))
+        # RMS of a sine wave
+        assert levels[0] == pytest.approx(0.5 / 2 ** 0.5, abs=0.01)
+        assert levels[0] == pytest.approx(levels[1], abs=1e-5)
+
+    def test_microphone_detector(self):
+        detector = VoiceDetector(block_time=0.02, threshold=0.02, start_time=0.06,
+                                 stop_time=0.2)
+        blocks = [noise(0.02, seed=index) for index in range(20)]
+        blocks += list(tone(440, 0.5, volume=0.3, chunk_frames=320))
+        blocks += [noise(0.02, seed=index) for index in range(20)]
+        events = [(index, event) for index, event in enumerate(map(detector.process, blocks))
+                  if event is not None]
+        # 3 blocks of speech to start, 10 blocks of silence to stop
+        assert events == [(22, "speech_start"), (54, "speech_stop")]
+        assert detector.floor < 0.005
+        # Noise floor adapts to a loud background
+        detector = VoiceDetector(threshold=0.01)
+        loud_noise = [noise(0.02, level=0.02, seed=index) for index in range(50)]
+        assert [detector.process(block) for block in loud_noise] == [None] * 50
+
+    def test_microphone_noise_step(self):
+        detector = VoiceDetector(block_time=0.02, threshold=0.02, start_time=0.06,
+                                 stop_time=0.2)
+        # Quiet, a fan starting for 6s, then quiet again
+        blocks = [noise(0.02, seed=index) for index in range(50)]
+        blocks += [noise(0.02, level=0.05, seed=index) for index in range(300)]
+        blocks += [noise(0.02, seed=index) for index in range(50)]
+        events = [(index, event) for index, event in enumerate(map(detector.process, blocks))
+                  if event is not None]
+        # Taken for speech at first, the floor catches up within the step
+        assert [event for _, event in events] == ["speech_start", "speech_stop"]
+        assert events[0][0] < 55
+        assert events[1][0] < 350
+        assert not detector.is_speech
+        assert detector.floor < 0.005
+
+    def test_microphone_wav(self, tmpdir):
+        path = os.path.join(str(tmpdir), "speech.wav")
+        write_recording(path, [noise(0.4), b"".join(tone(300, 0.6)), noise(0.6),
+                               b"".join(tone(300, 0.3))])
+        mic = Microphone(WavSource(path, realtime=False))
+        events = []
+        done = threading.Semaphore(0)
+        for event in microphone.EVENTS:
+            mic.add_callback(event, lambda event=event: (events.append(event), done.release()))
+        with pytest.raises(TuxDroidMicrophoneError):
+            mic.add_callback("noise", print)
+        payloads = queue.Queue()
+        subscription = mic.add_callback("speech_start", payloads.put)
+        mic.start()
+        assert mic.wait(5)
+        for _ in range(4):
+            assert done.acquire(timeout=1)
+        # Speech is closed at the end of the file
+        assert events == ["speech_start", "speech_stop"] * 2
+        first = payloads.get(timeout=1)
+        assert (first.component, first.sequence) == ("microphone.speech_start", 1)
+        # Timestamp of the captured block
+        assert first.timestamp <= payloads.get(timeout=1).timestamp
+        assert subscription.unsubscribe()
+        stats = mic.stats()
+        assert stats["blocks"] == 95
+        assert stats["overruns"] == 0
+        assert stats["max_process_time"] < stats["block_time"]
+        assert not mic.is_running
+        mic.stop()
+
+    def test_microphone_reactions(self, tmpdir):
+        path = os.path.join(str(tmpdir), "speech.wav")
+        write_recording(path, [noise(0.2), b"".join(tone(300, 0.4)), noise(0.6)])
+        config = os.path.join(os.path.dirname(__file__), "tuxdroid_test_config.yaml")
+        tux = TuxDroid(config, parts=("head",), calibrate=False, gpio=new_fake_gpio())
+        assert (tux.head.eyes.led_left, tux.head.eyes.led_right) == (True, None)
+        mic = tux.start_microphone(WavSource(path, realtime=True))
+        lit = []
+        while not mic.wait(0.01):
+            lit.append(tux.head.eyes.led_right)
+        # Both eyes lit while speaking, then restored
+        assert True in lit
+        assert not tux.head.eyes.led_right
+        tux.stop()
+        stats = mic.stats()
+        # Callbacks run right after the block which triggered them
+        assert stats["max_latency"] < 0.05
+        assert (tux.head.eyes.led_left, tux.head.eyes.led_right) == (False, False)
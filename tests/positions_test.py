@@ -0,0 +1,64 @@
+import pytest
+
+from tuxdroid.errors import TuxDroidWingsError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.positions import EYELID, WINGS, Position, StateMachine
+from tuxdroid.wings import Wings
+
+
+class TestPositions(object):
+
+    def test_position(self):
+        assert Position.UP == "UP"
+        assert "{} {}".format(Position.OPENED, Position.CLOSED) == "OPENED CLOSED"
+        assert {"UP": 1}[Position.UP] == 1
+        assert WINGS.position("up") is Position.UP
+        assert WINGS.position("OPENED") is None
+        assert EYELID.position("closed") is Position.CLOSED
+        assert EYELID.position("BAD") is None
+        assert WINGS.events == {"moving"}
+        assert EYELID.events == {"opened", "closed"}
+
+    def test_state_machine(self):
+        machine = StateMachine(WINGS, TuxDroidWingsError)
+        transitions = []
+        hook = lambda old, event, new: transitions.append((old, event, new))
+        machine.add_hook(hook)
+        assert machine.next(Position.UP, "moving") is Position.DOWN
+        assert machine.next("DOWN", "moving") is Position.UP
+        machine.record(Position.UP, "moving", Position.DOWN)
+        assert transitions == [(Position.UP, "moving", Position.DOWN)]
+        # Invalid transitions
+        with pytest.raises(TuxDroidWingsError):
+            machine.next(None, "moving")
+        with pytest.raises(TuxDroidWingsError):
+            machine.next(Position.UP, "opened")
+        assert machine.metrics() == {"transitions": {"UP -moving-> DOWN": 1}, "invalid": 2}
+        # Failing hooks do not break transitions
+        machine.del_hook(hook)
+        machine.add_hook(lambda old, event, new: 1 / 0)
+        machine.record(Position.DOWN, "moving", Position.UP)
+        assert len(transitions) == 1
+        # Eyes and mouth sensors give the position
+        machine = StateMachine(EYELID, TuxDroidWingsError)
+        assert machine.next(None, "closed") is Position.CLOSED
+        assert machine.next(Position.CLOSED, "opened") is Position.OPENED
+
+    def test_wings_transitions(self):
+        config = {"gpio": {"left_button": 5,
+                           "right_button": 6,
+                           "moving_sensor": 26,
+                           "motor_direction_1": 19,
+                           "motor_direction_2": 13,
+                           }
+                  }
+        gpio = new_fake_gpio()
+        gpio.set_config_({"wings": config})
+        wings = Wings(config, gpio=gpio)
+        assert wings.position is Position.DOWN
+        wings.up()
+        assert wings.position is Position.UP
+        metrics = wings.state_machine.metrics()
+        assert metrics["transitions"] == {"DOWN -moving-> UP": 1}
+        assert metrics["invalid"] == 0
+        wings.stop().result()
@@ -0,0 +1,84 @@
+import pytest
+
+from tuxdroid.errors import TuxDroidError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.replay import (EDGE, OUTPUT, Event, GPIORecorder, ReplayGPIO,
+                             read_recording)
+from tuxdroid.wings import Wings
+
+
+CONFIG = {"gpio": {"left_button": 5,
+                   "right_button": 6,
+                   "moving_sensor": 26,
+                   "motor_direction_1": 19,
+                   "motor_direction_2": 13,
+                   }
+          }
+
+
+class TestReplay(object):
+
+    def test_replay_record(self, tmpdir):
+        path = str(tmpdir.join("session.tuxrec"))
+        gpio = GPIORecorder(new_fake_gpio(), path)
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, gpio=gpio)
+        wings.move(2)
+        wings.stop().result()
+        gpio.close()
+        events = read_recording(path)
+        assert len(events) == gpio.count
+        assert events[0] == Event(events[0].time, OUTPUT, 19, 1)
+        assert {event.channel for event in events if event.kind == EDGE} == {26}
+        times = [event.time for event in events]
+        assert times == sorted(times)
+        # Truncated record is dropped
+        with open(path, "ab") as fobj:
+            fobj.write(b"\x00\x01")
+        assert read_recording(path) == events
+        # Bad file
+        with open(path, "wb") as fobj:
+            fobj.write(b"not a recording")
+        with pytest.raises(TuxDroidError):
+            read_recording(path)
+
+    def test_replay_play(self, tmpdir):
+        path = str(tmpdir.join("session.tuxrec"))
+        gpio = GPIORecorder(new_fake_gpio(), path)
+        gpio.set_config_({"wings": CONFIG})
+        wings = Wings(CONFIG, gpio=gpio)
+        # Brake pulses are timed by the scheduler: let them end, so both runs write them
+        wings.stop().result()
+        wings.move(3)
+        wings.stop().result()
+        position = wings.position
+        gpio.close()
+        recorded = read_recording(path)
+
+        # Replayed edges drive a new Wings the same way
+        gpio = ReplayGPIO(path)
+        gpio.play()
+        wings = Wings(CONFIG, gpio=gpio)
+        wings.stop().result()
+        wings.move(3)
+        wings.stop().result()
+        assert gpio.wait(5)
+        assert gpio.mismatches == []
+        assert wings.position == position
+        outputs = [(event.channel, event.value) for event in recorded if event.kind == OUTPUT]
+        assert gpio.written[:len(outputs)] == outputs
+        gpio.cleanup()
+
+    def test_replay_mismatch(self):
+        events = [Event(0., OUTPUT, 19, 1), Event(0.01, EDGE, 5, 1), Event(0.02, EDGE, 5, 0)]
+        gpio = ReplayGPIO(events, speed=None, sync_timeout=0.05)
+        pressed = []
+        gpio.add_event_detect(5, gpio.RISING, callback=pressed.append)
+        gpio.play()
+        assert gpio.wait(1)
+        # Output never written, edges are replayed anyway
+        assert gpio.mismatches == [(19, 1)]
+        assert pressed == [5]
+        # Both edges recorded, levels follow them
+        assert gpio.input(5) == gpio.LOW
+        gpio.cleanup()
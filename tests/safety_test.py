@@ -0,0 +1,121 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+import yaml
+
+from tuxdroid.errors import TuxDroidWingsError
+from tuxdroid.gpio import GPIO
+from tuxdroid.safety import Watchdog, install_signal_handlers, motor_pins
+from tuxdroid.tuxdroid import TuxDroid
+
+
+class TestSafety(object):
+
+    def get_config(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            return yaml.safe_load(fhc)
+
+    def test_safety_motor_pins(self):
+        config = self.get_config()
+        assert motor_pins(config) == [19, 13, 16, 25]
+        del config['head']
+        assert motor_pins(config) == [19, 13]
+
+    def test_safety_emergency_stop(self):
+        tux = TuxDroid(self.get_config(), parts=('wings',), calibrate=False)
+        tux.wings.up()
+        errors = []
+        def move():
+            try:
+                tux.wings.down()
+            except TuxDroidWingsError as exp:
+                errors.append(exp)
+        thread = threading.Thread(target=move)
+        thread.start()
+        time.sleep(0.1)
+        assert tux.moving_components() == [("wings", tux.wings)]
+        tux.emergency_stop()
+        thread.join(1)
+        assert not thread.is_alive()
+        assert len(errors) == 1
+        assert GPIO.outputs[19] == GPIO.LOW
+        assert GPIO.outputs[13] == GPIO.LOW
+        assert tux.moving_components() == []
+        # Wings can move again
+        tux.wings.down()
+        assert tux.wings.position == "DOWN"
+        tux.stop()
+
+    def test_safety_emergency_stop_locked_state(self):
+        tux = TuxDroid(self.get_config(), parts=('wings',), calibrate=False)
+        tux.wings._state.update(is_moving=True)
+
+        def changes(state):
+            # Signal arriving while the main thread updates the wings state
+            tux.emergency_stop()
+            return {"count": state.count + 1}
+
+        tux.wings._state.modify(changes)
+        assert tux.wings._state.snapshot().count == 1
+        assert tux.moving_components() == []
+        tux.stop()
+
+    def test_safety_signal(self):
+        tux = TuxDroid(self.get_config(), parts=('wings',), calibrate=False)
+        tux.wings.up()
+        previous = signal.getsignal(signal.SIGUSR1)
+        self.received = False
+        def handler(signum, frame):
+            self.received = True
+        signal.signal(signal.SIGUSR1, handler)
+        install_signal_handlers(tux, (signal.SIGUSR1,))
+        tux.wings.start()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        time.sleep(0.05)
+        assert self.received
+        assert tux.wings.is_moving == False
+        assert GPIO.outputs[19] == GPIO.LOW
+        signal.signal(signal.SIGUSR1, previous)
+        tux.stop()
+
+    def test_safety_watchdog_clock_step(self, monkeypatch):
+        config = self.get_config()
+        config['safety'] = {"max_motor_time": 0.2}
+        tux = TuxDroid(config, parts=('wings',), calibrate=False)
+        tux.wings.up()
+        watchdog = Watchdog(tux, 0.2)
+        tux.wings.start()
+        # Wall clock set an hour later
+        wall_time = time.time
+        monkeypatch.setattr(time, "time", lambda: wall_time() + 3600)
+        assert watchdog.check() is None
+        monkeypatch.undo()
+        time.sleep(0.25)
+        assert "wings motor" in watchdog.check()
+        tux.stop()
+
+    def test_safety_watchdog(self):
+        config = self.get_config()
+        config['safety'] = {"max_motor_time": 0.2, "heartbeat_timeout": 0.3,
+                            "watchdog_interval": 0.01}
+        tux = TuxDroid(config, parts=('wings',), calibrate=False)
+        tux.wings.up()
+        watchdog = tux.start_watchdog()
+        tux.wings.start()
+        time.sleep(0.1)
+        assert watchdog.tripped is None
+        time.sleep(0.2)
+        assert "wings motor" in watchdog.tripped
+        assert tux.wings.is_moving == False
+        # Heartbeat
+        watchdog.reset()
+        for _ in range(5):
+            time.sleep(0.1)
+            watchdog.heartbeat()
+        assert watchdog.tripped is None
+        time.sleep(0.4)
+        assert "heartbeat" in watchdog.tripped
+        tux.stop()
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from tuxdroid.scheduler import Scheduler, get_scheduler
+
+
+class TestScheduler(object):
+
+    def setup_method(self, method):
+        self.scheduler = Scheduler()
+
+    def teardown_method(self, method):
+        self.scheduler.shutdown()
+
+    def test_scheduler_call_later(self):
+        calls = []
+        done = threading.Event()
+        self.scheduler.call_later(0.04, calls.append, 2)
+        self.scheduler.call_later(0.02, calls.append, 1)
+        self.scheduler.call_later(0.01, calls.append, 0).cancel()
+        self.scheduler.call_later(0.06, done.set)
+        assert self.scheduler.pending() == 3
+        assert done.wait(1)
+        assert calls == [1, 2]
+
+    def test_scheduler_call_every(self):
+        calls = []
+        timer = self.scheduler.call_every(0.02, lambda: calls.append(time.monotonic()))
+        time.sleep(0.11)
+        timer.cancel()
+        count = len(calls)
+        assert 4 <= count <= 6
+        time.sleep(0.05)
+        assert len(calls) == count
+        # A failing callback does not stop the scheduler
+        done = threading.Event()
+        self.scheduler.call_later(0, lambda: 1 / 0)
+        self.scheduler.call_later(0.01, done.set)
+        assert done.wait(1)
+
+    def test_scheduler_shared(self):
+        assert get_scheduler() is get_scheduler()
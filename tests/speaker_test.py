@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+import wave
+
+import pytest
+
+from tuxdroid import speaker as speaker_module
+from tuxdroid.errors import TuxDroidSpeakerError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.speaker import ByteRing, FileSink, NullSink, Speaker, get_sink, tone
+from tuxdroid.tuxdroid import TuxDroid
+
+
+class TestSpeaker(object):
+
+    def test_speaker_ring(self):
+        ring = ByteRing(8)
+        assert ring.write(b"abcdef") == 6
+        assert ring.read(4) == b"abcd"
+        # Wraps around the end of the buffer
+        assert ring.write(b"ghijkl") == 6
+        assert ring.available() == 8
+        assert ring.read(16) == b"efghijkl"
+        assert ring.read(1, timeout=0.01) == b""
+        # A full buffer blocks the writer until read or cancelled
+        ring.write(b"12345678")
+        assert ring.write(b"9", cancelled=lambda: True) == 0
+        thread = threading.Thread(target=ring.write, args=(b"90",))
+        thread.start()
+        assert ring.read(3) == b"123"
+        thread.join(1)
+        assert ring.read(16) == b"4567890"
+        ring.write(b"abc")
+        ring.discard(ring.write_offset - 1)
+        assert ring.read(16) == b"c"
+
+    def test_speaker_gapless_file(self, tmpdir):
+        path = os.path.join(str(tmpdir), "out.wav")
+        speaker = Speaker(FileSink(path), buffer_time=0.05)
+        first = speaker.play(tone(440, 0.3))
+        second = speaker.play(tone(880, 0.2))
+        assert first.wait(5) is True
+        assert second.wait(5) is True
+        assert second.start_offset == first.end_offset
+        speaker.stop()
+        with wave.open(path, "rb") as wav:
+            assert wav.getframerate() == 16000
+            assert wav.getnframes() == int(16000 * 0.5)
+            frames = wav.readframes(wav.getnframes())
+        assert frames == b"".join(tone(440, 0.3)) + b"".join(tone(880, 0.2))
+        # Wav files are played back
+        copy = os.path.join(str(tmpdir), "copy.wav")
+        speaker = Speaker(FileSink(copy))
+        assert speaker.play(path).wait(5) is True
+        speaker.stop()
+        with wave.open(copy, "rb") as wav:
+            assert wav.readframes(wav.getnframes()) == frames
+        # Wav format is checked
+        speaker = Speaker(FileSink(copy), rate=8000)
+        with pytest.raises(TuxDroidSpeakerError):
+            speaker.play(path)
+
+    def test_speaker_cancel_and_clock(self):
+        speaker = Speaker(NullSink(), buffer_time=0.1)
+        assert speaker.clock() is None
+        long = speaker.play(tone(440, 5.))
+        queued = speaker.play(tone(440, 5.))
+        last = speaker.play(tone(440, 0.2))
+        cues = []
+        cued = threading.Event()
+        last.add_cue(0.1, lambda: (cues.append(last.position()), cued.set()))
+        time.sleep(0.3)
+        assert speaker.playing() is long
+        assert 0.15 < speaker.clock() < 0.6
+        queued.cancel()
+        start = time.monotonic()
+        long.cancel()
+        assert long.wait(1) is False
+        assert queued.wait(1) is False
+        # Next sound starts right away
+        assert cued.wait(1)
+        assert time.monotonic() - start < 0.5
+        assert last.wait(1) is True
+        assert cues[0] >= 0.1
+        assert speaker.clock() is None
+        # Stop cancels the queue
+        playbacks = [speaker.play(tone(440, 5.)) for _ in range(2)]
+        speaker.stop()
+        assert [playback.wait(1) for playback in playbacks] == [False, False]
+
+    def test_speaker_gain(self, tmpdir, monkeypatch):
+        samples = b"".join(tone(440, 0.1))
+        outputs = []
+        for numpy in (speaker_module.numpy, None):
+            monkeypatch.setattr(speaker_module, "numpy", numpy)
+            path = os.path.join(str(tmpdir), "gain.wav")
+            speaker = Speaker(FileSink(path))
+            speaker.gain = 0.5
+            with pytest.raises(TuxDroidSpeakerError):
+                speaker.gain = 1.5
+            assert speaker.play([samples]).wait(5) is True
+            speaker.stop()
+            with wave.open(path, "rb") as wav:
+                outputs.append(wav.readframes(wav.getnframes()))
+        assert outputs[0] == outputs[1]
+        assert outputs[0] == b"".join(tone(440, 0.1, volume=0.25))
+
+    def test_speaker_sinks(self, tmpdir):
+        assert isinstance(get_sink("null"), NullSink)
+        with pytest.raises(TuxDroidSpeakerError):
+            get_sink("file")
+        with pytest.raises(TuxDroidSpeakerError):
+            get_sink("pulse")
+        assert get_sink("file", os.path.join(str(tmpdir), "out.wav")).path.endswith("out.wav")
+
+    def test_speaker_tuxdroid(self):
+        config = os.path.join(os.path.dirname(__file__), "tuxdroid_test_config.yaml")
+        tux = TuxDroid(config, lazy=True, calibrate=False, gpio=new_fake_gpio())
+        assert tux.config["speaker"] == {"sink": "auto", "buffer_time": 0.5,
+                                         "period_time": 0.02}
+        assert tux.speaker is tux.speaker
+        playback = tux.speaker.play(tone(440, 5.))
+        tux.stop()
+        assert playback.wait(1) is False
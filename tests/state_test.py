@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.state import ComponentState, StateCell, TuxDroidState, state_property
+from tuxdroid.tuxdroid import TuxDroid
+
+
+class Component(object):
+    position = state_property("position")
+
+    def __init__(self):
+        self._state = StateCell(position="DOWN")
+
+
+class TestState(object):
+
+    def test_state_cell(self):
+        cell = StateCell(position="UP")
+        state = cell.snapshot()
+        assert isinstance(state, ComponentState)
+        assert state.position == "UP"
+        assert state.is_moving == False
+        assert state.count == 0
+        assert state.version == 0
+        new = cell.update(is_moving=True)
+        assert new.version == 1
+        assert new.is_moving == True
+        # Snapshots are immutable
+        assert state.is_moving == False
+        with pytest.raises(AttributeError):
+            state.position = "DOWN"
+        old, new = cell.modify(lambda state: {"count": state.count + 2})
+        assert (old.count, new.count) == (0, 2)
+        # Properties
+        component = Component()
+        assert component.position == "DOWN"
+        component.position = "UP"
+        assert component._state.snapshot().position == "UP"
+
+    def test_state_concurrent(self):
+        cell = StateCell()
+        stop = threading.Event()
+        seen = []
+
+        def reader():
+            last = -1
+            while not stop.is_set():
+                state = cell.snapshot()
+                # Versions never go backward
+                assert state.version >= last
+                last = state.version
+            seen.append(last)
+
+        def writer():
+            for _ in range(2000):
+                cell.modify(lambda state: {"count": state.count + 1})
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        writers = [threading.Thread(target=writer) for _ in range(4)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in readers:
+            thread.join()
+        # No lost count
+        assert cell.snapshot().count == 8000
+        assert cell.snapshot().version == 8000
+        assert len(seen) == 4
+
+    def test_state_stop_concurrent(self):
+        cell = StateCell(is_moving=True)
+        barrier = threading.Barrier(2)
+
+        def counter():
+            barrier.wait()
+            for _ in range(2000):
+                cell.modify(lambda state: {"count": state.count + 1})
+
+        thread = threading.Thread(target=counter)
+        thread.start()
+        barrier.wait()
+        cell.update(is_moving=False)
+        thread.join()
+        # The stop is never written back by a concurrent modify
+        assert cell.snapshot().is_moving == False
+        assert cell.snapshot().count == 2000
+
+    def test_state_nested(self):
+        cell = StateCell(is_moving=True)
+
+        def changes(state):
+            # Like a signal handler interrupting this section
+            cell.update(is_moving=False)
+            return {"is_moving": state.is_moving, "count": 1}
+
+        old, new = cell.modify(changes)
+        assert old.is_moving == True
+        assert (new.is_moving, new.count) == (False, 1)
+        assert cell.snapshot() == new
+        # Nested changes only apply to the interrupted section
+        cell.update(is_moving=True)
+        assert cell.snapshot().is_moving == True
+
+    def test_tux_state(self):
+        config = {"wings": {"gpio": {"left_button": 5,
+                                     "right_button": 6,
+                                     "moving_sensor": 26,
+                                     "motor_direction_1": 19,
+                                     "motor_direction_2": 13,
+                                     }
+                            },
+                  "head": {"gpio": {"head_button": 12},
+                           "mouth": {"gpio": {"opened_sensor": 21,
+                                              "closed_sensor": 20,
+                                              "motor": 16,
+                                              },
+                                     },
+                           "eyes": {"gpio": {"opened_sensor": 7,
+                                             "closed_sensor": 8,
+                                             "motor": 25,
+                                             "left_led": 23,
+                                             "right_led": 24,
+                                             },
+                                    },
+                           },
+                  }
+        tux = TuxDroid(config, lazy=True, calibrate=False, gpio=new_fake_gpio())
+        assert tux.state() == TuxDroidState(None, None, None, None, None)
+        tux.head.eyes.led_on("left")
+        state = tux.state()
+        assert state.wings is None
+        assert state.eyes.position is None
+        assert state.mouth.is_moving == False
+        assert (state.led_left, state.led_right) == (True, None)
+        tux.wings.up()
+        state = tux.state()
+        assert state.wings.position == "UP"
+        assert state.wings.is_moving == False
+        tux.stop()
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+import yaml
+
+from tuxdroid.errors import TuxDroidThermalError
+from tuxdroid.thermal import MotorBudget
+from tuxdroid.tuxdroid import TuxDroid
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class TestThermal(object):
+
+    def test_thermal_budget(self):
+        clock = FakeClock()
+        budget = MotorBudget("wings", window=10, budget=4, min_run=1, policy="reject",
+                             clock=clock)
+        budget.motor_on()
+        clock.now += 3
+        budget.motor_off()
+        assert budget.on_time() == pytest.approx(3)
+        assert budget.remaining() == pytest.approx(1)
+        assert budget.cooldown() == 0
+        budget.motor_on()
+        clock.now += 0.5
+        budget.motor_off()
+        # 0.5s left, 1s is needed: wait for the first run to leave the window
+        assert budget.cooldown() == pytest.approx(7, abs=1e-3)
+        with pytest.raises(TuxDroidThermalError):
+            budget.acquire()
+        assert budget.state()['throttled'] == 1
+        clock.now += 10
+        assert budget.on_time() == pytest.approx(0)
+        budget.acquire()
+        with pytest.raises(TuxDroidThermalError):
+            MotorBudget("wings", policy="bad")
+
+    def test_thermal_wait(self):
+        clock = FakeClock()
+        budget = MotorBudget("wings", window=10, budget=1, min_run=0.5, clock=clock,
+                             max_wait=0.5)
+        budget.motor_on()
+        clock.now += 1
+        budget.motor_off()
+        # Cooldown longer than the longest wait
+        with pytest.raises(TuxDroidThermalError):
+            budget.acquire()
+        budget.max_wait = 20
+
+        async def start():
+            budget.acquire()
+
+        # Never waited for in an event loop
+        loop = asyncio.new_event_loop()
+        try:
+            with pytest.raises(TuxDroidThermalError) as exp:
+                loop.run_until_complete(start())
+        finally:
+            loop.close()
+        assert "can not be waited for" in str(exp.value)
+        assert budget.state()['throttled'] == 2
+
+    def test_thermal_nested_stop(self):
+        clock = FakeClock()
+        budget = MotorBudget("wings", window=10, budget=4, on_exhausted=lambda: None,
+                             clock=clock)
+        prune = budget._prune
+
+        def interrupted_prune(now):
+            # Emergency stop in a signal handler interrupting the start
+            budget.motor_off()
+            prune(now)
+
+        budget._prune = interrupted_prune
+        budget.motor_on()
+        assert budget.state()['running'] == False
+        assert budget._cutoff is None
+
+    def test_thermal_cutoff(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            config = yaml.safe_load(fhc)
+        config['wings']['thermal'] = {"window": 2, "budget": 0.3, "min_run": 0.2,
+                                      "policy": "reject"}
+        tux = TuxDroid(config, parts=('wings',), calibrate=False)
+        tux.wings.is_calibrated = True
+        tux.wings.position = "DOWN"
+        tux.wings.start()
+        time.sleep(0.4)
+        # Stopped by its thermal budget
+        assert tux.wings.is_moving == False
+        state = tux.thermal_state()['wings']
+        assert state['remaining'] == 0
+        assert state['running'] == False
+        with pytest.raises(TuxDroidThermalError):
+            tux.wings.start()
+        tux.wings.stop().result(1)
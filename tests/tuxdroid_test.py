@@ -1,7 +1,9 @@
 import time
 
 import pytest
+import yaml
 
+from tuxdroid.gpio import GPIO
 from tuxdroid.tuxdroid import TuxDroid
 from tuxdroid.wings import Wings
 from tuxdroid.wings import Wings
@@ -75,3 +77,83 @@ class TestTux(object):
                   "head": { "gpio": {'head_button': 'badid'}}}
         with pytest.raises(TuxDroidHeadError) as exp:
             tux = TuxDroid(config)
+
+    def test_tux_lazy(self):
+        config_file = "tests/tuxdroid_test_config.yaml"
+        with open(config_file) as fhc:
+            config = yaml.safe_load(fhc)
+        tux = TuxDroid(config, lazy=True)
+        assert GPIO.is_fake_()
+        assert tux._head is None
+        assert tux._wings is None
+        assert tux.head.eyes.led_left == True
+        assert tux._wings is None
+        tux.stop()
+        assert tux._wings is None
+        assert tux.wings.position == "DOWN"
+        assert tux.head.eyes.led_left == True
+        tux.stop()
+
+    def test_tux_package_lazy_attributes(self):
+        import tuxdroid
+        assert tuxdroid.TuxDroid is TuxDroid
+        with pytest.raises(AttributeError) as exp:
+            tuxdroid.Missing
+
+    def test_tux_partial(self):
+        config_file = "tests/tuxdroid_test_config.yaml"
+        with open(config_file) as fhc:
+            config = yaml.safe_load(fhc)
+        start = time.time()
+        tux = TuxDroid.led_only(config)
+        assert time.time() - start < 0.5
+        assert tux.parts == ('head',)
+        assert tux.head.eyes.is_calibrated == False
+        assert tux.head.mouth.is_calibrated == False
+        tux.head.eyes.led_on()
+        assert tux.head.eyes.led_right == True
+        with pytest.raises(TuxDroidError) as exp:
+            tux.wings
+        # Mouth is calibrated on first move
+        tux.head.mouth.open()
+        assert tux.head.mouth.is_calibrated == True
+        assert tux.head.mouth.position == "OPENED"
+        assert tux.head.eyes.is_calibrated == False
+        tux.stop()
+
+        with pytest.raises(TuxDroidError) as exp:
+            TuxDroid(config, parts=('tail',))
+        # Only enabled parts are checked
+        del config['head']
+        tux = TuxDroid(config, parts=('wings',), calibrate=False)
+        assert tux.wings.is_calibrated == False
+        tux.wings.up()
+        assert tux.wings.is_calibrated == True
+        assert tux.wings.position == "UP"
+        tux.stop()
+
+    def test_tux_gestures(self):
+        config_file = "tests/tuxdroid_test_config.yaml"
+        with open(config_file) as fhc:
+            config = yaml.safe_load(fhc)
+        config['gestures'] = {"double_press_time": 0.05, "long_press_time": 0.1}
+        tux = TuxDroid.led_only(config)
+        self.gestures = []
+        def double_press():
+            self.gestures.append("double")
+        def long_press():
+            self.gestures.append("long")
+        tux.gestures.add_callback("head.double_press", double_press)
+        tux.gestures.add_callback("head.long_press", long_press)
+        button = tux.head.config['gpio']['head_button']
+        tux.head._button_detected(button)
+        tux.head._button_detected(button)
+        time.sleep(0.2)
+        assert self.gestures == ["double"]
+        # Button held
+        GPIO.levels[button] = GPIO.HIGH
+        tux.head._button_detected(button)
+        time.sleep(0.2)
+        del GPIO.levels[button]
+        assert self.gestures == ["double", "long"]
+        tux.stop()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from tuxdroid.errors import TuxDroidVolumeError
+from tuxdroid.gpio import new_fake_gpio
+from tuxdroid.speaker import NullSink, Speaker
+from tuxdroid.tuxdroid import TuxDroid
+from tuxdroid.volume import Volume
+
+
+CONFIG = {"gpio": {"up_button": 17, "down_button": 27},
+          "debounce": {"up_button": {"time": 0}, "down_button": {"time": 0}},
+          "level": 0.5,
+          "step": 0.1,
+          "frame_time": 0.1,
+          }
+
+
+class TestVolume(object):
+
+    def test_volume_coalescing(self):
+        gpio = new_fake_gpio()
+        speaker = Speaker(NullSink())
+        volume = Volume(CONFIG, speaker, gpio=gpio)
+        assert speaker.gain == 0.5
+        changes = []
+        done = threading.Semaphore(0)
+
+        def changed(event):
+            changes.append((round(event.position, 2), event.component))
+            done.release()
+
+        subscription = volume.add_callback(changed)
+        for _ in range(5):
+            gpio._edge(17)
+        gpio._edge(27)
+        assert done.acquire(timeout=1)
+        # One change per frame
+        assert changes == [(0.9, "volume.up")]
+        assert speaker.gain == pytest.approx(0.9)
+        assert (volume.presses, volume.frames) == (6, 1)
+        # Level is bounded
+        for _ in range(10):
+            gpio._edge(17)
+        assert done.acquire(timeout=1)
+        assert changes[-1] == (1.0, "volume.up")
+        # Presses cancelling each other change nothing
+        gpio._edge(17)
+        gpio._edge(27)
+        time.sleep(0.2)
+        assert len(changes) == 2
+        assert volume.frames == 2
+        volume.set_level(0.2)
+        assert speaker.gain == 0.2
+        with pytest.raises(TuxDroidVolumeError):
+            volume.set_level(2)
+        # Pending presses are applied on stop
+        gpio._edge(27)
+        volume.stop()
+        assert volume.level == pytest.approx(0.1)
+        assert done.acquire(timeout=1)
+        assert changes[-1] == (0.1, "volume.down")
+        assert subscription.unsubscribe()
+        assert gpio.callbacks.get(17) is None
+
+    def test_volume_config(self):
+        with pytest.raises(TuxDroidVolumeError):
+            Volume({}, gpio=new_fake_gpio())
+        with pytest.raises(TuxDroidVolumeError):
+            Volume({"gpio": {"up_button": 17, "down_button": 27}, "step": 2},
+                   gpio=new_fake_gpio())
+        config = {"wings": {"gpio": {"left_button": 5, "right_button": 6, "moving_sensor": 26,
+                                     "motor_direction_1": 19, "motor_direction_2": 13}},
+                  "volume": {"gpio": {"up_button": 17, "down_button": 27}},
+                  }
+        tux = TuxDroid(config, parts=("wings",), calibrate=False, gpio=new_fake_gpio())
+        assert tux.volume.level == 1.
+        assert tux.volume.speaker is tux.speaker
+        assert tux.config["volume"]["debounce"]["up_button"]["algorithm"] == "stable"
+        tux.stop()
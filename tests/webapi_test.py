@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+
+import pytest
+import yaml
+
+from tuxdroid.tuxdroid import TuxDroid
+from tuxdroid.webapi import WebAPIServer, websocket_accept, websocket_frame, \
+    websocket_unmask, read_websocket_frame
+
+
+async def http_request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write("{} {} HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                 .format(method, path, len(data)).encode() + data)
+    status = int((await reader.readline()).split()[1])
+    response = await reader.read()
+    writer.close()
+    return status, json.loads(response.split(b"\r\n\r\n", 1)[1].decode())
+
+
+async def websocket_connect(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n")
+    response = await reader.readuntil(b"\r\n\r\n")
+    assert b"s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in response
+    return reader, writer
+
+
+def masked_frame(payload):
+    mask = os.urandom(4)
+    return bytes((0x81, 0x80 | len(payload))) + mask + websocket_unmask(mask, payload)
+
+
+class TestWebAPI(object):
+
+    def test_webapi_01(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            tux = TuxDroid(yaml.safe_load(fhc))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # Local only by default
+        assert WebAPIServer(tux, loop=loop).host == "127.0.0.1"
+        server = WebAPIServer(tux, "127.0.0.1", 0, loop=loop)
+        loop.run_until_complete(server.start())
+
+        async def scenario():
+            status, state = await http_request(server.port, "GET", "/state")
+            assert status == 200
+            assert state["wings"] == "DOWN"
+            status, result = await http_request(server.port, "POST", "/command/eyes.led_on",
+                                                ["right"])
+            assert status == 200 and result == {"ok": True, "result": None}
+            assert tux.head.eyes.led_right == True
+            status, _ = await http_request(server.port, "POST", "/command/bad")
+            assert status == 404
+            status, _ = await http_request(server.port, "GET", "/command/eyes.led_on")
+            assert status == 405
+            status, result = await http_request(server.port, "POST", "/command/eyes.led_on",
+                                                ["bad_side"])
+            assert result["ok"] == False
+            # Arguments should be a JSON list
+            status, _ = await http_request(server.port, "POST", "/command/eyes.led_on", "right")
+            assert status == 400
+
+            # Duplicate commands are coalesced
+            results = await asyncio.gather(
+                http_request(server.port, "POST", "/command/wings.up"),
+                http_request(server.port, "POST", "/command/wings.up"))
+            assert results[0] == results[1] == (200, {"ok": True, "result": None})
+            assert server.stats["coalesced"] == 1
+            assert tux.wings.position == "UP"
+
+            # WebSocket events and commands
+            reader, writer = await websocket_connect(server.port)
+            tux.head._button_detected(tux.head._head_button)
+            opcode, payload = await asyncio.wait_for(read_websocket_frame(reader), 5)
+            assert json.loads(payload.decode()) == {"event": "head.button"}
+            writer.write(masked_frame(b'{"id": 7, "cmd": "eyes.led_off", "args": []}'))
+            opcode, payload = await asyncio.wait_for(read_websocket_frame(reader), 5)
+            assert json.loads(payload.decode()) == {"id": 7, "ok": True, "result": None}
+            writer.write(masked_frame(b'{"id": 8, "cmd": "eyes.led_off", "args": "left"}'))
+            opcode, payload = await asyncio.wait_for(read_websocket_frame(reader), 5)
+            assert json.loads(payload.decode())["error"] == "Bad request"
+            writer.write(bytes((0x88, 0x80)) + os.urandom(4))
+            opcode, payload = await asyncio.wait_for(read_websocket_frame(reader), 5)
+            assert opcode == 0x8
+            writer.close()
+
+        loop.run_until_complete(scenario())
+        loop.run_until_complete(server.stop())
+        loop.close()
+        tux.stop()
+
+    def test_webapi_lazy(self):
+        with open("tests/tuxdroid_test_config.yaml") as fhc:
+            tux = TuxDroid(yaml.safe_load(fhc), lazy=True, calibrate=False)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = WebAPIServer(tux, "127.0.0.1", 0, loop=loop)
+        loop.run_until_complete(server.start())
+        # Motor starts and commands of parts not built yet leave the event loop
+        assert not server.dispatcher.is_quick("eyes.led_on")
+        assert not server.dispatcher.is_quick("wings.start")
+        assert server.dispatcher.is_quick("thermal")
+
+        async def scenario():
+            status, state = await http_request(server.port, "GET", "/state")
+            assert (status, state["wings"], state["eyes"]) == (200, None, None)
+            # State does not build parts
+            assert not tux.is_built("wings") and not tux.is_built("head")
+            status, result = await http_request(server.port, "POST", "/command/eyes.led_on",
+                                                ["left"])
+            assert result == {"ok": True, "result": None}
+            assert tux.is_built("head")
+
+        loop.run_until_complete(scenario())
+        assert server.dispatcher.is_quick("eyes.led_on")
+        loop.run_until_complete(server.stop())
+        loop.close()
+        tux.stop()
+
+    def test_webapi_websocket_helpers(self):
+        assert websocket_accept("dGhlIHNhbXBsZSBub25jZQ==") == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+        assert websocket_frame(b"hi") == b"\x81\x02hi"
+        assert websocket_frame(b"x" * 200)[:4] == b"\x81\x7e\x00\xc8"
+        assert websocket_unmask(b"\x01\x02\x03\x04", websocket_unmask(b"\x01\x02\x03\x04",
+                                                                      b"hello")) == b"hello"
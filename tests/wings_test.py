@@ -106,3 +106,50 @@ class TestWings(object):
         with pytest.raises(TuxDroidWingsError) as exp:
             wings = Wings(config)
 
+
+    def test_wings_brake(self):
+        config = {"gpio": {"left_button": 5,
+                           "right_button": 6,
+                           "moving_sensor": 26,
+                           "motor_direction_1": 19,
+                           "motor_direction_2": 13,
+                           },
+                  "brake": {"time": 0.1},
+                  }
+        GPIO.set_config_({"wings": config})
+        wings = Wings(config, calibrate=False)
+        wings.is_calibrated = True
+        wings.position = "DOWN"
+        wings.start()
+        start = time.time()
+        done = wings.stop()
+        # Stop does not wait for the brake pulse
+        assert time.time() - start < 0.05
+        assert wings.is_moving == False
+        assert wings.stop() is done
+        assert done.result(1) == True
+        assert time.time() - start >= 0.1
+        assert GPIO.outputs[13] == GPIO.LOW
+        # Start interrupts the brake
+        wings.start()
+        done = wings.stop()
+        time.sleep(0.02)
+        assert GPIO.outputs[13] == GPIO.HIGH
+        wings.start()
+        assert done.result(0) == False
+        assert GPIO.outputs[13] == GPIO.LOW
+        assert GPIO.outputs[19] == GPIO.HIGH
+        wings.stop().result(1)
+        # Brake end and cancel resolve the future once, whatever their order
+        wings.start()
+        done = wings.stop()
+        wings._cancel_brake()
+        wings._brake_end(done)
+        assert done.result(0) == False
+        wings.start()
+        done = wings.stop()
+        time.sleep(0.02)
+        wings._brake_end(done)
+        wings._cancel_brake()
+        assert done.result(0) == True
+        assert wings.stop().result(0) == True
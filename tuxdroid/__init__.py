@@ -0,0 +1,41 @@
+"""TuxDroid package
+
+Submodules are imported on first use, so `import tuxdroid` stays cheap:
+
+.. code-block:: python
+
+    import tuxdroid
+    tux = tuxdroid.TuxDroid("config.yaml")
+"""
+import importlib
+import sys
+
+
+_LAZY_ATTRIBUTES = {
+    "TuxDroid": "tuxdroid.tuxdroid",
+    "Wings": "tuxdroid.wings",
+    "Head": "tuxdroid.head",
+    "Eyes": "tuxdroid.eyes",
+    "Mouth": "tuxdroid.mouth",
+    "GPIO": "tuxdroid.gpio",
+}
+
+
+def __getattr__(name):
+    """Import public classes on first access (Python >= 3.7)"""
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__ (PEP 562), import them now
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
@@ -0,0 +1,58 @@
+"""Module defining TuxDroid calibration strategies
+
+* ``full`` (default): move until the sensors give the position, whatever
+  it was (two eyes or mouth cycles, at least four wings moves)
+* ``fast``: eyes and mouth read their position sensors first and only move
+  when no sensor, or both, are active. The wings moving sensor gives no
+  absolute position, so wings still move, but stop as soon as two moves
+  tell they are down. Eyes and mouth are left where they are, not in
+  the position reached by a full calibration.
+"""
+import collections
+import time
+
+from tuxdroid.inputs import read_pins
+from tuxdroid.positions import Position
+
+
+CALIBRATIONS = ("fast", "full")
+
+# Sensor waits are cut in slices to notice a motor stopped meanwhile
+EDGE_POLL_TIME = 0.1
+
+# Motor moves of the full calibration: cycles for eyes and mouth, least moves for wings
+FULL_MOVES = {"eyes": 2, "mouth": 2, "wings": 4}
+
+CalibrationReport = collections.namedtuple("CalibrationReport", (
+    "strategy",
+    # Seconds spent calibrating
+    "time",
+    # Motor moves done
+    "moves",
+    # Moves saved compared to the full calibration
+    "moves_saved",
+))
+
+
+def sensor_position(gpio, opened_sensor: int, closed_sensor: int):
+    """Get the position given by active (HIGH) sensors, None if ambiguous"""
+    levels = read_pins(gpio, (opened_sensor, closed_sensor))
+    return {0b01: Position.OPENED, 0b10: Position.CLOSED}.get(levels)
+
+
+def report(component: str, strategy: str, start: float, moves: int):
+    """Get the report of a calibration started at a monotonic time"""
+    return CalibrationReport(strategy, time.monotonic() - start, moves,
+                             max(0, FULL_MOVES[component] - moves))
+
+
+def wait_for_sensor(gpio, channel: int, running, error: type):
+    """Wait for a rising edge of a sensor while the motor runs
+
+    running: function returning False once the motor was stopped
+             (emergency stop, watchdog, thermal cutoff)
+    error: exception class raised if the motor stops before the edge
+    """
+    while gpio.wait_for_edge(channel, gpio.RISING, timeout=int(EDGE_POLL_TIME * 1000)) is None:
+        if not running():
+            raise error("Calibration interrupted, motor stopped")
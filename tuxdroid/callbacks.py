@@ -0,0 +1,299 @@
+"""Module defining TuxDroid component callbacks
+
+Callbacks can be functions, bound methods, `functools.partial` objects or
+any callable, and coroutine functions. Callbacks with a required argument
+get an `Event`, others are called without argument.
+
+Subscribers of each event are stored in a tuple replaced on each change,
+so dispatching iterates a stable snapshot without locking.
+
+Callbacks run in a thread pool by default. Inline callbacks run right away
+in the GPIO event thread, before pooled ones, for reactions which cannot
+wait for a pool thread (like lighting a led). They must be short: each call
+is timed against the inline budget and a callback overrunning it too often
+is moved to the thread pool.
+"""
+import asyncio
+import collections
+import functools
+import inspect
+import itertools
+import sys
+import threading
+import time
+
+
+Event = collections.namedtuple("Event", (
+    # Event source, like "wings.left" or "eyes"
+    "component",
+    # Component position after the event, None if unknown
+    "position",
+    # Monotonic time of the event
+    "timestamp",
+    # Event number of the component
+    "sequence",
+))
+
+Subscriber = collections.namedtuple("Subscriber", ("callback", "wants_event", "coroutine",
+                                                   "loop", "inline", "stats"))
+
+# Longest inline callback run, in seconds
+INLINE_BUDGET = 0.001
+# Overruns before an inline callback is moved to the thread pool
+MAX_OVERRUNS = 3
+
+
+def callback_name(callback):
+    """Get a readable callback name"""
+    return getattr(callback, "__qualname__", None) or getattr(callback, "__name__", None) or \
+        repr(callback)
+
+
+def wants_event(callback):
+    """True if the callback has a required positional argument"""
+    try:
+        parameters = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        # Builtins without signature
+        return False
+    for parameter in parameters:
+        if parameter.kind == parameter.VAR_POSITIONAL:
+            return True
+        if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD) \
+                and parameter.default is parameter.empty:
+            return True
+    return False
+
+
+def is_coroutine_function(callback):
+    """True for coroutine functions, also wrapped in `functools.partial`"""
+    while isinstance(callback, functools.partial):
+        callback = callback.func
+    return inspect.iscoroutinefunction(callback) or \
+        inspect.iscoroutinefunction(getattr(callback, "__call__", None))
+
+
+def running_loop():
+    """Get the event loop running in this thread, None if none"""
+    if sys.version_info < (3, 7):
+        # No get_running_loop(), the loop of this thread tells if it runs
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return None
+        return loop if loop.is_running() else None
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def run_coroutine(coroutine):
+    """Run a coroutine in a new event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class CallStats():
+    """Run time statistics of a callback"""
+
+    __slots__ = ("calls", "total_time", "max_time", "overruns", "demoted")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.overruns = 0
+        self.demoted = False
+
+    def record(self, duration: float):
+        """Record one call duration"""
+        self.calls += 1
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+
+
+class Subscription():
+    """Handle of a registered callback"""
+
+    def __init__(self, registry, event: str, callback):
+        self.event = event
+        self.callback = callback
+        self._registry = registry
+
+    @property
+    def active(self):
+        """True while the callback is registered"""
+        return self.callback in self._registry.callbacks(self.event)
+
+    def unsubscribe(self):
+        """Remove the callback, return False if it was already removed"""
+        return self._registry.remove(self.event, self.callback)
+
+
+class CallbackRegistry():
+    """Callbacks of a component, per event
+
+    component: component name, prefix of event sources
+    events: accepted event names
+    error: exception class raised for bad callbacks
+    thread_pool: executor running callbacks
+    inline_budget: longest inline callback run, in seconds
+    """
+    def __init__(self, component: str, events, error, thread_pool, logger,
+                 inline_budget: float = INLINE_BUDGET):
+        self.component = component
+        self.error = error
+        self.inline_budget = inline_budget
+        self._thread_pool = thread_pool
+        self._logger = logger
+        self._subscribers = {event: () for event in events}
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def callbacks(self, event: str):
+        """Get registered callbacks of an event"""
+        return frozenset(subscriber.callback for subscriber in self._subscribers[event])
+
+    def add_events(self, *events):
+        """Accept new event names, for components adding events after their creation"""
+        with self._lock:
+            for event in events:
+                self._subscribers.setdefault(event, ())
+
+    def add(self, event: str, callback, where: str = None, inline: bool = False):
+        """Register a callback, return its Subscription
+
+        Coroutine functions run in the event loop running while they are added,
+        in a new loop of the thread pool otherwise.
+        where: description of the event for log messages
+        inline: run the callback in the GPIO event thread
+        """
+        if not callable(callback):
+            raise self.error("Callback `{}` is not callable".format(callback))
+        where = where or "`{}` {}".format(event, self.component)
+        coroutine = is_coroutine_function(callback)
+        if inline and coroutine:
+            raise self.error("Coroutine callback `{}` can not be inline".format(
+                callback_name(callback)))
+        loop = running_loop() if coroutine else None
+        with self._lock:
+            subscribers = self._subscribers[event]
+            if any(subscriber.callback == callback for subscriber in subscribers):
+                self._logger.warning("Callback `%s` already registered to %s",
+                                     callback_name(callback), where)
+            else:
+                self._logger.info("Adding %scallback `%s` to %s", "inline " if inline else "",
+                                  callback_name(callback), where)
+                subscriber = Subscriber(callback, wants_event(callback), coroutine, loop, inline,
+                                        CallStats())
+                if inline:
+                    # Inline callbacks run first
+                    inlines = sum(1 for item in subscribers if item.inline)
+                    subscribers = subscribers[:inlines] + (subscriber,) + subscribers[inlines:]
+                else:
+                    subscribers += (subscriber,)
+                self._subscribers[event] = subscribers
+        return Subscription(self, event, callback)
+
+    def remove(self, event: str, callback, where: str = None):
+        """Unregister a callback, return False if it was not registered"""
+        where = where or "`{}` {}".format(event, self.component)
+        with self._lock:
+            subscribers = self._subscribers[event]
+            kept = tuple(subscriber for subscriber in subscribers
+                         if subscriber.callback != callback)
+            self._subscribers[event] = kept
+        if len(kept) == len(subscribers):
+            self._logger.warning("Callback `%s` not registered to %s",
+                                 callback_name(callback), where)
+            return False
+        self._logger.info("Deleting callback `%s` to %s", callback_name(callback), where)
+        return True
+
+    def dispatch(self, event: str, source: str = None, position=None, timestamp: float = None):
+        """Run the callbacks of an event, return the Event
+
+        source: event source, the component name by default
+        timestamp: monotonic time of the event, now by default
+        """
+        payload = Event(source or self.component, position,
+                        time.monotonic() if timestamp is None else timestamp,
+                        next(self._sequence))
+        for subscriber in self._subscribers[event]:
+            if subscriber.inline:
+                self._run_inline(event, subscriber, payload)
+            else:
+                self._logger.debug("Calling: %s", callback_name(subscriber.callback))
+                self._submit(subscriber, payload)
+        return payload
+
+    def _run_inline(self, event: str, subscriber, payload):
+        """Run a callback in this thread and check its run time"""
+        start = time.perf_counter()
+        try:
+            if subscriber.wants_event:
+                subscriber.callback(payload)
+            else:
+                subscriber.callback()
+        except Exception:  # pylint: disable=W0703
+            self._logger.exception("Inline callback `%s` failed",
+                                   callback_name(subscriber.callback))
+        duration = time.perf_counter() - start
+        stats = subscriber.stats
+        stats.record(duration)
+        if duration <= self.inline_budget:
+            return
+        stats.overruns += 1
+        self._logger.warning("Inline callback `%s` ran %.1fms, over its %.1fms budget",
+                             callback_name(subscriber.callback), duration * 1000,
+                             self.inline_budget * 1000)
+        if stats.overruns >= MAX_OVERRUNS:
+            self._demote(event, subscriber)
+
+    def _demote(self, event: str, subscriber):
+        """Move an inline callback to the thread pool"""
+        with self._lock:
+            subscribers = self._subscribers[event]
+            if subscriber not in subscribers:
+                return
+            subscriber.stats.demoted = True
+            self._subscribers[event] = tuple(item for item in subscribers
+                                             if item is not subscriber) + \
+                (subscriber._replace(inline=False),)
+        self._logger.warning("Inline callback `%s` moved to the thread pool",
+                             callback_name(subscriber.callback))
+
+    def stats(self):
+        """Get run time statistics of inline callbacks and demoted ones, per event"""
+        return {event: [{"callback": callback_name(subscriber.callback),
+                         "inline": subscriber.inline,
+                         "calls": subscriber.stats.calls,
+                         "mean_time": (subscriber.stats.total_time / subscriber.stats.calls
+                                       if subscriber.stats.calls else None),
+                         "max_time": subscriber.stats.max_time,
+                         "overruns": subscriber.stats.overruns,
+                         "demoted": subscriber.stats.demoted,
+                         } for subscriber in subscribers
+                        if subscriber.inline or subscriber.stats.demoted]
+                for event, subscribers in self._subscribers.items()}
+
+    def _submit(self, subscriber, payload):
+        """Run one callback out of the GPIO thread"""
+        args = (payload,) if subscriber.wants_event else ()
+        if subscriber.loop is not None:
+            if not subscriber.loop.is_closed():
+                asyncio.run_coroutine_threadsafe(subscriber.callback(*args), subscriber.loop)
+        elif subscriber.coroutine:
+            self._thread_pool.submit(run_coroutine, subscriber.callback(*args))
+        else:
+            self._thread_pool.submit(subscriber.callback, *args)
+
+
+def callbacks_property(event: str):
+    """Registered callbacks of an event, read only"""
+    return property(lambda self: self._callbacks.callbacks(event))
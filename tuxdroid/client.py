@@ -0,0 +1,165 @@
+"""Module defining TuxDroid daemon client
+
+Thin client for :mod:`tuxdroid.daemon`, it does not need any GPIO
+library and can be used from any process on the robot or on the network.
+
+.. code-block:: python
+
+    client = TuxDroidClient("/tmp/tuxdroid.sock")
+    client.execute("eyes.led_on")
+    with client.pipeline() as pipe:
+        pipe.call("wings.up")
+        done = pipe.call("mouth.move", 4)
+    done.result()
+"""
+from concurrent.futures import Future
+import itertools
+import json
+import logging
+import socket
+import threading
+
+from tuxdroid.errors import TuxDroidCommandError
+from tuxdroid.daemon import DEFAULT_UNIX_ADDRESS
+
+
+class Pipeline():
+    """Requests batch sent to the daemon in one write"""
+
+    def __init__(self, client):
+        self._client = client
+        self._requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def call(self, cmd: str, *args):
+        """Queue a command and return its future"""
+        data, future = self._client._prepare(cmd, args)
+        self._requests.append(data)
+        return future
+
+    def send(self):
+        """Send queued commands"""
+        if self._requests:
+            self._client._send(b"".join(self._requests))
+            self._requests = []
+
+
+class TuxDroidClient():
+    """TuxDroid daemon client
+
+    address: Unix socket path (str) or TCP (host, port) tuple
+    """
+    def __init__(self, address=DEFAULT_UNIX_ADDRESS):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("client")
+        # Connect
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(address)
+        else:
+            self._socket = socket.create_connection(tuple(address))
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Privates
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._event_callbacks = set()
+        self._subscribed = False
+        self._closed = False
+        # Reader
+        self._reader = threading.Thread(target=self._read_loop, name="tuxdroid-client")
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _prepare(self, cmd: str, args):
+        """Build a request and register its future"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise TuxDroidCommandError("Connection closed")
+            req_id = next(self._ids)
+            self._pending[req_id] = future
+        data = json.dumps({"id": req_id, "cmd": cmd, "args": list(args)}).encode() + b"\n"
+        return data, future
+
+    def _send(self, data: bytes):
+        """Write data to the daemon"""
+        with self._write_lock:
+            self._socket.sendall(data)
+
+    def _read_loop(self):
+        """Read responses and events from the daemon"""
+        try:
+            for line in self._socket.makefile("rb"):
+                message = json.loads(line.decode())
+                if "event" in message:
+                    for callback in tuple(self._event_callbacks):
+                        try:
+                            callback(message["event"])
+                        except Exception:  # pylint: disable=W0703
+                            self._logger.exception("Event callback failed")
+                    continue
+                with self._lock:
+                    future = self._pending.pop(message.get("id"), None)
+                if future is None:
+                    self._logger.warning("Unexpected response: %s", message)
+                elif message.get("ok"):
+                    future.set_result(message.get("result"))
+                else:
+                    future.set_exception(TuxDroidCommandError(message.get("error")))
+        except (OSError, ValueError):
+            if not self._closed:
+                self._logger.exception("Connection to daemon lost")
+        finally:
+            with self._lock:
+                self._closed = True
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for future in pending:
+                future.set_exception(TuxDroidCommandError("Connection closed"))
+
+    def call(self, cmd: str, *args):
+        """Send a command and return its future"""
+        data, future = self._prepare(cmd, args)
+        self._send(data)
+        return future
+
+    def execute(self, cmd: str, *args, timeout=None):
+        """Send a command and wait for its result"""
+        return self.call(cmd, *args).result(timeout)
+
+    def pipeline(self):
+        """Get a pipeline to send many commands in one round trip"""
+        return Pipeline(self)
+
+    def state(self, timeout=None):
+        """Get current positions of all parts"""
+        return self.execute("state", timeout=timeout)
+
+    def add_event_callback(self, callback):
+        """Add callback called with the event name on each daemon event"""
+        self._event_callbacks.add(callback)
+        if not self._subscribed:
+            self._subscribed = True
+            self.execute("subscribe")
+
+    def del_event_callback(self, callback):
+        """Delete event callback"""
+        self._event_callbacks.discard(callback)
+
+    def close(self):
+        """Close connection"""
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._reader.join(1)
@@ -0,0 +1,208 @@
+"""Module defining TuxDroid remote commands
+
+The command table maps a public command name to the component owning it,
+the method to call and whether the call blocks until a motor movement ends.
+It is shared by every remote frontend (daemon, web API, ...).
+"""
+from concurrent.futures import Future
+import inspect
+import logging
+import threading
+
+from tuxdroid.errors import TuxDroidCommandError
+from tuxdroid.gestures import GESTURES, DEFAULT_COMBOS, combo_name
+
+
+# name: (component path, method name, blocking)
+# Starts are blocking: they can calibrate or wait for a motor cooldown first
+COMMANDS = {
+    "wings.up": (("wings",), "up", True),
+    "wings.down": (("wings",), "down", True),
+    "wings.move": (("wings",), "move", True),
+    "wings.start": (("wings",), "start", True),
+    "wings.stop": (("wings",), "stop", False),
+    "head.start": (("head",), "start", True),
+    "head.stop": (("head",), "stop", False),
+    "eyes.open": (("head", "eyes"), "open", True),
+    "eyes.close": (("head", "eyes"), "close", True),
+    "eyes.move": (("head", "eyes"), "move", True),
+    "eyes.led_on": (("head", "eyes"), "led_on", False),
+    "eyes.led_off": (("head", "eyes"), "led_off", False),
+    "eyes.led_blink": (("head", "eyes"), "led_blink", True),
+    "mouth.open": (("head", "mouth"), "open", True),
+    "mouth.close": (("head", "mouth"), "close", True),
+    "mouth.move": (("head", "mouth"), "move", True),
+    # Motors only: shutdown and GPIO cleanup are left to the process owning the robot
+    "stop": ((), "stop_motors", True),
+    "thermal": ((), "thermal_state", False),
+    "inputs": ((), "input_levels", False),
+}
+
+# Commands which must never wait for a running movement
+UNLOCKED_COMMANDS = ("wings.stop", "head.stop", "stop")
+
+# Events sent to subscribers: (component path, callback arguments, event name)
+EVENTS = (
+    (("wings",), ("left",), "wings.left"),
+    (("wings",), ("right",), "wings.right"),
+    (("head",), (), "head.button"),
+    (("head", "eyes"), ("opened",), "eyes.opened"),
+    (("head", "eyes"), ("closed",), "eyes.closed"),
+    (("head", "mouth"), ("opened",), "mouth.opened"),
+    (("head", "mouth"), ("closed",), "mouth.closed"),
+) + tuple((("gestures",), (event,), event)
+          for event in ["{}.{}".format(button, gesture)
+                        for button in ("wings.left", "wings.right", "head")
+                        for gesture in GESTURES] +
+          [combo_name(combo) for combo in DEFAULT_COMBOS])
+
+
+class Dispatcher():
+    """Resolve and run commands against a single TuxDroid
+
+    Blocking commands moving the same part are serialized, commands on
+    different parts (wings and head) can run at the same time.
+    Non blocking commands (leds, stop) never wait for a lock.
+    """
+    def __init__(self, tux):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("commands")
+        self._tux = tux
+        # Privates
+        self._handlers = {}
+        self._locks = {"wings": threading.Lock(),
+                       "head": threading.Lock(),
+                       "": threading.Lock(),
+                       }
+        self._listeners = set()
+        self._listeners_lock = threading.Lock()
+        self._events_set = False
+
+    def _resolve(self, path):
+        """Get the component object from its path"""
+        component = self._tux
+        for name in path:
+            component = getattr(component, name)
+        return component
+
+    def _get(self, name: str):
+        """Get the bound method of a command and its signature"""
+        handler = self._handlers.get(name)
+        if handler is None:
+            if name not in COMMANDS:
+                raise TuxDroidCommandError("Unknown command `{}`".format(name))
+            path, method, _ = COMMANDS[name]
+            method = getattr(self._resolve(path), method)
+            handler = (method, inspect.signature(method))
+            self._handlers[name] = handler
+        return handler
+
+    def get(self, name: str):
+        """Get the bound method of a command"""
+        return self._get(name)[0]
+
+    @staticmethod
+    def is_blocking(name: str):
+        """Return True if the command waits for a motor movement"""
+        if name not in COMMANDS:
+            raise TuxDroidCommandError("Unknown command `{}`".format(name))
+        return COMMANDS[name][2]
+
+    def is_quick(self, name: str):
+        """Return True if the command can run in an event loop
+
+        It neither waits for a motor, nor builds and calibrates a lazy part
+        """
+        if name == "state":
+            return True
+        if self.is_blocking(name):
+            return False
+        path = COMMANDS[name][0]
+        return not path or self._tux.is_built(path[0])
+
+    def call(self, name: str, args=()):
+        """Run a command and return its result"""
+        if name == "state":
+            return self.state()
+        handler, signature = self._get(name)
+        if not isinstance(args, (list, tuple)):
+            raise TuxDroidCommandError("Arguments of `{}` should be a list".format(name))
+        try:
+            signature.bind(*args)
+        except TypeError as exp:
+            raise TuxDroidCommandError("Bad arguments for `{}`: {}".format(name, exp))
+        path, _, blocking = COMMANDS[name]
+        if not blocking or name in UNLOCKED_COMMANDS:
+            return self._result(handler(*args), blocking)
+        with self._locks[path[0] if path else ""]:
+            return self._result(handler(*args), blocking)
+
+    @staticmethod
+    def _result(result, blocking: bool):
+        """Wait for a completion handle if the command is blocking, never send it"""
+        if isinstance(result, Future):
+            return result.result() if blocking else None
+        return result
+
+    def state(self):
+        """Get current positions of all enabled parts, None for parts not built yet
+
+        Only snapshots are read: no part is built, no lock is taken
+        """
+        snapshot = self._tux.state()
+        state = {}
+        if "wings" in self._tux.parts:
+            state["wings"] = snapshot.wings.position if snapshot.wings is not None else None
+        if "head" in self._tux.parts:
+            state.update({"eyes": snapshot.eyes.position if snapshot.eyes is not None else None,
+                          "mouth": snapshot.mouth.position if snapshot.mouth is not None else None,
+                          "led_left": snapshot.led_left,
+                          "led_right": snapshot.led_right,
+                          })
+        return state
+
+    def _set_event_callbacks(self):
+        """Register one callback per event on enabled components
+
+        Lazy parts are not built: their callbacks are set once they are
+        """
+        for path, args, event in EVENTS:
+            if path[0] == "gestures":
+                self._add_event_callback(path, args, event)
+        self._tux.on_build(self._set_part_callbacks)
+        self._events_set = True
+
+    def _set_part_callbacks(self, part: str):
+        """Register the event callbacks of a built part"""
+        for path, args, event in EVENTS:
+            if path[0] == part:
+                self._add_event_callback(path, args, event)
+
+    def _add_event_callback(self, path, args, event):
+        """Forward an event of a component to listeners"""
+        def callback():
+            """Forward component event to listeners"""
+            self._notify(event)
+        self._resolve(path).add_callback(*(args + (callback,)))
+
+    def _notify(self, event):
+        """Send event to all listeners"""
+        for listener in tuple(self._listeners):
+            try:
+                listener(event)
+            except Exception:  # pylint: disable=W0703
+                self._logger.exception("Event listener failed on `%s`", event)
+
+    def subscribe(self, listener):
+        """Add an event listener
+
+        The listener is called with the event name from a component thread
+        """
+        with self._listeners_lock:
+            if not self._events_set:
+                self._set_event_callbacks()
+            self._listeners.add(listener)
+
+    def unsubscribe(self, listener):
+        """Delete an event listener"""
+        self._listeners.discard(listener)
@@ -0,0 +1,415 @@
+"""Module defining TuxDroid configuration schema and loading
+
+The schema is declarative: each section lists its GPIO pins and timings.
+It is compiled once into a flat list of checks, so validating a
+configuration does not walk the schema again and reports all errors at once.
+"""
+import logging
+import marshal
+import os
+
+from tuxdroid.calibration import CALIBRATIONS
+from tuxdroid.debounce import ALGORITHMS
+from tuxdroid.thermal import POLICIES
+from tuxdroid.errors import TuxDroidError, TuxDroidWingsError, TuxDroidHeadError, \
+    TuxDroidEyesError, TuxDroidMouthError, TuxDroidSpeakerError, TuxDroidMicrophoneError, \
+    TuxDroidVolumeError
+
+
+# Highest BCM GPIO number
+MAX_PIN = 53
+
+
+class Pin():
+    """GPIO number (BCM)"""
+
+    def __init__(self, required: bool = True):
+        self.required = required
+        self.default = None
+
+    @staticmethod
+    def convert(value):
+        """Return the GPIO number or raise ValueError"""
+        if isinstance(value, bool):
+            raise ValueError
+        pin = int(value)
+        if not 0 <= pin <= MAX_PIN:
+            raise ValueError
+        return pin
+
+    @staticmethod
+    def describe():
+        """Expected value description"""
+        return "a GPIO number between 0 and {}".format(MAX_PIN)
+
+
+class Duration():
+    """Positive duration in seconds"""
+
+    def __init__(self, default: float):
+        self.required = False
+        self.default = default
+
+    @staticmethod
+    def convert(value):
+        """Return the duration or raise ValueError"""
+        if isinstance(value, bool):
+            raise ValueError
+        duration = float(value)
+        if duration < 0:
+            raise ValueError
+        return duration
+
+    @staticmethod
+    def describe():
+        """Expected value description"""
+        return "a positive duration in seconds"
+
+
+class Ratio():
+    """Number between 0 and 1"""
+
+    def __init__(self, default: float):
+        self.required = False
+        self.default = default
+
+    @staticmethod
+    def convert(value):
+        """Return the ratio or raise ValueError"""
+        if isinstance(value, bool):
+            raise ValueError
+        ratio = float(value)
+        if not 0 <= ratio <= 1:
+            raise ValueError
+        return ratio
+
+    @staticmethod
+    def describe():
+        """Expected value description"""
+        return "a number between 0 and 1"
+
+
+class Choice():
+    """One value in a list"""
+
+    def __init__(self, choices: tuple, default):
+        self.required = False
+        self.choices = choices
+        self.default = default
+
+    def convert(self, value):
+        """Return the value or raise ValueError"""
+        if value not in self.choices:
+            raise ValueError
+        return value
+
+    def describe(self):
+        """Expected value description"""
+        return "one of {}".format(", ".join(self.choices))
+
+
+class Section():
+    """Mapping of fields, errors are raised with the section exception class
+
+    required: if False, a missing section is created with its defaults
+    """
+
+    def __init__(self, error: type, fields: dict, required: bool = True):
+        self.error = error
+        self.fields = fields
+        self.required = required
+
+
+def _debounce(error: type, defaults: dict):
+    """Optional per GPIO debounce section
+
+    defaults: {gpio name: (algorithm, bounce time)}
+    """
+    return Section(error, {name: Section(error, {"algorithm": Choice(ALGORITHMS, algorithm),
+                                                 "time": Duration(bounce_time),
+                                                 }, required=False)
+                           for name, (algorithm, bounce_time) in defaults.items()},
+                   required=False)
+
+
+def _thermal(error: type):
+    """Optional motor thermal budget section"""
+    return Section(error, {"window": Duration(60.),
+                           "budget": Duration(40.),
+                           "min_run": Duration(1.),
+                           "policy": Choice(POLICIES, "wait"),
+                           "max_wait": Duration(10.),
+                           }, required=False)
+
+
+# Release bounces of buttons are rejected from their level, see tuxdroid.debounce
+BUTTON_BOUNCE_TIME = 0.02
+
+# Parts are in build order, so errors are raised for the first built part
+SCHEMA = Section(TuxDroidError, {
+    "head": Section(TuxDroidHeadError, {
+        "gpio": Section(TuxDroidHeadError, {
+            "head_button": Pin(),
+        }),
+        "debounce": _debounce(TuxDroidHeadError, {"head_button": ("stable", BUTTON_BOUNCE_TIME)}),
+        "eyes": Section(TuxDroidEyesError, {
+            "gpio": Section(TuxDroidEyesError, {
+                "opened_sensor": Pin(),
+                "closed_sensor": Pin(),
+                "motor": Pin(),
+                "left_led": Pin(),
+                "right_led": Pin(),
+                # Digital photodetector output, an ADC can be used instead
+                "photodetector": Pin(required=False),
+            }),
+            "debounce": _debounce(TuxDroidEyesError, {"opened_sensor": ("lockout", 0.25),
+                                                      "closed_sensor": ("lockout", 0.25),
+                                                      }),
+            "startup_time": Duration(0.2),
+            "calibration": Choice(CALIBRATIONS, "full"),
+            "thermal": _thermal(TuxDroidEyesError),
+            # Photodetector sampling and light events
+            "light": Section(TuxDroidEyesError, {
+                "period": Duration(0.02),
+                "window": Duration(5.),
+                "dark_level": Ratio(0.2),
+                "wave_ratio": Ratio(0.3),
+                "wave_time": Duration(0.5),
+            }, required=False),
+        }),
+        "mouth": Section(TuxDroidMouthError, {
+            "gpio": Section(TuxDroidMouthError, {
+                "opened_sensor": Pin(),
+                "closed_sensor": Pin(),
+                "motor": Pin(),
+            }),
+            "debounce": _debounce(TuxDroidMouthError, {"opened_sensor": ("lockout", 0.25),
+                                                       "closed_sensor": ("lockout", 0.25),
+                                                       }),
+            "startup_time": Duration(0.2),
+            "calibration": Choice(CALIBRATIONS, "full"),
+            "thermal": _thermal(TuxDroidMouthError),
+        }),
+    }),
+    "wings": Section(TuxDroidWingsError, {
+        "gpio": Section(TuxDroidWingsError, {
+            "left_button": Pin(),
+            "right_button": Pin(),
+            "moving_sensor": Pin(),
+            "motor_direction_1": Pin(),
+            "motor_direction_2": Pin(),
+        }),
+        # Moving sensor edges closer than its debounce time are bounces
+        "debounce": _debounce(TuxDroidWingsError, {"left_button": ("stable", BUTTON_BOUNCE_TIME),
+                                                   "right_button": ("stable", BUTTON_BOUNCE_TIME),
+                                                   "moving_sensor": ("lockout", 0.1),
+                                                   }),
+        # Sensor events right after motor start are ignored
+        "startup_time": Duration(0.1),
+        "calibration": Choice(CALIBRATIONS, "full"),
+        # Reverse pulse after motor stop, a time of 0 disables braking
+        "brake": Section(TuxDroidWingsError, {
+            "dead_time": Duration(0.),
+            "time": Duration(0.03),
+        }, required=False),
+        "thermal": _thermal(TuxDroidWingsError),
+    }),
+    # Watchdog limits, a heartbeat timeout of 0 disables heartbeat checks
+    "safety": Section(TuxDroidError, {
+        "max_motor_time": Duration(10.),
+        "heartbeat_timeout": Duration(0.),
+        "watchdog_interval": Duration(0.05),
+    }, required=False),
+    # Button gesture delays
+    "gestures": Section(TuxDroidError, {
+        "double_press_time": Duration(0.3),
+        "long_press_time": Duration(0.8),
+        "combo_time": Duration(0.1),
+    }, required=False),
+    # Audio output, `auto` plays with ALSA when available
+    "speaker": Section(TuxDroidSpeakerError, {
+        "sink": Choice(("auto", "alsa", "null"), "auto"),
+        "buffer_time": Duration(0.5),
+        "period_time": Duration(0.02),
+    }, required=False),
+    # Voice activity detection, threshold is the lowest speech RMS level
+    "microphone": Section(TuxDroidMicrophoneError, {
+        "block_time": Duration(0.02),
+        "threshold": Ratio(0.02),
+        "start_time": Duration(0.06),
+        "stop_time": Duration(0.3),
+    }, required=False),
+    # Volume buttons, presses within a frame are applied at once
+    "volume": Section(TuxDroidVolumeError, {
+        "gpio": Section(TuxDroidVolumeError, {
+            "up_button": Pin(required=False),
+            "down_button": Pin(required=False),
+        }, required=False),
+        "debounce": _debounce(TuxDroidVolumeError, {"up_button": ("stable", BUTTON_BOUNCE_TIME),
+                                                    "down_button": ("stable", BUTTON_BOUNCE_TIME),
+                                                    }),
+        "level": Ratio(1.),
+        "step": Ratio(0.05),
+        "frame_time": Duration(0.1),
+    }, required=False),
+})
+
+
+class Validator():
+    """Validator compiled from a schema section
+
+    Calling the validator returns a normalized copy of the configuration
+    (GPIO numbers as int, missing timings set to their defaults)
+    and raises the exception class of the first section in error
+    with all errors in its message.
+    """
+
+    def __init__(self, section: Section, name: str):
+        self.name = name
+        self.error = section.error
+        # Sections which must be mappings: (path, error class if missing or bad)
+        self._sections = [((), section.error)]
+        self._optional = {}
+        # Flat list of (path, field, error class)
+        self._fields = []
+        self._compile(section, ())
+
+    def _compile(self, section, path):
+        """Flatten schema section"""
+        for key, field in section.fields.items():
+            if isinstance(field, Section):
+                # A missing sub section is an error of its parent
+                self._sections.append((path + (key,), section.error))
+                self._optional[path + (key,)] = not field.required
+                self._compile(field, path + (key,))
+            else:
+                self._fields.append((path + (key,), field, section.error))
+
+    def errors(self, config):
+        """Return (normalized config, list of (error class, message))"""
+        errors = []
+        # Sections, parents are always checked before their children
+        sections = {}
+        for path, error in self._sections:
+            if path and path[:-1] not in sections:
+                # Parent section already reported
+                continue
+            value = config if not path else sections[path[:-1]].get(path[-1])
+            if value is None and path and not self._optional.get(path):
+                errors.append((error, "Missing `{}` section in {} config".format(
+                    ".".join(path), self.name)))
+            elif value is None and path:
+                sections[path] = {}
+                sections[path[:-1]][path[-1]] = sections[path]
+            elif not isinstance(value, dict):
+                errors.append((error, "`{}` should be a mapping in {} config".format(
+                    ".".join(path) or self.name, self.name)))
+            else:
+                sections[path] = dict(value)
+                if path:
+                    sections[path[:-1]][path[-1]] = sections[path]
+        # Fields
+        pins = {}
+        for path, field, error in self._fields:
+            section = sections.get(path[:-1])
+            if section is None:
+                # Section already reported
+                continue
+            value = section.get(path[-1])
+            if value is None:
+                if field.required:
+                    errors.append((error, "Missing `{}` in {} config".format(
+                        ".".join(path), self.name)))
+                else:
+                    section[path[-1]] = field.default
+                continue
+            try:
+                section[path[-1]] = field.convert(value)
+            except (TypeError, ValueError):
+                errors.append((error, "`{}` should be {} in {} config".format(
+                    ".".join(path), field.describe(), self.name)))
+                continue
+            if isinstance(field, Pin):
+                pins.setdefault(section[path[-1]], []).append(".".join(path))
+        # Pin collisions
+        for pin, names in sorted(pins.items()):
+            if len(names) > 1:
+                errors.append((self.error, "GPIO {} used by {} in {} config".format(
+                    pin, ", ".join(names), self.name)))
+        return sections.get((), {}), errors
+
+    def __call__(self, config):
+        normalized, errors = self.errors(config)
+        if errors:
+            raise errors[0][0]("; ".join(message for _, message in errors))
+        return normalized
+
+
+def _sub_section(path):
+    """Get schema section from its path"""
+    section = SCHEMA
+    for key in path:
+        section = section.fields[key]
+    return section
+
+
+# Compiled validators
+VALIDATORS = {
+    "tuxdroid": Validator(SCHEMA, "tuxdroid"),
+    "wings": Validator(_sub_section(("wings",)), "wings"),
+    "head": Validator(_sub_section(("head",)), "head"),
+    "eyes": Validator(_sub_section(("head", "eyes")), "eyes"),
+    "mouth": Validator(_sub_section(("head", "mouth")), "mouth"),
+    "volume": Validator(_sub_section(("volume",)), "volume"),
+}
+
+
+def validate(config, component: str = "tuxdroid", parts=None):
+    """Validate and normalize a component configuration
+
+    parts: for the `tuxdroid` component, only validate these parts
+    """
+    if component == "tuxdroid" and parts is not None:
+        key = ("tuxdroid",) + tuple(sorted(parts))
+        validator = VALIDATORS.get(key)
+        if validator is None:
+            # Keep the parts order of the schema and optional sections
+            fields = {part: section for part, section in SCHEMA.fields.items()
+                      if part in parts or not section.required}
+            validator = Validator(Section(TuxDroidError, fields), "tuxdroid")
+            VALIDATORS[key] = validator
+        return validator(config)
+    return VALIDATORS[component](config)
+
+
+def load_config(path: str, cache: bool = False):
+    """Load a yaml configuration file
+
+    The libyaml (C) loader is used when available.
+    cache: keep a pre-parsed copy of the file next to it, used
+           while the yaml file modification time does not change
+    """
+    logger = logging.getLogger("tuxdroid").getChild("config")
+    cache_path = os.path.join(os.path.dirname(path),
+                              ".{}.cache".format(os.path.basename(path)))
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if cache:
+        try:
+            with open(cache_path, "rb") as fhc:
+                cached_key, config = marshal.load(fhc)
+            if tuple(cached_key) == key:
+                return config
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path) as fhc:
+        config = yaml.load(fhc, Loader=loader)
+    if cache:
+        try:
+            with open(cache_path, "wb") as fhc:
+                marshal.dump((key, config), fhc)
+        except (OSError, ValueError):
+            logger.warning("Can not write config cache %s", cache_path)
+    return config
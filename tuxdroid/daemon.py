@@ -0,0 +1,227 @@
+"""Module defining TuxDroid daemon
+
+The daemon owns a single TuxDroid, so the robot is calibrated once,
+and accepts commands from local (Unix socket) or remote (TCP) clients.
+
+The protocol is line based, one JSON object per line.
+Clients can send many requests without waiting for responses (pipelining).
+Each request gets exactly one response, sent when the command is done,
+so responses of blocking commands can come out of order::
+
+    --> {"id": 1, "cmd": "wings.move", "args": [2]}
+    --> {"id": 2, "cmd": "eyes.led_on", "args": ["left"]}
+    <-- {"id": 2, "ok": true, "result": null}
+    <-- {"id": 1, "ok": true, "result": null}
+
+Errors are reported in the response::
+
+    <-- {"id": 3, "ok": false, "error": "Unknown command `foo`"}
+
+After a ``subscribe`` request, component events are sent to the client::
+
+    <-- {"event": "wings.left"}
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import logging
+import os
+import socketserver
+import threading
+
+from tuxdroid.commands import COMMANDS, Dispatcher
+from tuxdroid.errors import TuxDroidError, TuxDroidCommandError
+
+
+DEFAULT_UNIX_ADDRESS = "/tmp/tuxdroid.sock"
+
+
+def format_error(exp):
+    """Get error message from a TuxDroid exception
+
+    TuxDroid exceptions are raised with logging style arguments
+    """
+    if len(exp.args) > 1:
+        try:
+            return exp.args[0] % exp.args[1:]
+        except TypeError:
+            pass
+    return " ".join(str(arg) for arg in exp.args)
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    """Handle one client connection"""
+
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+
+    def handle(self):
+        daemon = self.server.tux_daemon
+        daemon._logger.info("Client connected")
+        try:
+            for line in self.rfile:
+                line = line.strip()
+                if line:
+                    daemon._handle_line(self, line)
+        finally:
+            daemon.dispatcher.unsubscribe(self.send_event)
+            daemon._logger.info("Client disconnected")
+
+    def send(self, message: dict):
+        """Send a message to the client"""
+        data = json.dumps(message).encode() + b"\n"
+        with self._write_lock:
+            try:
+                self.wfile.write(data)
+            except OSError:
+                self.server.tux_daemon._logger.warning("Client connection lost")
+
+    def send_event(self, event: str):
+        """Send an event to the client"""
+        self.send({"event": event})
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded Unix socket server"""
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP server"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TuxDroidDaemon():
+    """TuxDroid daemon
+
+    address: Unix socket path (str) or TCP (host, port) tuple
+
+    Non blocking commands (leds, stop, ...) are run as soon as they are read.
+    Blocking commands are queued per part, so commands on wings
+    and head run at the same time but in order for each part.
+    """
+    def __init__(self, tux, address=DEFAULT_UNIX_ADDRESS):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("daemon")
+        # Set attributes
+        self.tux = tux
+        self.dispatcher = Dispatcher(tux)
+        # One worker per part keeps commands ordered
+        self._queues = {"wings": ThreadPoolExecutor(max_workers=1),
+                        "head": ThreadPoolExecutor(max_workers=1),
+                        "": ThreadPoolExecutor(max_workers=1),
+                        }
+        # Create server
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = _UnixServer(address, _ConnectionHandler)
+        else:
+            self._server = _TCPServer(tuple(address), _ConnectionHandler)
+        self._server.tux_daemon = self
+
+    @property
+    def address(self):
+        """Listening address"""
+        return self._server.server_address
+
+    def serve_forever(self):
+        """Handle requests until shutdown"""
+        self._logger.info("Daemon listening on %s", self.address)
+        self._server.serve_forever()
+
+    def start(self):
+        """Handle requests in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, name="tuxdroid-daemon")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """Stop the daemon"""
+        self._server.shutdown()
+        self._server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        for queue in self._queues.values():
+            queue.shutdown(wait=False)
+
+    def _handle_line(self, connection, line: bytes):
+        """Parse and run a request"""
+        try:
+            request = json.loads(line.decode())
+            req_id = request.get("id")
+            cmd = request["cmd"]
+            args = request.get("args", [])
+        except (ValueError, KeyError, AttributeError):
+            connection.send({"id": None, "ok": False, "error": "Bad request"})
+            return
+        if not isinstance(cmd, str):
+            connection.send({"id": req_id, "ok": False,
+                             "error": "Bad request: `cmd` should be a string"})
+            return
+        if cmd == "subscribe":
+            try:
+                self.dispatcher.subscribe(connection.send_event)
+            except TuxDroidError as exp:
+                connection.send({"id": req_id, "ok": False, "error": format_error(exp)})
+            else:
+                connection.send({"id": req_id, "ok": True, "result": None})
+        elif cmd == "unsubscribe":
+            self.dispatcher.unsubscribe(connection.send_event)
+            connection.send({"id": req_id, "ok": True, "result": None})
+        elif cmd in COMMANDS and Dispatcher.is_blocking(cmd):
+            path = COMMANDS[cmd][0]
+            self._queues[path[0] if path else ""].submit(self._run, connection,
+                                                         req_id, cmd, args)
+        else:
+            self._run(connection, req_id, cmd, args)
+
+    def _run(self, connection, req_id, cmd: str, args):
+        """Run a command and send its response"""
+        try:
+            result = self.dispatcher.call(cmd, args)
+        except TuxDroidError as exp:
+            connection.send({"id": req_id, "ok": False, "error": format_error(exp)})
+        except Exception as exp:  # pylint: disable=W0703
+            self._logger.exception("Command `%s` failed", cmd)
+            connection.send({"id": req_id, "ok": False, "error": repr(exp)})
+        else:
+            connection.send({"id": req_id, "ok": True, "result": result})
+
+
+def main(argv=None):
+    """Run TuxDroid daemon"""
+    # Import here to keep the module light for clients
+    from tuxdroid.tuxdroid import TuxDroid
+
+    parser = argparse.ArgumentParser(description="TuxDroid daemon")
+    parser.add_argument("config", help="yaml configuration file")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--unix", default=DEFAULT_UNIX_ADDRESS, help="Unix socket path")
+    group.add_argument("--tcp", help="TCP address as HOST:PORT")
+    args = parser.parse_args(argv)
+
+    address = args.unix
+    if args.tcp:
+        host, port = args.tcp.rsplit(":", 1)
+        try:
+            address = (host, int(port))
+        except ValueError:
+            raise TuxDroidCommandError("Bad TCP address `{}`".format(args.tcp))
+
+    tux = TuxDroid(args.config)
+    daemon = TuxDroidDaemon(tux, address)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+        tux.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Module defining TuxDroid software debounce
+
+Each input pin gets its own debouncer, configured with an algorithm
+and a bounce time, which filters timestamped edges before calling the component:
+
+* ``lockout``: an edge is accepted if the last accepted edge is older than
+  the bounce time. It is the RPi.GPIO `bouncetime` behaviour.
+* ``stable``: an edge is accepted if the line was quiet (no edge at all)
+  during the bounce time before it. Bounce bursts keep the line busy so only their
+  first edge is accepted, and a new press is accepted as soon as the
+  previous burst settled.
+
+Both algorithms deliver the first edge right away, without waiting.
+
+Buttons only detect RISING edges, and release bounces give rising edges too.
+Button debouncers get a `pressed` function and re-read the level once the
+line was quiet for the bounce time. A burst starting while the button is
+held is a release, or a press after a release without bounces: it is
+delivered one bounce time late, only if the button is held when it settled.
+"""
+import time
+
+from tuxdroid.errors import TuxDroidError
+from tuxdroid.scheduler import get_scheduler
+
+
+ALGORITHMS = ("lockout", "stable")
+
+
+def button_held(gpio, pin: int):
+    """Get a function returning True while a button is held (HIGH)"""
+    def held():
+        return gpio.input(pin) == gpio.HIGH
+    return held
+
+
+class Debouncer():
+    """Debounce edges of one GPIO
+
+    The debouncer is the callable given to `GPIO.add_event_detect`,
+    it calls `callback(gpio_id)` for each accepted edge.
+    pressed: function returning True while the button is held,
+             None for inputs which are not buttons
+    """
+    def __init__(self, callback, algorithm: str = "stable", bounce_time: float = 0.02,
+                 clock=time.monotonic, pressed=None):
+        if algorithm not in ALGORITHMS:
+            raise TuxDroidError("Bad debounce algorithm `{}`, should be in {}".format(
+                algorithm, ALGORITHMS))
+        self.callback = callback
+        self.algorithm = algorithm
+        self.bounce_time = bounce_time
+        self._clock = clock
+        self.pressed = pressed
+        self._stable = algorithm == "stable"
+        # Button level after the last burst settled, and the timer reading it
+        self._held = False
+        self._settle_timer = None
+        # Edge waiting for the settled level, and its GPIO
+        self._deferred = False
+        self._gpio_id = None
+        # Last raw and accepted edge timestamps
+        self._last_edge = None
+        self._last_accepted = None
+        # Statistics
+        self.accepted = 0
+        self.rejected = 0
+        # Rejected edges of release bounces
+        self.releases = 0
+        self.shortest_interval = None
+        self.longest_rejected_interval = None
+
+    def accept(self, timestamp: float):
+        """Return True if the edge at `timestamp` is not a bounce"""
+        last_edge = self._last_edge
+        self._last_edge = timestamp
+        if last_edge is not None:
+            interval = timestamp - last_edge
+            if self.shortest_interval is None or interval < self.shortest_interval:
+                self.shortest_interval = interval
+        if self._held:
+            if self._deferred:
+                self.rejected += 1
+            else:
+                # Decided by `settle` from the level
+                self._deferred = True
+            return False
+        reference = last_edge if self._stable else self._last_accepted
+        if reference is None or timestamp - reference >= self.bounce_time:
+            self._last_accepted = timestamp
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        interval = timestamp - reference
+        if self.longest_rejected_interval is None or interval > self.longest_rejected_interval:
+            self.longest_rejected_interval = interval
+        return False
+
+    def __call__(self, gpio_id):
+        self._gpio_id = gpio_id
+        accepted = self.accept(self._clock())
+        if self.pressed is not None:
+            # Read the level once the line is quiet
+            timer = self._settle_timer
+            if timer is not None:
+                timer.cancel()
+            self._settle_timer = get_scheduler().call_later(self.bounce_time, self.settle)
+        if accepted:
+            self.callback(gpio_id)
+
+    def settle(self):
+        """Read the button level after a burst settled
+
+        Return True if a deferred edge was a press, it is then delivered
+        """
+        self._settle_timer = None
+        self._held = bool(self.pressed())
+        deferred, self._deferred = self._deferred, False
+        if not deferred:
+            return False
+        if not self._held:
+            self.rejected += 1
+            self.releases += 1
+            return False
+        self._last_accepted = self._last_edge
+        self.accepted += 1
+        if self._gpio_id is not None:
+            self.callback(self._gpio_id)
+        return True
+
+    def reset(self):
+        """Forget edge history and statistics"""
+        self._held = False
+        self._deferred = False
+        self._last_edge = None
+        self._last_accepted = None
+        self.accepted = 0
+        self.rejected = 0
+        self.releases = 0
+        self.shortest_interval = None
+        self.longest_rejected_interval = None
+
+    def stats(self):
+        """Get debounce statistics"""
+        total = self.accepted + self.rejected
+        return {"algorithm": self.algorithm,
+                "bounce_time": self.bounce_time,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "releases": self.releases,
+                "rejected_ratio": self.rejected / total if total else 0.,
+                "shortest_interval": self.shortest_interval,
+                "longest_rejected_interval": self.longest_rejected_interval,
+                }
+
+
+class DebouncerSet():
+    """Debouncers of the GPIOs of a component
+
+    config: `debounce` section of the component, {gpio name: {algorithm, time}}
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self._debouncers = {}
+
+    def add(self, gpio_name: str, callback, pressed=None):
+        """Get a new debouncer calling `callback` for a GPIO
+
+        pressed: function returning True while the button is held, for buttons
+        """
+        config = self.config[gpio_name]
+        debouncer = Debouncer(callback, config['algorithm'], config['time'], pressed=pressed)
+        self._debouncers[gpio_name] = debouncer
+        return debouncer
+
+    def stats(self):
+        """Get debounce statistics of each GPIO"""
+        return {name: debouncer.stats() for name, debouncer in self._debouncers.items()}
@@ -24,3 +24,33 @@ class TuxDroidEyesError(TuxDroidError):
 class TuxDroidMouthError(TuxDroidError):
     """class for wings exceptions"""
     pass
+
+
+class TuxDroidCommandError(TuxDroidError):
+    """class for remote command exceptions"""
+    pass
+
+
+class TuxDroidThermalError(TuxDroidError):
+    """class for motor thermal protection exceptions"""
+    pass
+
+
+class TuxDroidGestureError(TuxDroidError):
+    """class for gesture exceptions"""
+    pass
+
+
+class TuxDroidSpeakerError(TuxDroidError):
+    """class for speaker exceptions"""
+    pass
+
+
+class TuxDroidMicrophoneError(TuxDroidError):
+    """class for microphone exceptions"""
+    pass
+
+
+class TuxDroidVolumeError(TuxDroidError):
+    """class for volume button exceptions"""
+    pass
@@ -1,18 +1,20 @@
 """Module defining TuxDroid Eyes"""
 # pylint: disable=R0801
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
+import threading
 import time
-import types
 
+from tuxdroid.calibration import CALIBRATIONS, report, sensor_position, wait_for_sensor
+from tuxdroid.callbacks import CallbackRegistry, callbacks_property
+from tuxdroid.config import validate
+from tuxdroid.debounce import DebouncerSet
 from tuxdroid.gpio import GPIO
+from tuxdroid.thermal import motor_budget
 from tuxdroid.errors import TuxDroidEyesError
-
-
-# Bounce time for rising edge detection: 100ms
-BOUNCE_TIME = 0.1
-# TODO Improve button bounce time
-BUTTON_BOUNCE_TIME = 0.25
+from tuxdroid.positions import EYELID, Position, StateMachine
+from tuxdroid.scheduler import get_scheduler
+from tuxdroid.state import StateCell, state_property
 
 
 class Eyes():
@@ -21,42 +23,62 @@ class Eyes():
     .. todo:: Missing led blink speed control (using PWM, need to find PWN frequency/duty cycle)
 
     .. todo:: Missing led intensity control (using PWM, need to find PWN frequency/duty cycle)
+
+    gpio: GPIO backend, the module `GPIO` by default
     """
-    def __init__(self, head, config: dict):
+    # Attributes stored in the state snapshot
+    position = state_property("position")
+    is_moving = state_property("is_moving")
+    _move_count = state_property("count")
+    _wanted_moves = state_property("wanted_moves")
+    _motor_start_time = state_property("motor_start_time")
+    # Registered callbacks
+    _opened_callbacks = callbacks_property("opened")
+    _closed_callbacks = callbacks_property("closed")
+
+    def __init__(self, head, config: dict, gpio=None):
         # Get logger
         self._logger = logging.getLogger("tuxdroid").getChild("head").getChild("eyes")
         # Set attributes
         self._head = head
+        self._state = StateCell()
+        self.state_machine = StateMachine(EYELID, TuxDroidEyesError)
         self.is_ready = False
-        self.is_moving = False
         self.is_calibrated = False
+        # CalibrationReport of the last calibration
+        self.calibration = None
         self.led_right = None
         self.led_left = None
-        self.position = None
+        # Monotonic time of the last motor start
+        self.motor_started_at = None
         # Privates
-        self._move_count = 0
-        self._wanted_moves = None
-        self._motor_start_time = None
-        self._gpio_names = ('opened_sensor', 'closed_sensor', 'motor',
-                            'left_led', 'right_led')
+        self._gpio = gpio or GPIO
+        self._calibrating = False
         # Validate config
         self.config = config
         self._check_config()
         # Set GPUIO
-        GPIO.setmode(GPIO.BCM)
-        self._opened_sensor = int(config.get("gpio").get('opened_sensor'))
-        GPIO.setup(self._opened_sensor, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._closed_sensor = int(config.get("gpio").get('closed_sensor'))
-        GPIO.setup(self._closed_sensor, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._right_led = int(config.get("gpio").get('right_led'))
-        GPIO.setup(self._right_led, GPIO.OUT)
-        self._left_led = int(config.get("gpio").get('left_led'))
-        GPIO.setup(self._left_led, GPIO.OUT)
+        self._gpio.setmode(self._gpio.BCM)
+        self._opened_sensor = self.config['gpio']['opened_sensor']
+        self._gpio.setup(self._opened_sensor, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._closed_sensor = self.config['gpio']['closed_sensor']
+        self._gpio.setup(self._closed_sensor, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._right_led = self.config['gpio']['right_led']
+        self._gpio.setup(self._right_led, self._gpio.OUT)
+        self._left_led = self.config['gpio']['left_led']
+        self._gpio.setup(self._left_led, self._gpio.OUT)
         # Callbacks
-        self._opened_callbacks = set()
-        self._closed_callbacks = set()
+        self._debouncers = DebouncerSet(self.config['debounce'])
+        # Notified on each position change and stop
+        self._moved = threading.Condition()
         # Thread pool
         self._thread_pool = ThreadPoolExecutor()
+        self._callbacks = CallbackRegistry("eyes", ("opened", "closed"), TuxDroidEyesError,
+                                           self._thread_pool, self._logger)
+        # Photodetector sampler, built by start_light_sensor()
+        self.light = None
+        # Motor on-time accounting, done by head component
+        self.thermal = motor_budget("eyes", self.config['thermal'], self.stop)
         # we need to call calibrate() which is done by head component
 
     def led_on(self, side: str = None):
@@ -69,15 +91,15 @@ class Eyes():
         """
         if side is None:
             # Power on left and right leds
-            GPIO.output(self._right_led, GPIO.HIGH)
-            GPIO.output(self._left_led, GPIO.HIGH)
+            self._gpio.output(self._right_led, self._gpio.HIGH)
+            self._gpio.output(self._left_led, self._gpio.HIGH)
             self.led_right = True
             self.led_left = True
         elif side not in ("right", "left"):
             raise TuxDroidEyesError("Bad side should be `right` or `left`")
         else:
             # Power on right or left led
-            GPIO.output(getattr(self, '_{}_led'.format(side)), GPIO.HIGH)
+            self._gpio.output(getattr(self, '_{}_led'.format(side)), self._gpio.HIGH)
             setattr(self, 'led_{}'.format(side), True)
 
     def led_off(self, side: str = None):
@@ -88,59 +110,97 @@ class Eyes():
         """
         if side is None:
             # Power off left and right leds
-            GPIO.output(self._right_led, GPIO.LOW)
-            GPIO.output(self._left_led, GPIO.LOW)
+            self._gpio.output(self._right_led, self._gpio.LOW)
+            self._gpio.output(self._left_led, self._gpio.LOW)
             self.led_right = False
             self.led_left = False
         elif side not in ("right", "left"):
             raise TuxDroidEyesError("Bad side should be `right` or `left`")
         else:
             # Power off right or left led
-            GPIO.output(getattr(self, '_{}_led'.format(side)), GPIO.LOW)
+            self._gpio.output(getattr(self, '_{}_led'.format(side)), self._gpio.LOW)
             setattr(self, 'led_{}'.format(side), False)
 
-    def led_blink(self, times: int, side: str = None):
+    def led_blink(self, times: int, side: str = None, interval: float = 0.5,
+                  wait: bool = True):
         """Blink eye leds
 
         side: 'left', 'right' or None
               None means both leds
+        interval: seconds between each led change
+        wait: if False, return a future done when blinking ends
+              instead of waiting for it. Blinking runs in the scheduler
+              thread, so it can not be waited for from there (like in
+              fake GPIO edge callbacks)
         """
+        scheduler = get_scheduler()
+        if wait and scheduler.in_thread():
+            raise TuxDroidEyesError("Blinking can not be waited for from the scheduler thread, "
+                                    "use `wait=False`")
         self.led_off(side)
-        time.sleep(0.5)
-        for _ in range(times):
-            self.led_on(side)
-            time.sleep(0.5)
-            self.led_off(side)
-            time.sleep(0.5)
+        done = Future()
+        steps = iter(range(2 * times))
+
+        def blink_step():
+            """Switch leds, the last step only ends blinking"""
+            step = next(steps, None)
+            if step is None:
+                timer.cancel()
+                done.set_result(None)
+            elif step % 2 == 0:
+                self.led_on(side)
+            else:
+                self.led_off(side)
+
+        timer = scheduler.call_every(interval, blink_step)
+        if not wait:
+            return done
+        return done.result()
+
+    def start_light_sensor(self, read=None):
+        """Start sampling the photodetector
+
+        read: function returning the light level between 0 and 1 (like an ADC
+              channel), the `photodetector` GPIO by default
+        """
+        if self.light is None:
+            # Import here: it loads NumPy, only needed with a photodetector
+            from tuxdroid.light import gpio_reader, light_sensor
+            if read is None:
+                pin = self.config['gpio']['photodetector']
+                if pin is None:
+                    raise TuxDroidEyesError("No photodetector GPIO in eyes config")
+                self._gpio.setup(pin, self._gpio.IN)
+                read = gpio_reader(self._gpio, pin)
+            self.light = light_sensor(self.config['light'], read)
+        self.light.start()
+        return self.light
 
     def _check_config(self):
-        """Validate config"""
-        if not self.config.get('gpio'):
-            raise TuxDroidEyesError("Missing `gpio` section in eyes config")
-        for gpio_name in self._gpio_names:
-            if gpio_name not in self.config.get('gpio'):
-                raise TuxDroidEyesError("Missing `%s` section in `gpio` section "
-                                        "in eyes config", gpio_name)
-            try:
-                int(self.config.get('gpio').get(gpio_name))
-            except ValueError:
-                raise TuxDroidEyesError("`gpio.%s` should be a integer", gpio_name)
+        """Validate config and set timing defaults"""
+        self.config = validate(self.config, "eyes")
+
+    def state(self):
+        """Get an immutable snapshot of the eyes state"""
+        return self._state.snapshot()
 
     def _set_callbacks(self):
         """Set button callbacks"""
         for position in ("opened", "closed"):
             sensor = getattr(self, "_{}_sensor".format(position))
             callback = getattr(self, "_{}_event".format(position))
-            GPIO.remove_event_detect(sensor)
-            GPIO.add_event_detect(sensor,
-                                  GPIO.RISING,
-                                  callback=callback,
-                                  bouncetime=int(BUTTON_BOUNCE_TIME * 1000))
+            self._gpio.remove_event_detect(sensor)
+            debouncer = self._debouncers.add("{}_sensor".format(position), callback)
+            self._gpio.add_event_detect(sensor, self._gpio.RISING, callback=debouncer)
+
+    def debounce_stats(self):
+        """Get debounce statistics of each GPIO"""
+        return self._debouncers.stats()
 
     def _opened_event(self, gpio_id):
         """Opened eyes event callback"""
         # We have to not consider the first event
-        if time.time() - self._motor_start_time < 0.2:
+        if time.time() - self._motor_start_time < self.config['startup_time']:
             # Maybe we want a debug ?
             self._logger.warning("Startup wings event detected, ignoring it")
             return
@@ -150,19 +210,15 @@ class Eyes():
             self._logger.error("Bad opened sensor GPIO id")
             raise TuxDroidEyesError("Bad GPIO id when opening")
 
-        self.position = "OPENED"
-        self._move_count += 1
-        if isinstance(self._wanted_moves, int) and self._move_count >= self._wanted_moves:
-            self._wanted_moves = None
+        if self._reached("opened"):
             self.stop()
-        for callback in self._opened_callbacks:
-            self._logger.debug("Calling: %s", callback.__name__)
-            self._thread_pool.submit(callback)
+        self._notify_move()
+        self._callbacks.dispatch("opened", position=self.position)
 
     def _closed_event(self, gpio_id):
         """Closed eyes event callback"""
         # We have to not consider the first event
-        if time.time() - self._motor_start_time < 0.2:
+        if time.time() - self._motor_start_time < self.config['startup_time']:
             # Maybe we want a debug ?
             self._logger.warning("Startup wings event detected, ignoring it")
             return
@@ -172,74 +228,112 @@ class Eyes():
             self._logger.error("Bad closed sensor GPIO id")
             raise TuxDroidEyesError("Bad GPIO id when closing")
 
-        self.position = "CLOSED"
-        self._move_count += 1
-        if isinstance(self._wanted_moves, int) and self._move_count >= self._wanted_moves:
-            self._wanted_moves = None
+        if self._reached("closed"):
             self.stop()
-        for callback in self._closed_callbacks:
-            self._logger.debug("Calling: %s", callback.__name__)
-            self._thread_pool.submit(callback)
-
-    def add_callback(self, position: str, callback):
-        """Add callback"""
+        self._notify_move()
+        self._callbacks.dispatch("closed", position=self.position)
+
+    def _reached(self, event: str):
+        """Record a sensor event, return True if wanted moves are done"""
+        def changes(state):
+            """State changes of a movement"""
+            count = state.count + 1
+            wanted_moves = state.wanted_moves
+            if isinstance(wanted_moves, int) and count >= wanted_moves:
+                wanted_moves = None
+            return {"position": self.state_machine.next(state.position, event),
+                    "count": count, "wanted_moves": wanted_moves}
+
+        old, new = self._state.modify(changes)
+        self.state_machine.record(old.position, event, new.position)
+        return old.wanted_moves is not None and new.wanted_moves is None
+
+    def _motor_starting(self):
+        """Reset movement state before the head starts the motor"""
+        self._state.update(motor_start_time=time.time(), count=0)
+
+    def add_callback(self, position: str, callback, inline: bool = False):
+        """Add callback, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument
+        inline: run the callback in the GPIO event thread, it must be short
+                (see `tuxdroid.callbacks.INLINE_BUDGET`)
+        """
         if position not in ("closed", "opened"):
             raise TuxDroidEyesError("Bad position, should be 'closed' or 'opened'")
-        if not isinstance(callback, types.FunctionType):
-            raise TuxDroidEyesError("Callback `%s` is not a function", callback)
-
-        callbacks = getattr(self, "_{}_callbacks".format(position))
-        if callback in callbacks:
-            self._logger.warning("Callback `%s` already registered to `%s` eyes",
-                                 callback.__name__, position)
-        else:
-            self._logger.info("Adding callback `%s` to `%s` eyes", callback.__name__, position)
-            callbacks.add(callback)
+        return self._callbacks.add(position, callback, "`{}` eyes".format(position), inline)
 
     def del_callback(self, position: str, callback):
         """Delete callback"""
         if position not in ("closed", "opened"):
             raise TuxDroidEyesError("Bad position, should be 'closed' or 'opened'")
+        self._callbacks.remove(position, callback, "`{}` eyes".format(position))
 
-        callbacks = getattr(self, "_{}_callbacks".format(position))
-        if callback not in callbacks:
-            self._logger.warning("Callback `%s` not registered to `%s` eyes",
-                                 callback.__name__, position)
-        else:
-            self._logger.info("Deleting callback `%s` to `%s` eyes", callback.__name__, position)
-            callbacks.remove(callback)
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
+
+    def calibrate(self, strategy: str = None):
+        """Moving eyes until it reaches the closed positiion
 
-    def calibrate(self):
-        """Moving eyes until it reaches the closed positiion"""
+        strategy: `fast` or `full`, see `tuxdroid.calibration`, config value by default
+        """
+        strategy = strategy or self.config['calibration']
+        if strategy not in CALIBRATIONS:
+            raise TuxDroidEyesError("Bad calibration, should be one of {}".format(CALIBRATIONS))
         # Calibration
         self._logger.info("Eyes calibration starting")
+        self._calibrating = True
+        start = time.monotonic()
         # Init variables
         eyes_nb_moves = 0
-        # Start moving
-        self.start()
-        # Start init
-        while eyes_nb_moves < 2:
-            # Wait for Rising edge
-            GPIO.wait_for_edge(self._opened_sensor, GPIO.RISING)
-            eyes_nb_moves += 1
-        # Set position
-        self.position = "OPENED"
-        # Stop moving
-        self.stop()
+        position = None
+        if strategy == "fast":
+            # An active position sensor gives the position without moving
+            position = sensor_position(self._gpio, self._opened_sensor, self._closed_sensor)
+        if position is not None:
+            self.position = position
+        else:
+            # Start moving
+            self.start()
+            # Start init
+            try:
+                while eyes_nb_moves < 2:
+                    # Wait for Rising edge
+                    wait_for_sensor(self._gpio, self._opened_sensor, lambda: self.is_moving,
+                                    TuxDroidEyesError)
+                    eyes_nb_moves += 1
+            except TuxDroidEyesError:
+                self._calibrating = False
+                raise
+            # Set position
+            self.position = Position.OPENED
+            # Stop moving
+            self.stop()
+        self.calibration = report("eyes", strategy, start, eyes_nb_moves)
         # Eyes should be closed
         self.is_calibrated = True
-        self._logger.info("Eyes calibration done")
+        self._calibrating = False
+        self._logger.info("Eyes calibration done: %.2fs, %d moves saved",
+                          self.calibration.time, self.calibration.moves_saved)
         # Set callbacks
         self._set_callbacks()
         # Set it as ready
         self.is_ready = True
 
+    def _ensure_calibrated(self):
+        """Calibrate eyes on first move if it was not done at startup"""
+        if not self.is_calibrated and not self._calibrating:
+            self.calibrate()
+
     def set_position(self, position):
         """Move eyes to a position"""
-        position = position.upper()
-        if position not in ["OPENED", "CLOSED"]:
+        position = self.state_machine.target(position)
+        if position is None:
             self._logger.error("Bad eyes position")
             raise TuxDroidEyesError("Bad eyes position")
+        self._ensure_calibrated()
         # Do nothing if already in position
         if self.position == position:
             self._logger.info("Eyes already in %s position", position)
@@ -248,10 +342,12 @@ class Eyes():
         self.start()
         # Wait for position
         # TODO add timeout
-        while self.position != position:
-            pass
+        with self._moved:
+            self._moved.wait_for(lambda: self.position == position or not self.is_moving)
         # Stop moving
         self.stop()
+        if self.position != position:
+            raise TuxDroidEyesError("Eyes stopped before reaching %s position" % position)
 
     def close(self):  # pylint: disable=C0103
         """Move head up"""
@@ -268,17 +364,28 @@ class Eyes():
 
         The count is incremented each time head are in OPENED or CLOSED position
         """
-        self._move_count = 0
-        self._wanted_moves = times
+        self._ensure_calibrated()
+        self._state.update(count=0, wanted_moves=times)
         # Start moving
         self.start()
-        while self.is_moving:
+        with self._moved:
             # Wait for the count
-            time.sleep(0.01)
+            self._moved.wait_for(lambda: not self.is_moving)
         # Stop moving
         self.stop()
         self._move_count = 0
 
+    def _notify_move(self, blocking: bool = True):
+        """Wake up threads waiting for a position or a stop
+
+        blocking: if False, give up when another thread holds the condition
+        """
+        if self._moved.acquire(blocking):
+            try:
+                self._moved.notify_all()
+            finally:
+                self._moved.release()
+
     def stop(self):
         """Stop moving eyes"""
         self._head.stop("eyes")
@@ -0,0 +1,210 @@
+"""Module defining TuxDroid button gestures
+
+Debounced button presses go through a state machine per button:
+
+* ``press``: one press, reported when the double press delay is over
+* ``double_press``: a second press before the double press delay
+* ``long_press``: the button is still held after the long press delay
+  (only for buttons which can read their level)
+
+Presses of several buttons within the combo delay are reported
+as one combo event, named after its buttons: ``wings.left+wings.right``.
+
+Timeouts are handled by the shared scheduler, there is no thread per button.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from tuxdroid.callbacks import CallbackRegistry
+from tuxdroid.errors import TuxDroidGestureError
+from tuxdroid.scheduler import get_scheduler
+
+
+GESTURES = ("press", "double_press", "long_press")
+
+DEFAULT_COMBOS = (("wings.left", "wings.right"),
+                  ("head", "wings.left"),
+                  ("head", "wings.right"),
+                  )
+
+
+def combo_name(buttons):
+    """Get combo event name from its buttons"""
+    return "+".join(sorted(buttons))
+
+
+class _Button():
+    """Gesture state of one button"""
+
+    __slots__ = ("name", "is_pressed", "state", "first_press", "timer")
+
+    def __init__(self, name, is_pressed):
+        self.name = name
+        self.is_pressed = is_pressed
+        # idle, pending (waiting for a second press) or held (waiting for long press)
+        self.state = "idle"
+        self.first_press = None
+        self.timer = None
+
+    def reset(self):
+        """Go back to idle state"""
+        if self.timer is not None:
+            self.timer.cancel()
+        self.state = "idle"
+        self.first_press = None
+        self.timer = None
+
+
+class GestureRecognizer():
+    """Recognize gestures from button presses
+
+    .. code-block:: python
+
+        tux.gestures.add_callback("wings.left.double_press", callback)
+        tux.gestures.add_callback("wings.left+wings.right", callback)
+    """
+    def __init__(self, double_press_time: float = 0.3, long_press_time: float = 0.8,
+                 combo_time: float = 0.1, combos=DEFAULT_COMBOS, scheduler=None):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("gestures")
+        if long_press_time <= double_press_time:
+            raise TuxDroidGestureError("Long press time should be longer than double "
+                                       "press time")
+        # Set attributes
+        self.double_press_time = double_press_time
+        self.long_press_time = long_press_time
+        self.combo_time = combo_time
+        # Privates
+        self._scheduler = scheduler or get_scheduler()
+        self._buttons = {}
+        self._combos = set()
+        self._lock = threading.Lock()
+        self._thread_pool = ThreadPoolExecutor()
+        # Events are added with buttons and combos
+        self._callbacks = CallbackRegistry("gestures", (), TuxDroidGestureError,
+                                           self._thread_pool, self._logger)
+        for buttons in combos:
+            self.add_combo(*buttons)
+
+    def add_button(self, name: str, is_pressed=None):
+        """Add a button
+
+        is_pressed: function returning True while the button is held,
+                    needed for long presses
+        """
+        with self._lock:
+            self._buttons[name] = _Button(name, is_pressed)
+        self._callbacks.add_events(*("{}.{}".format(name, gesture) for gesture in GESTURES))
+
+    def add_combo(self, *buttons):
+        """Add a combo of buttons pressed together"""
+        if len(buttons) < 2:
+            raise TuxDroidGestureError("A combo needs at least 2 buttons")
+        self._combos.add(frozenset(buttons))
+        self._callbacks.add_events(combo_name(buttons))
+
+    def events(self):
+        """Get all event names"""
+        events = ["{}.{}".format(name, gesture)
+                  for name in sorted(self._buttons) for gesture in GESTURES]
+        return events + sorted(combo_name(combo) for combo in self._combos)
+
+    def _check_event(self, event):
+        """Raise if the event name is not a gesture or a combo"""
+        if "+" in event:
+            if frozenset(event.split("+")) not in self._combos:
+                raise TuxDroidGestureError("Unknown combo `{}`".format(event))
+        elif event.rpartition(".")[2] not in GESTURES:
+            raise TuxDroidGestureError("Bad event `{}`, should end with one of {}".format(
+                event, GESTURES))
+
+    def add_callback(self, event: str, callback, inline: bool = False):
+        """Add callback, return its Subscription
+
+        Callbacks with a required argument get an `Event`, its source
+        is the gesture event, like "wings.left.double_press"
+        inline: run the callback in the thread reporting the gesture
+        """
+        self._check_event(event)
+        # Buttons of the event can be added later
+        self._callbacks.add_events(event)
+        return self._callbacks.add(event, callback, "`{}`".format(event), inline)
+
+    def del_callback(self, event: str, callback):
+        """Delete callback"""
+        self._check_event(event)
+        self._callbacks.add_events(event)
+        self._callbacks.remove(event, callback, "`{}`".format(event))
+
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks, per event"""
+        return self._callbacks.stats()
+
+    def _emit(self, event):
+        """Call event callbacks"""
+        self._logger.info("Gesture %s", event)
+        self._callbacks.dispatch(event, event)
+
+    def press(self, name: str, timestamp: float = None):
+        """Feed a debounced press of a button"""
+        if timestamp is None:
+            timestamp = self._scheduler.time()
+        events = []
+        with self._lock:
+            button = self._buttons.get(name)
+            if button is None:
+                raise TuxDroidGestureError("Unknown button `{}`".format(name))
+            # Combo with other buttons pressed just before
+            group = frozenset([name] + [other.name for other in self._buttons.values()
+                                        if other.state == "pending" and other is not button
+                                        and timestamp - other.first_press <= self.combo_time])
+            if len(group) > 1 and group in self._combos:
+                for other in group:
+                    self._buttons[other].reset()
+                events.append(combo_name(group))
+            elif button.state == "pending":
+                button.reset()
+                events.append("{}.double_press".format(name))
+            else:
+                if button.state == "held":
+                    # Released and pressed again before the long press delay
+                    button.reset()
+                    events.append("{}.press".format(name))
+                button.state = "pending"
+                button.first_press = timestamp
+                button.timer = self._scheduler.call_at(timestamp + self.double_press_time,
+                                                       self._double_press_timeout, button,
+                                                       timestamp)
+        for event in events:
+            self._emit(event)
+
+    def _double_press_timeout(self, button, first_press):
+        """No second press came"""
+        with self._lock:
+            if button.state != "pending" or button.first_press != first_press:
+                # Timer of a finished gesture
+                return
+            if button.is_pressed is not None and button.is_pressed():
+                button.state = "held"
+                button.timer = self._scheduler.call_at(
+                    first_press + self.long_press_time, self._long_press_timeout, button,
+                    first_press)
+                return
+            button.reset()
+        self._emit("{}.press".format(button.name))
+
+    def _long_press_timeout(self, button, first_press):
+        """Button held or released since the double press timeout"""
+        with self._lock:
+            if button.state != "held" or button.first_press != first_press:
+                return
+            gesture = "long_press" if button.is_pressed() else "press"
+            button.reset()
+        self._emit("{}.{}".format(button.name, gesture))
+
+    def reset(self):
+        """Drop all pending presses"""
+        with self._lock:
+            for button in self._buttons.values():
+                button.reset()
@@ -1,14 +1,80 @@
-"""Module for faking GPIO library"""
+"""Module for faking GPIO library
+
+The GPIO backend is chosen on first use, not at import time:
+RPi.GPIO on a Raspberry Pi, the fake GPIO everywhere else.
+Set the `TUXDROID_GPIO` environment variable to `rpi` or `fake` to force it.
+"""
 # pylint: disable=C0103
-from concurrent.futures import ThreadPoolExecutor
 # from unittest.mock import MagicMock
-import time
+import os
+import random
+import sys
+import threading
+
+
+JITTER_DISTRIBUTIONS = ("gauss", "uniform", "exponential")
+
+
+class FakeFaults():
+    """Faults injected by the fake GPIO motor simulation
 
-try:
-    import RPi.GPIO as _RealGPIO
-    FAKE_GPIO = False
-except RuntimeError:
-    FAKE_GPIO = True
+    jitter: spread of sensor edge delays in seconds: standard deviation
+            for `gauss`, half width for `uniform`, mean lateness for `exponential`
+    bounce: probability of a contact bounce burst after a sensor edge
+    bounce_count: most extra edges in a burst
+    bounce_spacing: time between extra edges of a burst
+    drop: probability of losing a sensor edge
+    stuck: sensors never producing edges, like "wings.moving_sensor"
+    slow_motors: cycle duration factor per motor, like {"mouth": 2.}
+    time_scale: cycle duration factor of all motors, < 1 to speed up simulations
+    seed: random seed, for repeatable runs
+    """
+    def __init__(self, jitter: float = 0., jitter_distribution: str = "gauss",
+                 bounce: float = 0., bounce_count: int = 3, bounce_spacing: float = 0.002,
+                 drop: float = 0., stuck=(), slow_motors=None, time_scale: float = 1.,
+                 seed=None):
+        if jitter_distribution not in JITTER_DISTRIBUTIONS:
+            raise ValueError("Bad jitter distribution `{}`, should be in {}".format(
+                jitter_distribution, JITTER_DISTRIBUTIONS))
+        self.jitter = jitter
+        self.jitter_distribution = jitter_distribution
+        self.bounce = bounce
+        self.bounce_count = bounce_count
+        self.bounce_spacing = bounce_spacing
+        self.drop = drop
+        self.stuck = set(stuck)
+        self.slow_motors = dict(slow_motors or {})
+        self.time_scale = time_scale
+        # Injected fault counters
+        self.stats = {"dropped": 0, "bounces": 0, "stuck": 0}
+        # Privates
+        self._random = random.Random(seed)
+
+    def delay(self, motor: str, delay: float):
+        """Get a faulty sensor edge delay"""
+        delay *= self.time_scale * self.slow_motors.get(motor, 1.)
+        if self.jitter:
+            if self.jitter_distribution == "gauss":
+                delay += self._random.gauss(0., self.jitter)
+            elif self.jitter_distribution == "uniform":
+                delay += self._random.uniform(-self.jitter, self.jitter)
+            else:
+                delay += self._random.expovariate(1. / self.jitter)
+        return max(0., delay)
+
+    def edges(self, sensor: str):
+        """Get the number of edges produced by one sensor transition"""
+        if sensor in self.stuck:
+            self.stats["stuck"] += 1
+            return 0
+        if self.drop and self._random.random() < self.drop:
+            self.stats["dropped"] += 1
+            return 0
+        if self.bounce and self._random.random() < self.bounce:
+            extra = self._random.randint(1, self.bounce_count)
+            self.stats["bounces"] += extra
+            return 1 + extra
+        return 1
 
 
 class _FakeGPIO():
@@ -22,123 +88,118 @@ class _FakeGPIO():
     HIGH = 1
     RISING = 1
     FALLING = 0
+    BOTH = 2
+
+    # Simulated motors: (config path of the motor, delay before the first sensor
+    # edge, cycle of (config path of the sensor, delay before the next edge))
+    MOTORS = {
+        "wings": (("wings", "motor_direction_1"), 0.,
+                  ((("wings", "moving_sensor"), 0.3), (("wings", "moving_sensor"), 0.5))),
+        "mouth": (("head", "mouth", "motor"), 0.5,
+                  ((("head", "mouth", "opened_sensor"), 0.5),
+                   (("head", "mouth", "closed_sensor"), 0.5))),
+        "eyes": (("head", "eyes", "motor"), 0.,
+                 ((("head", "eyes", "opened_sensor"), 0.3),
+                  (("head", "eyes", "closed_sensor"), 0.3))),
+    }
 
     def __init__(self):
-        self._thread_pool = ThreadPoolExecutor()
         self.config = {}
         self.callbacks = {}
-        self.waits = {self.RISING: {},
-                      self.FALLING: {},
-                      }
+        # Input levels, set by tests to simulate held buttons
+        self.levels = {}
+        # Last output levels
+        self.outputs = {}
+        # Edge counters per (event type, channel), used by wait_for_edge
+        self._edges = {}
+        self._edges_condition = threading.Condition()
+        # Running motor timers and generation, a stale timer does nothing
+        self._motor_timers = {}
+        self._motor_generations = {}
+        # Injected faults, perfect motors by default
+        self.faults = None
 
     def set_config_(self, config):
         """Save config"""
         self.config = config
 
-    def _wings_start(self):
-        """Simulate wings move"""
-        self._run_wings = True
-        moving_sensor_gpio = self.config.get('wings', {}).get('gpio', {}).get('moving_sensor', {})
-        while self._run_wings:
-            # Wings moving sensor edge rising
-            self.waits[self.RISING][moving_sensor_gpio] = True
-            # Wings moving sensor callback
-            callback = self.callbacks.get(moving_sensor_gpio)
-            if callback:
-                func = callback.get(self.RISING)
-                if func:
-                    func(moving_sensor_gpio)
-            # Wait for next up
-            time.sleep(0.3)
-            # stop the move if asked
-            if not self._run_wings:
-                break
-            # Wings moving sensor edge rising
-            self.waits[self.RISING][moving_sensor_gpio] = True
-            # Wings moving sensor callback
-            callback = self.callbacks.get(moving_sensor_gpio)
-            if callback:
-                func = callback.get(self.RISING)
-                if func:
-                    func(moving_sensor_gpio)
-            # Wait for next down
-            time.sleep(0.5)
-
-    def _wings_stop(self):
-        """Simulate stop moving wings"""
-        self._run_wings = False
-
-    def _mouth_start(self):
-        """Simulate start moving mouth"""
-        self._run_mouth = True
-        opened_sensor_gpio = self.config.get('head', {}).get('mouth', {}).\
-            get('gpio', {}).get('opened_sensor', {})
-        closed_sensor_gpio = self.config.get('head', {}).get('mouth', {}).\
-            get('gpio', {}).get('closed_sensor', {})
-        while self._run_mouth:
-            # Wait for next up
-            time.sleep(0.5)
-            # Wings moving sensor edge rising
-            self.waits[self.RISING][opened_sensor_gpio] = True
-            # Wings moving sensor callback
-            callback = self.callbacks.get(opened_sensor_gpio)
-            if callback:
-                func = callback.get(self.RISING)
-                if func:
-                    func(opened_sensor_gpio)
-            # Wait for next down
-            time.sleep(0.5)
-            # stop the move if asked
-            if not self._run_mouth:
-                break
-            # Wings moving sensor edge rising
-            self.waits[self.RISING][closed_sensor_gpio] = True
-            # Wings moving sensor callback
-            callback = self.callbacks.get(closed_sensor_gpio)
-            if callback:
-                func = callback.get(self.RISING)
-                if func:
-                    func(closed_sensor_gpio)
-
-    def _mouth_stop(self):
-        """Simulate stop moving mouth"""
-        self._run_mouth = False
-
-    def _eyes_start(self):
-        """Simulate stop moving mouth"""
-        self._run_eyes = True
-        opened_sensor_gpio = self.config.get('head', {}).get('eyes', {}).\
-            get('gpio', {}).get('opened_sensor', {})
-        closed_sensor_gpio = self.config.get('head', {}).get('eyes', {}).\
-            get('gpio', {}).get('closed_sensor', {})
-        while self._run_eyes:
-            # Wings moving sensor edge rising
-            self.waits[self.RISING][opened_sensor_gpio] = True
-            # Wings moving sensor callback
-            callback = self.callbacks.get(opened_sensor_gpio)
-            if callback:
-                func = callback.get(self.RISING)
-                if func:
-                    func(opened_sensor_gpio)
-            # Wait for next up
-            time.sleep(0.3)
-            # stop the move if asked
-            if not self._run_eyes:
-                break
-            # Wings moving sensor edge rising
-            self.waits[self.RISING][closed_sensor_gpio] = True
-            # Wings moving sensor callback
-            callback = self.callbacks.get(closed_sensor_gpio)
-            if callback:
-                func = callback.get(self.RISING)
-                if func:
-                    func(closed_sensor_gpio)
-            # Wait for next down
-            time.sleep(0.3)
-
-    def _eyes_stop(self):
-        """Simulate stop moving eyes"""
-        self._run_eyes = False
+    def set_faults_(self, faults=None):
+        """Inject faults in the motor simulation, None for perfect motors"""
+        self.faults = faults
+
+    def _config_gpio(self, path):
+        """Get a GPIO number from its config path, like ("wings", "moving_sensor")"""
+        section = self.config
+        for key in path[:-1]:
+            section = section.get(key, {})
+        return section.get('gpio', {}).get(path[-1])
+
+    def _edge(self, channel, event_type=None):
+        """Simulate an edge on an input GPIO, rising by default"""
+        if event_type is None:
+            event_type = self.RISING
+        with self._edges_condition:
+            key = (event_type, channel)
+            self._edges[key] = self._edges.get(key, 0) + 1
+            self._edges_condition.notify_all()
+        callback = self.callbacks.get(channel)
+        if callback:
+            func = callback.get(event_type)
+            if func:
+                func(channel)
+
+    @staticmethod
+    def _scheduler():
+        """Get the shared scheduler, imported on first motor start"""
+        from tuxdroid.scheduler import get_scheduler
+        return get_scheduler()
+
+    def _motor_start(self, motor):
+        """Simulate motor start, sensor edges are chained scheduler timers"""
+        generation = self._motor_generations.get(motor, 0) + 1
+        self._motor_generations[motor] = generation
+        first_delay = self.MOTORS[motor][1]
+        if self.faults is not None:
+            first_delay = self.faults.delay(motor, first_delay)
+        self._motor_timers[motor] = self._scheduler().call_later(
+            first_delay, self._motor_step, motor, generation, 0)
+
+    def _motor_step(self, motor, generation, index):
+        """Simulate one sensor edge of a running motor"""
+        if self._motor_generations.get(motor) != generation:
+            return
+        steps = self.MOTORS[motor][2]
+        sensor, delay = steps[index % len(steps)]
+        faults = self.faults
+        edges = 1
+        if faults is not None:
+            delay = faults.delay(motor, delay)
+            edges = faults.edges(".".join(sensor))
+        # Schedule next edge first, so slow callbacks do not shift the cycle
+        self._motor_timers[motor] = self._scheduler().call_later(
+            delay, self._motor_step, motor, generation, index + 1)
+        channel = self._config_gpio(sensor)
+        if edges and len(steps) > 1 and steps[0][0] != steps[1][0]:
+            # Position sensors: the reached one is active, the others are released
+            for path, _ in steps:
+                self.levels[self._config_gpio(path)] = self.HIGH if path == sensor else self.LOW
+        if edges:
+            self._edge(channel)
+        for bounce in range(1, edges):
+            self._scheduler().call_later(bounce * faults.bounce_spacing,
+                                         self._bounce, motor, generation, channel)
+
+    def _bounce(self, motor, generation, channel):
+        """Simulate a contact bounce edge"""
+        if self._motor_generations.get(motor) == generation:
+            self._edge(channel)
+
+    def _motor_stop(self, motor):
+        """Simulate motor stop"""
+        self._motor_generations[motor] = self._motor_generations.get(motor, 0) + 1
+        timer = self._motor_timers.pop(motor, None)
+        if timer is not None:
+            timer.cancel()
 
     def setmode(self, mode):
         """Fake GPIO set mode"""
@@ -159,11 +220,29 @@ class _FakeGPIO():
         if channel in self.callbacks:
             self.callbacks.pop(channel)
 
-    def wait_for_edge(self, channel, event_type):
-        """Wait for new edge (rising or falling)"""
-        self.waits[event_type][channel] = False
-        while not self.waits[event_type][channel]:
-            time.sleep(0.1)
+    def input(self, channel):
+        """Fake GPIO input level"""
+        return self.levels.get(channel, self.LOW)
+
+    def input_bank_(self):
+        """Fake read of all input levels at once, bit n for GPIO n"""
+        high = self.HIGH
+        return sum(1 << channel for channel, level in tuple(self.levels.items())
+                   if level == high)
+
+    def wait_for_edge(self, channel, event_type, timeout=None):
+        """Wait for new edge (rising or falling)
+
+        timeout: in milliseconds, like RPi.GPIO
+        Return the channel, None on timeout
+        """
+        key = (event_type, channel)
+        with self._edges_condition:
+            count = self._edges.get(key, 0)
+            if self._edges_condition.wait_for(lambda: self._edges.get(key, 0) != count,
+                                              None if timeout is None else timeout / 1000.):
+                return channel
+        return None
 
     def cleanup(self):
         """Fake GPIO cleanup"""
@@ -171,32 +250,90 @@ class _FakeGPIO():
 
     def output(self, channel, output_type):
         """Simulate set GPIO output"""
-        wings_motor_gpio = self.config.get('wings', {}).get('gpio', {}).\
-            get('motor_direction_1', {})
-        mouth_motor_gpio = self.config.get('head', {}).get('mouth', {}).\
-            get('gpio', {}).get('motor')
-        eyes_motor_gpio = self.config.get('head', {}).get('eyes', {}).\
-            get('gpio', {}).get('motor')
-        if channel == wings_motor_gpio:
-            # Simulate GPIO.output to simulate wings start or stop
-            if output_type == self.HIGH:
-                self._thread_pool.submit(self._wings_start)
-            elif output_type == self.LOW:
-                self._wings_stop()
-        elif channel == mouth_motor_gpio:
-            if output_type == self.HIGH:
-                self._thread_pool.submit(self._mouth_start)
-            elif output_type == self.LOW:
-                self._mouth_stop()
-        elif channel == eyes_motor_gpio:
-            if output_type == self.HIGH:
-                self._thread_pool.submit(self._eyes_start)
-            elif output_type == self.LOW:
-                self._eyes_stop()
+        if isinstance(channel, (list, tuple)):
+            # Batched write, one value for all channels or one per channel
+            if not isinstance(output_type, (list, tuple)):
+                output_type = [output_type] * len(channel)
+            for sub_channel, sub_output_type in zip(channel, output_type):
+                self.output(sub_channel, sub_output_type)
+            return
+        self.outputs[channel] = output_type
+        for motor, (motor_path, _, _) in self.MOTORS.items():
+            if channel == self._config_gpio(motor_path):
+                # Simulate GPIO.output to simulate motor start or stop
+                if output_type == self.HIGH:
+                    self._motor_start(motor)
+                elif output_type == self.LOW:
+                    self._motor_stop(motor)
+
+
+def _load_backend():
+    """Import RPi.GPIO or fall back on the fake GPIO
+
+    Return the backend and True if it is the fake one
+    """
+    wanted = os.environ.get("TUXDROID_GPIO", "").lower()
+    if wanted != "fake":
+        try:
+            import RPi.GPIO as real_gpio
+            return real_gpio, False
+        except (RuntimeError, ImportError):
+            # Not running on a Raspberry Pi
+            if wanted == "rpi":
+                raise
+    return _FakeGPIO(), True
+
+
+class _LazyGPIO():
+    """GPIO backend loaded on first attribute access
+
+    Methods and constants are cached on the instance once resolved,
+    so the proxy costs nothing after the first call.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._fake = None
+        self._lock = threading.Lock()
+
+    def backend_(self):
+        """Get the real backend, loading it if needed"""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend, self._fake = _load_backend()
+        return self._backend
+
+    def is_fake_(self):
+        """Return True if the fake GPIO is used"""
+        self.backend_()
+        return self._fake
+
+    def __getattr__(self, name):
+        value = getattr(self.backend_(), name)
+        if callable(value) or name.isupper():
+            # Fake GPIO data attributes can be replaced, don't cache them
+            self.__dict__[name] = value
+        return value
+
+
+def new_fake_gpio(faults=None):
+    """Get a new fake GPIO backend, simulating its own robot body"""
+    gpio = _FakeGPIO()
+    gpio.set_faults_(faults)
+    return gpio
+
+
+def __getattr__(name):
+    """Resolve FAKE_GPIO lazily (Python >= 3.7)"""
+    if name == "FAKE_GPIO":
+        return GPIO.is_fake_()
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
 
 
 # Set GPIO
-if FAKE_GPIO:
-    GPIO = _FakeGPIO()
-else:
-    GPIO = _RealGPIO
+GPIO = _LazyGPIO()
+
+if sys.version_info < (3, 7):
+    # No module __getattr__ (PEP 562), detect the backend now
+    FAKE_GPIO = GPIO.is_fake_()
@@ -2,147 +2,156 @@
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import time
-import types
 
+from tuxdroid.callbacks import CallbackRegistry, callbacks_property
+from tuxdroid.config import validate
+from tuxdroid.debounce import DebouncerSet, button_held
 from tuxdroid.gpio import GPIO
 from tuxdroid.errors import TuxDroidHeadError
 from tuxdroid.mouth import Mouth
 from tuxdroid.eyes import Eyes
 
 
-# TODO Improve button bounce time
-BUTTON_BOUNCE_TIME = 0.25
-
-
 class Head():
     """Head Component
 
+    calibrate: if False, eyes and mouth are calibrated on their first move
+    gpio: GPIO backend, the module `GPIO` by default
     """
-    def __init__(self, config: dict):
+    # Registered callbacks
+    _head_callbacks = callbacks_property("head")
+
+    def __init__(self, config: dict, calibrate: bool = True, gpio=None):
         # Get logger
         self._logger = logging.getLogger("tuxdroid").getChild("head")
         # Set attributes
         self.is_ready = False
         # Privates
+        self._gpio = gpio or GPIO
         self._gpio_names = ('head_button',)
-        self._subcomponent_names = ('eyes', 'mouth')
-        # TODO validate config
+        # Validate config
         self.config = config
         self._check_config()
         # Set GPUIO
-        GPIO.setmode(GPIO.BCM)
-        self._head_button = int(config.get("gpio").get('head_button'))
-        GPIO.setup(self._head_button, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self._gpio.setmode(self._gpio.BCM)
+        self._head_button = self.config['gpio']['head_button']
+        self._gpio.setup(self._head_button, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
         # Thread pool
         self._thread_pool = ThreadPoolExecutor()
         # Set callbacks
-        self._head_callbacks = set()
+        self._debouncers = DebouncerSet(self.config['debounce'])
+        self._gestures = None
+        self._callbacks = CallbackRegistry("head", ("head",), TuxDroidHeadError,
+                                           self._thread_pool, self._logger)
         self._set_callbacks()
 
         # Init subcomponent
-        self.mouth = Mouth(self, config.get('mouth'))
-        self.eyes = Eyes(self, config.get('eyes'))
-
-        self._motor_mouth = int(config.get("mouth").get("gpio").get('motor'))
-        GPIO.setup(self._motor_mouth, GPIO.OUT)
-        self._motor_eyes = int(config.get("eyes").get("gpio").get('motor'))
-        GPIO.setup(self._motor_eyes, GPIO.OUT)
+        self.mouth = Mouth(self, self.config['mouth'], self._gpio)
+        self.eyes = Eyes(self, self.config['eyes'], self._gpio)
+
+        self._motor_mouth = self.config['mouth']['gpio']['motor']
+        self._gpio.setup(self._motor_mouth, self._gpio.OUT)
+        self._motor_eyes = self.config['eyes']['gpio']['motor']
+        self._gpio.setup(self._motor_eyes, self._gpio.OUT)
+        self.motor_pins = (self._motor_mouth, self._motor_eyes)
         # Calibration
-        self.eyes.calibrate()
-        self.mouth.calibrate()
+        if calibrate:
+            self.eyes.calibrate()
+            self.mouth.calibrate()
         # Set it as ready
         self.is_ready = True
 
     def _check_config(self):
-        """Validate config"""
-        if not self.config.get('gpio'):
-            raise TuxDroidHeadError("Missing `gpio` section in head config")
-        for gpio_name in self._gpio_names:
-            if gpio_name not in self.config.get('gpio'):
-                raise TuxDroidHeadError("Missing `%s` section in `gpio` section "
-                                        "in head config", gpio_name)
-            try:
-                int(self.config.get('gpio').get(gpio_name))
-            except ValueError:
-                raise TuxDroidHeadError("`gpio.%s` should be a integer", gpio_name)
-        for subcomponent in self._subcomponent_names:
-            if subcomponent not in self.config:
-                raise TuxDroidHeadError("Missing `%s` section in head config",
-                                        subcomponent)
+        """Validate config and set timing defaults"""
+        self.config = validate(self.config, "head")
 
     def _button_detected(self, gpio_id):
         """Callback for all buttons"""
         self._logger.info("Button %s pressed", gpio_id)
         # callbacks
         if gpio_id == self._head_button:
-            for callback in self._head_callbacks:
-                self._logger.debug("Calling: %s", callback.__name__)
-                self._thread_pool.submit(callback)
+            self._callbacks.dispatch("head")
+            if self._gestures is not None:
+                self._gestures.press("head")
         else:
             # Should be impossible
             self._logger.error("Bad button")
             raise TuxDroidHeadError("Bad GPIO id when button pressed")
 
+    def set_gesture_recognizer(self, recognizer):
+        """Feed button presses to a gesture recognizer"""
+        for name, pin in (("head", self._head_button),):
+            recognizer.add_button(name, lambda pin=pin: self._gpio.input(pin) == self._gpio.HIGH)
+        self._gestures = recognizer
+
     def _set_callbacks(self):
         """Set button callbacks"""
         for button in self._gpio_names:
-            button = "_{}".format(button)
+            pin = getattr(self, "_" + button)
             # Remove previous callbak if needed
-            GPIO.remove_event_detect(getattr(self, button))
+            self._gpio.remove_event_detect(pin)
             # Add standard callbacks
-            GPIO.add_event_detect(getattr(self, button), GPIO.RISING,
-                                  callback=self._button_detected,
-                                  bouncetime=int(BUTTON_BOUNCE_TIME * 1000))
+            debouncer = self._debouncers.add(button, self._button_detected,
+                                             button_held(self._gpio, pin))
+            self._gpio.add_event_detect(pin, self._gpio.RISING, callback=debouncer)
 
-    def add_callback(self, callback):
-        """Add callback"""
-        if not isinstance(callback, types.FunctionType):
-            raise TuxDroidHeadError("Callback `%s` is not a function", callback)
+    def debounce_stats(self):
+        """Get debounce statistics of each GPIO"""
+        return self._debouncers.stats()
 
-        if callback in self._head_callbacks:
-            self._logger.warning("Callback `%s` already registered to head", callback.__name__)
-        else:
-            self._logger.info("Adding callback `%s` to head", callback.__name__)
-            self._head_callbacks.add(callback)
+    def add_callback(self, callback, inline: bool = False):
+        """Add callback, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument
+        inline: run the callback in the GPIO event thread, it must be short
+                (see `tuxdroid.callbacks.INLINE_BUDGET`)
+        """
+        return self._callbacks.add("head", callback, "head", inline)
 
     def del_callback(self, callback):
         """Delete callback"""
-        if callback not in self._head_callbacks:
-            self._logger.warning("Callback `%s` not registered to head", callback.__name__)
-        else:
-            self._logger.info("Deleting callback `%s`to head", callback.__name__)
-            self._head_callbacks.remove(callback)
+        self._callbacks.remove("head", callback, "head")
+
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
 
     def start(self, component):
         """Start moving eyes or mouth"""
         if component not in ("eyes", "mouth"):
             raise TuxDroidHeadError("Component should be `eyes` or `mouth`")
+        getattr(self, component)._ensure_calibrated()
+        if not getattr(self, component).is_moving:
+            getattr(self, component).thermal.acquire()
         # TODO: handle
         # * mouth can NOT move when eyes are moving
         # * eyes can NOT move when mouth is moving
-        elif component == "mouth":
+        if component == "mouth":
             if not self.mouth.is_moving:
                 # Remove the startup moving event
                 # So we don't need remove the first bad detection
-                self.mouth._motor_start_time = time.time()
-                # Reset movement count
-                self.mouth._move_count = 0
+                self.mouth._motor_starting()
                 # Starting moving
                 self.mouth._logger.info("Starting moving mouth")
-                GPIO.output(self._motor_eyes, GPIO.LOW)
-                GPIO.output(self._motor_mouth, GPIO.HIGH)
+                self._gpio.output(self._motor_eyes, self._gpio.LOW)
+                self.eyes.thermal.motor_off()
+                self._gpio.output(self._motor_mouth, self._gpio.HIGH)
+                self.mouth.motor_started_at = time.monotonic()
+                self.mouth.thermal.motor_on()
                 self.mouth.is_moving = True
         elif component == "eyes":
             if not self.eyes.is_moving:
                 # Remove the startup moving event
                 # So we don't need remove the first bad detection
-                self.eyes._motor_start_time = time.time()
-                # Reset movement count
-                self.eyes._move_count = 0
+                self.eyes._motor_starting()
                 # Starting moving
                 self.eyes._logger.info("Starting moving eyes")
-                GPIO.output(self._motor_mouth, GPIO.LOW)
-                GPIO.output(self._motor_eyes, GPIO.HIGH)
+                self._gpio.output(self._motor_mouth, self._gpio.LOW)
+                self.mouth.thermal.motor_off()
+                self._gpio.output(self._motor_eyes, self._gpio.HIGH)
+                self.eyes.motor_started_at = time.monotonic()
+                self.eyes.thermal.motor_on()
                 self.eyes.is_moving = True
 
     def stop(self, component=None):
@@ -153,7 +162,23 @@ class Head():
             raise TuxDroidHeadError("Component should be `eyes` or `mouth`")
         else:
             getattr(self, component)._logger.info("Stopping {}".format(component))
-        GPIO.output(self._motor_mouth, GPIO.LOW)
-        GPIO.output(self._motor_eyes, GPIO.LOW)
+        self._gpio.output(self._motor_mouth, self._gpio.LOW)
+        self._gpio.output(self._motor_eyes, self._gpio.LOW)
+        self.mouth.thermal.motor_off()
+        self.eyes.thermal.motor_off()
+        self.mouth._state.update(is_moving=False)
+        self.eyes._state.update(is_moving=False)
+        self.mouth._notify_move()
+        self.eyes._notify_move()
+
+    def halt(self):
+        """Forget running movements after an emergency stop cut the motors
+
+        Only reentrant locks are taken, so it can run in a signal handler
+        """
+        self.mouth.thermal.motor_off()
+        self.eyes.thermal.motor_off()
         self.mouth.is_moving = False
         self.eyes.is_moving = False
+        self.mouth._notify_move(blocking=False)
+        self.eyes._notify_move(blocking=False)
@@ -0,0 +1,131 @@
+"""Module defining TuxDroid input snapshots
+
+The levels of all configured inputs are read in one backend call: a scan
+of the fake GPIO levels, or one read of the GPIO level registers
+(GPLEV0 and GPLEV1) through `/dev/gpiomem` on a Raspberry Pi.
+Backends without both fall back on one `GPIO.input` per pin.
+
+Levels are packed in a bitfield: bit `i` is the level of `names[i]`,
+1 for HIGH.
+"""
+import mmap
+import struct
+import time
+
+
+# Input name and config path, in bit order
+INPUTS = (
+    ("wings.left_button", ("wings", "gpio", "left_button")),
+    ("wings.right_button", ("wings", "gpio", "right_button")),
+    ("wings.moving_sensor", ("wings", "gpio", "moving_sensor")),
+    ("head.head_button", ("head", "gpio", "head_button")),
+    ("eyes.opened_sensor", ("head", "eyes", "gpio", "opened_sensor")),
+    ("eyes.closed_sensor", ("head", "eyes", "gpio", "closed_sensor")),
+    ("eyes.photodetector", ("head", "eyes", "gpio", "photodetector")),
+    ("mouth.opened_sensor", ("head", "mouth", "gpio", "opened_sensor")),
+    ("mouth.closed_sensor", ("head", "mouth", "gpio", "closed_sensor")),
+    ("volume.up_button", ("volume", "gpio", "up_button")),
+    ("volume.down_button", ("volume", "gpio", "down_button")),
+)
+
+GPIOMEM = "/dev/gpiomem"
+# Offset of the GPIO pin level registers
+GPLEV0 = 0x34
+GPLEV = struct.Struct("<II")
+
+
+class RegisterReader():
+    """Read the levels of GPIOs 0 to 53 from the GPIO registers"""
+
+    def __init__(self, path: str = GPIOMEM):
+        with open(path, "r+b") as fhd:
+            self._map = mmap.mmap(fhd.fileno(), 4096)
+
+    def read(self):
+        """Get the levels of all GPIOs as a bitfield, bit n for GPIO n"""
+        low, high = GPLEV.unpack_from(self._map, GPLEV0)
+        return low | high << 32
+
+    def close(self):
+        """Unmap the registers"""
+        self._map.close()
+
+
+def open_register_reader(path: str = GPIOMEM):
+    """Get a RegisterReader, None if the registers can not be mapped"""
+    try:
+        return RegisterReader(path)
+    except (OSError, ValueError):
+        return None
+
+
+def read_pins(gpio, pins, reader=None):
+    """Read some GPIOs at once, return a bitfield: bit i is the level of `pins[i]`
+
+    reader: RegisterReader used if the backend has no bulk read
+    """
+    read_bank = getattr(gpio, "input_bank_", None)
+    if read_bank is not None or reader is not None:
+        bank = read_bank() if read_bank is not None else reader.read()
+        bits = 0
+        for index, pin in enumerate(pins):
+            bits |= (bank >> pin & 1) << index
+        return bits
+    high = gpio.HIGH
+    bits = 0
+    for index, pin in enumerate(pins):
+        if gpio.input(pin) == high:
+            bits |= 1 << index
+    return bits
+
+
+class Inputs():
+    """Levels of the inputs read at once"""
+
+    __slots__ = ("bits", "names", "timestamp")
+
+    def __init__(self, bits: int, names: tuple, timestamp: float):
+        self.bits = bits
+        self.names = names
+        # Monotonic time of the read
+        self.timestamp = timestamp
+
+    def __getitem__(self, name: str):
+        """Get an input level, True for HIGH"""
+        return bool(self.bits >> self.names.index(name) & 1)
+
+    def as_dict(self):
+        """Get input levels by name"""
+        return {name: bool(self.bits >> index & 1) for index, name in enumerate(self.names)}
+
+    def __repr__(self):
+        return "Inputs({:#x}, {})".format(self.bits, self.names)
+
+
+class InputMap():
+    """Bit layout of the inputs configured for some parts
+
+    config: normalized TuxDroid config
+    parts: enabled parts, inputs of other parts are skipped
+    """
+    def __init__(self, config: dict, parts):
+        names = []
+        pins = []
+        for name, path in INPUTS:
+            if path[0] in ("wings", "head") and path[0] not in parts:
+                continue
+            section = config
+            for key in path:
+                section = (section or {}).get(key)
+            if section is not None:
+                names.append(name)
+                pins.append(section)
+        self.names = tuple(names)
+        self.pins = tuple(pins)
+
+    def read(self, gpio, reader=None):
+        """Read all inputs at once, return an Inputs snapshot
+
+        reader: RegisterReader used if the backend has no bulk read
+        """
+        return Inputs(read_pins(gpio, self.pins, reader), self.names, time.monotonic())
@@ -0,0 +1,260 @@
+"""Module defining TuxDroid eyes photodetector sampling
+
+The light level (0 for dark, 1 for bright) is sampled on the shared
+scheduler into a preallocated ring buffer. The sampling step only stores
+the level and runs O(1) event detection, so it does not delay motor edges.
+Rolling statistics are computed on demand, vectorised with NumPy
+when it is installed.
+
+Events:
+
+* ``lights_off``: level stays under the dark level longer than the wave time
+* ``lights_on``: level rises back over the dark level
+* ``hand_wave``: dip of the level under its baseline, shorter than the wave time
+"""
+from concurrent.futures import ThreadPoolExecutor
+import array
+import logging
+import math
+import random
+import threading
+import time
+
+from tuxdroid.callbacks import CallbackRegistry
+from tuxdroid.errors import TuxDroidEyesError
+from tuxdroid.scheduler import get_scheduler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+EVENTS = ("lights_off", "lights_on", "hand_wave")
+# Level margin over the dark level before lights are back on
+HYSTERESIS = 0.05
+# Time constant of the light baseline, in seconds
+BASELINE_TIME = 1.
+
+
+class RingBuffer():
+    """Preallocated buffer of the last `size` samples"""
+
+    def __init__(self, size: int):
+        self.size = max(1, int(size))
+        self.count = 0
+        if numpy is not None:
+            self._data = numpy.zeros(self.size)
+        else:
+            self._data = array.array("d", bytes(8 * self.size))
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def append(self, value: float):
+        """Add a sample, overwriting the oldest one when full"""
+        with self._lock:
+            self._data[self._index] = value
+            self._index = (self._index + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+
+    def values(self):
+        """Get a copy of the samples, oldest first"""
+        with self._lock:
+            if self.count < self.size:
+                values = self._data[:self.count]
+                return values.copy() if numpy is not None else values
+            if numpy is not None:
+                return numpy.concatenate((self._data[self._index:], self._data[:self._index]))
+            return self._data[self._index:] + self._data[:self._index]
+
+    def stats(self):
+        """Get count, mean, standard deviation, min, max and last sample"""
+        values = self.values()
+        count = len(values)
+        if not count:
+            return {"count": 0, "mean": None, "std": None, "min": None, "max": None,
+                    "last": None}
+        if numpy is not None:
+            mean, std = float(values.mean()), float(values.std())
+            low, high = float(values.min()), float(values.max())
+        else:
+            mean = math.fsum(values) / count
+            std = math.sqrt(math.fsum((value - mean) ** 2 for value in values) / count)
+            low, high = min(values), max(values)
+        return {"count": count, "mean": mean, "std": std, "min": low, "max": high,
+                "last": float(values[-1])}
+
+
+class FakeLight():
+    """Photodetector stand-in, tests set its `level`
+
+    noise: standard deviation of the noise added to each reading
+    """
+    def __init__(self, level: float = 0.8, noise: float = 0., seed=None):
+        self.level = level
+        self.noise = noise
+        self._random = random.Random(seed)
+
+    def read(self):
+        """Get the light level"""
+        level = self.level
+        if self.noise:
+            level += self._random.gauss(0., self.noise)
+        return min(1., max(0., level))
+
+
+def gpio_reader(gpio, pin: int):
+    """Get a reader of a digital photodetector output"""
+    high = gpio.HIGH
+
+    def read():
+        """Get the light level, 0 or 1"""
+        return 1. if gpio.input(pin) == high else 0.
+
+    return read
+
+
+class LightSensor():
+    """Eyes photodetector sampler
+
+    read: function returning the light level between 0 and 1 (GPIO, ADC, ...)
+    period: seconds between samples
+    window: seconds of samples kept for statistics
+    dark_level: level under which lights are off
+    wave_ratio: dip under the baseline detected as a hand wave
+    wave_time: longest hand wave, longer dips are lights going down
+    """
+    def __init__(self, read, period: float = 0.02, window: float = 5.,
+                 dark_level: float = 0.2, wave_ratio: float = 0.3, wave_time: float = 0.5,
+                 scheduler=None, clock=time.monotonic):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("head").getChild("light")
+        if period <= 0:
+            raise TuxDroidEyesError("Light sampling period should be positive")
+        # Set attributes
+        self.period = period
+        self.dark_level = dark_level
+        self.wave_ratio = wave_ratio
+        self.wave_time = wave_time
+        self.buffer = RingBuffer(window / period)
+        self.is_dark = None
+        self.baseline = None
+        self.samples = 0
+        # Privates
+        self._read = read
+        self._scheduler = scheduler or get_scheduler()
+        self._clock = clock
+        self._alpha = min(1., period / BASELINE_TIME)
+        self._dip_start = None
+        self._timer = None
+        self._thread_pool = ThreadPoolExecutor(max_workers=1)
+        self._callbacks = CallbackRegistry("light", EVENTS, TuxDroidEyesError,
+                                           self._thread_pool, self._logger)
+
+    def start(self):
+        """Start sampling"""
+        if self._timer is None:
+            self._timer = self._scheduler.call_every(self.period, self.sample)
+
+    def stop(self):
+        """Stop sampling"""
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+    @property
+    def is_running(self):
+        """True while sampling"""
+        return self._timer is not None
+
+    def add_callback(self, event: str, callback, inline: bool = False):
+        """Add a light event callback, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument
+        inline: run the callback in the sampling thread, it must be short
+        """
+        if event not in EVENTS:
+            raise TuxDroidEyesError("Bad light event `{}`, should be in {}".format(event,
+                                                                                   EVENTS))
+        return self._callbacks.add(event, callback, "`{}` light".format(event), inline)
+
+    def del_callback(self, event: str, callback):
+        """Remove a light event callback"""
+        if event not in EVENTS:
+            raise TuxDroidEyesError("Bad light event `{}`, should be in {}".format(event,
+                                                                                   EVENTS))
+        self._callbacks.remove(event, callback, "`{}` light".format(event))
+
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
+
+    def _emit(self, event):
+        """Run event callbacks out of the sampling thread"""
+        self._logger.debug("Light event %s", event)
+        self._callbacks.dispatch(event, "light.{}".format(event))
+
+    def sample(self):
+        """Read and store one sample, then detect events"""
+        try:
+            level = float(self._read())
+        except Exception:  # pylint: disable=W0703
+            self._logger.exception("Photodetector read failed")
+            return
+        self.buffer.append(level)
+        self.samples += 1
+        self._detect(level, self._clock())
+
+    def _detect(self, level, now):
+        """Update dark state and baseline, detect hand waves
+
+        A dip shorter than the wave time is a hand wave, even under the dark
+        level. Lights are off when the level stays dark longer.
+        """
+        if self.baseline is None:
+            self.baseline = level
+            self.is_dark = level < self.dark_level
+            return
+        if self.is_dark:
+            # Hysteresis avoids flapping around the dark level
+            if level > self.dark_level + HYSTERESIS:
+                self.is_dark = False
+                self.baseline = level
+                self._emit("lights_on")
+            return
+        if self._dip_start is None:
+            if level < self.baseline * (1. - self.wave_ratio) or level < self.dark_level:
+                # The baseline is frozen during a dip
+                self._dip_start = now
+            else:
+                self.baseline += self._alpha * (level - self.baseline)
+        elif level >= self.baseline * (1. - self.wave_ratio / 2.):
+            if now - self._dip_start <= self.wave_time:
+                self._emit("hand_wave")
+            self._dip_start = None
+        elif now - self._dip_start > self.wave_time:
+            self._dip_start = None
+            if level < self.dark_level:
+                self.is_dark = True
+                self._emit("lights_off")
+            else:
+                # Lights dimmed, follow them
+                self.baseline = level
+
+    def stats(self):
+        """Get rolling statistics of the samples in the window"""
+        stats = self.buffer.stats()
+        stats.update({"dark": self.is_dark,
+                      "baseline": self.baseline,
+                      "samples": self.samples,
+                      "numpy": numpy is not None,
+                      })
+        return stats
+
+
+def light_sensor(config: dict, read):
+    """Get a light sensor from a `light` config section"""
+    return LightSensor(read, config['period'], config['window'], config['dark_level'],
+                       config['wave_ratio'], config['wave_time'])
@@ -0,0 +1,254 @@
+"""Module defining TuxDroid multi robot manager
+
+Each robot has its own GPIO backend, so one process can drive many
+bodies. The manager runs the same command on all of them at once.
+
+.. code-block:: python
+
+    manager = TuxDroidManager()
+    for index in range(10):
+        manager.create("tux{}".format(index), "config.yaml")
+    manager.broadcast("wings.up")
+    # Motors start together in 100ms
+    report = manager.group("wings.move", [4], delay=0.1)
+    print(report["skew"])
+
+Group commands are started at a shared monotonic deadline. Each robot
+starts early by its measured motor start latency (time between the
+command call and the motor GPIO write), so motors start together.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import logging
+import threading
+import time
+
+from tuxdroid.commands import COMMANDS, Dispatcher
+from tuxdroid.errors import TuxDroidError, TuxDroidCommandError
+from tuxdroid.gpio import GPIO, new_fake_gpio
+
+
+# Weight of the last measure in motor start latency estimations
+LATENCY_SMOOTHING = 0.5
+# Longer latencies are not learnt (calibration on first move, thermal wait, ...)
+MAX_LATENCY = 0.25
+# Time spent spinning before a deadline instead of sleeping
+SPIN_TIME = 0.002
+
+
+def sleep_until(deadline: float):
+    """Sleep until a monotonic deadline, spinning the last milliseconds"""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_TIME:
+            time.sleep(remaining - SPIN_TIME)
+
+
+class TuxDroidManager():
+    """Manage several TuxDroids
+
+    clock: monotonic clock of group deadlines, the clock of motor start times
+    sleep_until: function sleeping until a deadline of the clock
+    """
+
+    def __init__(self, clock=time.monotonic, sleep_until=sleep_until):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("manager")
+        # Privates
+        self._clock = clock
+        self._sleep_until = sleep_until
+        self._robots = collections.OrderedDict()
+        self._dispatchers = {}
+        self._lock = threading.Lock()
+        self._thread_pool = None
+        self._workers = 0
+        # (robot name, command): motor start latency estimation
+        self._latencies = {}
+
+    def add(self, name: str, tux):
+        """Add a robot"""
+        with self._lock:
+            if name in self._robots:
+                raise TuxDroidError("Robot `{}` already exists".format(name))
+            self._robots[name] = tux
+            self._dispatchers[name] = Dispatcher(tux)
+        self._logger.info("Robot `%s` added", name)
+        return tux
+
+    def create(self, name: str, config, gpio=None, **kwargs):
+        """Build and add a robot
+
+        Without GPIO backend, each robot gets its own fake GPIO
+        when running off a Raspberry Pi
+        """
+        from tuxdroid.tuxdroid import TuxDroid
+        if gpio is None and GPIO.is_fake_():
+            gpio = new_fake_gpio()
+        return self.add(name, TuxDroid(config, gpio=gpio, **kwargs))
+
+    def remove(self, name: str):
+        """Remove a robot and return it"""
+        with self._lock:
+            if name not in self._robots:
+                raise TuxDroidError("Unknown robot `{}`".format(name))
+            self._dispatchers.pop(name)
+            for key in [key for key in self._latencies if key[0] == name]:
+                del self._latencies[key]
+            return self._robots.pop(name)
+
+    @property
+    def names(self):
+        """Robot names"""
+        return tuple(self._robots)
+
+    def __getitem__(self, name):
+        return self._robots[name]
+
+    def __len__(self):
+        return len(self._robots)
+
+    def _get_thread_pool(self, size: int):
+        """Get a thread pool with at least one worker per robot"""
+        with self._lock:
+            if self._workers < size:
+                if self._thread_pool is not None:
+                    self._thread_pool.shutdown(wait=False)
+                self._thread_pool = ThreadPoolExecutor(max_workers=size)
+                self._workers = size
+            return self._thread_pool
+
+    def _selected(self, names):
+        """Get (name, dispatcher) of selected robots"""
+        if names is None:
+            names = self.names
+        for name in names:
+            if name not in self._dispatchers:
+                raise TuxDroidError("Unknown robot `{}`".format(name))
+        return [(name, self._dispatchers[name]) for name in names]
+
+    @staticmethod
+    def _run(dispatcher, start, command, args):
+        """Wait for the start signal, then run the command"""
+        start.wait()
+        return dispatcher.call(command, args)
+
+    def broadcast(self, command: str, args=(), names=None, wait: bool = True):
+        """Run a command on several robots at the same time
+
+        names: robots to use, all by default
+        wait: if False, return {name: future} without waiting
+
+        Return {name: result}, and raise a TuxDroidCommandError
+        with all robot errors if a command failed
+        """
+        selected = self._selected(names)
+        if not selected:
+            return {}
+        thread_pool = self._get_thread_pool(len(selected))
+        # Commands start together once all of them are submitted.
+        # Workers busy with another broadcast start theirs later, but never deadlock
+        start = threading.Event()
+        futures = collections.OrderedDict(
+            (name, thread_pool.submit(self._run, dispatcher, start, command, list(args)))
+            for name, dispatcher in selected)
+        start.set()
+        if not wait:
+            return futures
+        return self._results(command, futures)
+
+    @staticmethod
+    def _results(command, futures):
+        """Wait for robot futures, raise all errors at once"""
+        results = collections.OrderedDict()
+        errors = []
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as exp:  # pylint: disable=W0703
+                errors.append("{}: {}".format(name, exp))
+        if errors:
+            raise TuxDroidCommandError("`{}` failed on {} robot(s): {}".format(
+                command, len(errors), "; ".join(errors)))
+        return results
+
+    def _run_at(self, name, dispatcher, deadline, command, args):
+        """Run the command so the motor starts at the deadline
+
+        Return (command result, motor start time)
+        """
+        path = COMMANDS[command][0] if command in COMMANDS else ()
+        component = dispatcher._resolve(path) if path else None
+        before = getattr(component, "motor_started_at", None)
+        key = (name, command)
+        self._sleep_until(deadline - self._latencies.get(key, 0.))
+        called = self._clock()
+        result = dispatcher.call(command, args)
+        started = getattr(component, "motor_started_at", None)
+        if started is None or started == before:
+            # No motor started, the command call is the start
+            started = called
+        latency = started - called
+        if latency <= MAX_LATENCY:
+            previous = self._latencies.get(key, latency)
+            self._latencies[key] = previous + LATENCY_SMOOTHING * (latency - previous)
+        return result, started
+
+    def group(self, command: str, args=(), names=None, delay: float = 0.1):
+        """Run a command on several robots so their motors start together
+
+        delay: seconds before the shared deadline, it should be longer
+               than the motor start latency of every robot
+
+        Return a report: {"deadline": monotonic time, "results": {name: result},
+        "offsets": {name: motor start - deadline}, "skew": largest start difference}
+        """
+        selected = self._selected(names)
+        if not selected:
+            return {"deadline": None, "results": {}, "offsets": {}, "skew": 0.}
+        thread_pool = self._get_thread_pool(len(selected))
+        deadline = self._clock() + delay
+        futures = collections.OrderedDict(
+            (name, thread_pool.submit(self._run_at, name, dispatcher, deadline,
+                                      command, list(args)))
+            for name, dispatcher in selected)
+        outcomes = self._results(command, futures)
+        offsets = collections.OrderedDict((name, started - deadline)
+                                          for name, (_, started) in outcomes.items())
+        skew = max(offsets.values()) - min(offsets.values())
+        self._logger.info("Group `%s` on %d robot(s), skew %.1fms", command, len(offsets),
+                          skew * 1000)
+        return {"deadline": deadline,
+                "results": collections.OrderedDict((name, result)
+                                                   for name, (result, _) in outcomes.items()),
+                "offsets": offsets,
+                "skew": skew,
+                }
+
+    def latencies(self):
+        """Get motor start latency estimations: {(robot name, command): seconds}"""
+        return dict(self._latencies)
+
+    def state(self):
+        """Get state of all robots"""
+        return collections.OrderedDict((name, dispatcher.state())
+                                       for name, dispatcher in self._selected(None))
+
+    def emergency_stop(self):
+        """Cut motors of all robots"""
+        for tux in tuple(self._robots.values()):
+            tux.emergency_stop()
+
+    def stop(self):
+        """Stop all robots and the thread pool"""
+        robots = tuple(self._robots.items())
+        if robots:
+            # Full shutdown is not a remote command, it cleans GPIOs up
+            thread_pool = self._get_thread_pool(len(robots))
+            self._results("stop", collections.OrderedDict(
+                (name, thread_pool.submit(tux.stop)) for name, tux in robots))
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown()
+            self._thread_pool = None
+            self._workers = 0
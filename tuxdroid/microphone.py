@@ -0,0 +1,309 @@
+"""Module defining TuxDroid microphone
+
+Audio (mono, signed 16 bits) is captured in fixed blocks from ALSA, or from
+a wav file standing in for it. Each block goes through an energy based
+voice activity detector: its RMS level is compared to an adaptive noise
+floor, vectorised with NumPy when it is installed.
+
+Events:
+
+* ``speech_start``: level stays over the speech threshold for `start_time`
+* ``speech_stop``: level stays under it for `stop_time`
+
+Events are detected at most `start_time` (or `stop_time`) plus one block
+after the sound, callbacks then run in a thread pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import array
+import logging
+import math
+import sys
+import threading
+import time
+import wave
+
+from tuxdroid.callbacks import CallbackRegistry
+from tuxdroid.errors import TuxDroidMicrophoneError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+EVENTS = ("speech_start", "speech_stop")
+# Speech level over the noise floor
+NOISE_FACTOR = 3.
+# Time constant of the noise floor rise, in seconds
+FLOOR_TIME = 2.
+# Slower time constant while speech lasts: a steady loud background
+# (a fan, music) ends as speech after a few seconds
+SPEECH_FLOOR_TIME = 5.
+# Latencies kept for statistics
+MAX_LATENCIES = 1000
+
+
+def block_level(data):
+    """Get the RMS level of signed 16 bits samples, between 0 and 1"""
+    if numpy is not None:
+        samples = numpy.frombuffer(data, dtype="<i2").astype(numpy.float32)
+        if not samples.size:
+            return 0.
+        return float(numpy.sqrt(numpy.dot(samples, samples) / samples.size)) / 32768.
+    samples = array.array("h", data)
+    if not samples:
+        return 0.
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return math.sqrt(math.fsum(sample * sample for sample in samples) / len(samples)) / 32768.
+
+
+class AlsaSource():
+    """Capture blocks from ALSA"""
+
+    def __init__(self, rate: int = 16000, block_frames: int = 320, device: str = "default"):
+        if alsaaudio is None:
+            raise TuxDroidMicrophoneError("ALSA capture needs the `pyalsaaudio` package")
+        self.rate = rate
+        self.block_frames = block_frames
+        self._pcm = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, device=device, rate=rate, channels=1,
+                                  format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=block_frames)
+        self._pending = b""
+
+    def read(self):
+        """Get one block, waiting for it"""
+        size = self.block_frames * 2
+        while len(self._pending) < size:
+            length, data = self._pcm.read()
+            if length > 0:
+                self._pending += data
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def close(self):
+        """Close the ALSA device"""
+        self._pcm.close()
+
+
+class WavSource():
+    """Read blocks from a mono 16 bits wav file
+
+    realtime: if True, give blocks at the rate of the recording
+    """
+    def __init__(self, path: str, block_frames: int = 320, realtime: bool = True):
+        self._wav = wave.open(path, "rb")
+        if self._wav.getnchannels() != 1 or self._wav.getsampwidth() != 2:
+            self._wav.close()
+            raise TuxDroidMicrophoneError("`{}` should be a mono 16 bits wav file".format(path))
+        self.rate = self._wav.getframerate()
+        self.block_frames = block_frames
+        self.realtime = realtime
+        self._deadline = None
+
+    def read(self):
+        """Get one block, empty at the end of the file"""
+        data = self._wav.readframes(self.block_frames)
+        if self.realtime and data:
+            now = time.monotonic()
+            if self._deadline is None:
+                self._deadline = now
+            self._deadline += len(data) / 2 / self.rate
+            time.sleep(max(0., self._deadline - now))
+        return data
+
+    def close(self):
+        """Close the wav file"""
+        self._wav.close()
+
+
+class VoiceDetector():
+    """Energy based voice activity detector
+
+    block_time: seconds of audio per block
+    threshold: lowest speech level, between 0 and 1
+    start_time: speech time before `speech_start`
+    stop_time: silence time before `speech_stop`
+    """
+    def __init__(self, block_time: float = 0.02, threshold: float = 0.02,
+                 start_time: float = 0.06, stop_time: float = 0.3):
+        self.threshold = threshold
+        self.start_blocks = max(1, int(round(start_time / block_time)))
+        self.stop_blocks = max(1, int(round(stop_time / block_time)))
+        self.is_speech = False
+        self.floor = None
+        self.level = 0.
+        # Privates
+        self._alpha = min(1., block_time / FLOOR_TIME)
+        self._speech_alpha = min(1., block_time / SPEECH_FLOOR_TIME)
+        self._run = 0
+
+    def process(self, data):
+        """Detect speech in one block, return an event or None"""
+        level = self.level = block_level(data)
+        loud = level > max(self.threshold, (self.floor or 0.) * NOISE_FACTOR)
+        # The noise floor follows drops at once and rises slowly,
+        # even more slowly during speech, whose pauses bring it back down
+        if self.floor is None or level < self.floor:
+            self.floor = level
+        elif self.is_speech:
+            self.floor += self._speech_alpha * (level - self.floor)
+        elif not loud:
+            self.floor += self._alpha * (level - self.floor)
+        if loud != self.is_speech:
+            self._run += 1
+            if self._run >= (self.start_blocks if loud else self.stop_blocks):
+                self._run = 0
+                self.is_speech = loud
+                return "speech_start" if loud else "speech_stop"
+        else:
+            self._run = 0
+        return None
+
+
+class Microphone():
+    """Microphone component
+
+    source: block source, like `AlsaSource()` or `WavSource(path)`
+    detector: VoiceDetector, with the source block time by default
+    """
+    def __init__(self, source, detector: VoiceDetector = None):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("microphone")
+        # Set attributes
+        self.source = source
+        self.block_time = source.block_frames / source.rate
+        self.detector = detector or VoiceDetector(self.block_time)
+        self.blocks = 0
+        self.overruns = 0
+        # Privates
+        self._process_time = 0.
+        self._max_process_time = 0.
+        self._latencies = []
+        self._thread = None
+        self._running = False
+        self._finished = threading.Event()
+        self._thread_pool = ThreadPoolExecutor(max_workers=1)
+        self._callbacks = CallbackRegistry("microphone", EVENTS, TuxDroidMicrophoneError,
+                                           self._thread_pool, self._logger)
+
+    def add_callback(self, event: str, callback, inline: bool = False):
+        """Add a speech event callback, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument, its timestamp is the block capture time
+        inline: run the callback in the capture thread, it must be short
+        """
+        if event not in EVENTS:
+            raise TuxDroidMicrophoneError("Bad microphone event `{}`, should be in {}".format(
+                event, EVENTS))
+        return self._callbacks.add(event, callback, "`{}` microphone".format(event), inline)
+
+    def del_callback(self, event: str, callback):
+        """Remove a speech event callback"""
+        if event not in EVENTS:
+            raise TuxDroidMicrophoneError("Bad microphone event `{}`, should be in {}".format(
+                event, EVENTS))
+        self._callbacks.remove(event, callback, "`{}` microphone".format(event))
+
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
+
+    def start(self):
+        """Start capturing in a thread"""
+        if self._thread is None:
+            self._running = True
+            self._finished.clear()
+            self._thread = threading.Thread(target=self._capture, daemon=True,
+                                            name="tuxdroid-microphone")
+            self._thread.start()
+
+    def stop(self):
+        """Stop capturing"""
+        thread, self._thread = self._thread, None
+        self._running = False
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    @property
+    def is_running(self):
+        """True while capturing"""
+        return self._thread is not None and not self._finished.is_set()
+
+    def wait(self, timeout: float = None):
+        """Wait for the end of the source, return True if it ended"""
+        return self._finished.wait(timeout)
+
+    def _capture(self):
+        """Capture thread: read and process blocks"""
+        try:
+            while self._running:
+                data = self.source.read()
+                if not data:
+                    break
+                self.process(data, time.monotonic())
+            if self.detector.is_speech:
+                # Source ended while speaking
+                self.detector.is_speech = False
+                self._emit("speech_stop", time.monotonic())
+        except Exception:  # pylint: disable=W0703
+            self._logger.exception("Audio capture failed")
+        finally:
+            self._finished.set()
+
+    def process(self, data, captured_at: float):
+        """Run voice detection on a block captured at a monotonic time"""
+        start = time.perf_counter()
+        event = self.detector.process(data)
+        if event is not None:
+            self._emit(event, captured_at)
+        duration = time.perf_counter() - start
+        self.blocks += 1
+        self._process_time += duration
+        self._max_process_time = max(self._max_process_time, duration)
+        if duration > self.block_time:
+            self.overruns += 1
+
+    def _emit(self, event: str, captured_at: float):
+        """Run event callbacks out of the capture thread"""
+        self._logger.debug("Microphone event %s", event)
+        if self._callbacks.callbacks(event):
+            # Queued first in the single worker pool, so it runs when the callbacks start
+            self._thread_pool.submit(self._record_latency, captured_at)
+        self._callbacks.dispatch(event, "microphone.{}".format(event), timestamp=captured_at)
+
+    def _record_latency(self, captured_at: float):
+        """Measure callback latency from the block capture"""
+        latency = time.monotonic() - captured_at
+        if len(self._latencies) >= MAX_LATENCIES:
+            del self._latencies[:MAX_LATENCIES // 2]
+        self._latencies.append(latency)
+
+    def stats(self):
+        """Get block processing times (budget is the block time) and callback latencies"""
+        latencies = list(self._latencies)
+        return {"blocks": self.blocks,
+                "block_time": self.block_time,
+                "mean_process_time": self._process_time / self.blocks if self.blocks else None,
+                "max_process_time": self._max_process_time,
+                "overruns": self.overruns,
+                "max_latency": max(latencies) if latencies else None,
+                "speech": self.detector.is_speech,
+                "floor": self.detector.floor,
+                "numpy": numpy is not None,
+                }
+
+
+def microphone(config: dict, source=None):
+    """Get a microphone from a `microphone` config section, capturing with ALSA by default"""
+    block_frames = max(1, int(16000 * config['block_time']))
+    if source is None:
+        source = AlsaSource(16000, block_frames)
+    detector = VoiceDetector(source.block_frames / source.rate, config['threshold'],
+                             config['start_time'], config['stop_time'])
+    return Microphone(source, detector)
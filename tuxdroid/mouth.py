@@ -2,82 +2,101 @@
 # pylint: disable=R0801
 from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
 import time
-import types
 
+from tuxdroid.calibration import CALIBRATIONS, report, sensor_position, wait_for_sensor
+from tuxdroid.callbacks import CallbackRegistry, callbacks_property
+from tuxdroid.config import validate
+from tuxdroid.debounce import DebouncerSet
 from tuxdroid.gpio import GPIO
+from tuxdroid.state import StateCell, state_property
+from tuxdroid.thermal import motor_budget
 from tuxdroid.errors import TuxDroidMouthError
-
-
-# Bounce time for rising edge detection: 100ms
-BOUNCE_TIME = 0.1
-# TODO Improve button bounce time
-BUTTON_BOUNCE_TIME = 0.25
+from tuxdroid.positions import EYELID, Position, StateMachine
 
 
 class Mouth():
     """Mouth Component
 
     .. todo:: Missing head speed control (using PWM, need to find PWN frequency/duty cycle)
+
+    gpio: GPIO backend, the module `GPIO` by default
     """
-    def __init__(self, head, config: dict):
+    # Attributes stored in the state snapshot
+    position = state_property("position")
+    is_moving = state_property("is_moving")
+    _move_count = state_property("count")
+    _wanted_moves = state_property("wanted_moves")
+    _motor_start_time = state_property("motor_start_time")
+    # Registered callbacks
+    _opened_callbacks = callbacks_property("opened")
+    _closed_callbacks = callbacks_property("closed")
+
+    def __init__(self, head, config: dict, gpio=None):
         # Get logger
         self._logger = logging.getLogger("tuxdroid").getChild("head").getChild("mouth")
         # Set attributes
         self._head = head
+        self._state = StateCell()
+        self.state_machine = StateMachine(EYELID, TuxDroidMouthError)
         self.is_ready = False
-        self.is_moving = False
         self.is_calibrated = False
-        self.position = None
+        # CalibrationReport of the last calibration
+        self.calibration = None
+        # Monotonic time of the last motor start
+        self.motor_started_at = None
         # Privates
-        self._move_count = 0
-        self._wanted_moves = None
-        self._motor_start_time = None
-        self._gpio_names = ('opened_sensor', 'closed_sensor', 'motor')
+        self._gpio = gpio or GPIO
+        self._calibrating = False
         # Validate config
         self.config = config
         self._check_config()
         # Set GPUIO
-        GPIO.setmode(GPIO.BCM)
-        self._opened_sensor = int(config.get("gpio").get('opened_sensor'))
-        GPIO.setup(self._opened_sensor, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._closed_sensor = int(config.get("gpio").get('closed_sensor'))
-        GPIO.setup(self._closed_sensor, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self._gpio.setmode(self._gpio.BCM)
+        self._opened_sensor = self.config['gpio']['opened_sensor']
+        self._gpio.setup(self._opened_sensor, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._closed_sensor = self.config['gpio']['closed_sensor']
+        self._gpio.setup(self._closed_sensor, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
         # Callbacks
-        self._opened_callbacks = set()
-        self._closed_callbacks = set()
+        self._debouncers = DebouncerSet(self.config['debounce'])
+        # Notified on each position change and stop
+        self._moved = threading.Condition()
         # Thread pool
         self._thread_pool = ThreadPoolExecutor()
+        self._callbacks = CallbackRegistry("mouth", ("opened", "closed"), TuxDroidMouthError,
+                                           self._thread_pool, self._logger)
+        # Motor on-time accounting, done by head component
+        self.thermal = motor_budget("mouth", self.config['thermal'], self.stop)
         # we need to call calibrate() which is done by head component
 
     def _check_config(self):
-        """Validate config"""
-        if not self.config.get('gpio'):
-            raise TuxDroidMouthError("Missing `gpio` section in mouth config")
-        for gpio_name in self._gpio_names:
-            if gpio_name not in self.config.get('gpio'):
-                raise TuxDroidMouthError("Missing `%s` section in `gpio` section "
-                                         "in mouth config", gpio_name)
-            try:
-                int(self.config.get('gpio').get(gpio_name))
-            except ValueError:
-                raise TuxDroidMouthError("`gpio.%s` should be a integer", gpio_name)
+        """Validate config and set timing defaults"""
+        self.config = validate(self.config, "mouth")
+
+    def state(self):
+        """Get an immutable snapshot of the mouth state"""
+        return self._state.snapshot()
 
     def _set_callbacks(self):
         """Set button callbacks"""
-        GPIO.remove_event_detect(self._opened_sensor)
-        GPIO.add_event_detect(self._opened_sensor, GPIO.RISING,
-                              callback=self._opened_event,
-                              bouncetime=int(BUTTON_BOUNCE_TIME * 1000))
-        GPIO.remove_event_detect(self._closed_sensor)
-        GPIO.add_event_detect(self._closed_sensor, GPIO.RISING,
-                              callback=self._closed_event,
-                              bouncetime=int(BUTTON_BOUNCE_TIME * 1000))
+        self._gpio.remove_event_detect(self._opened_sensor)
+        self._gpio.add_event_detect(self._opened_sensor, self._gpio.RISING,
+                                    callback=self._debouncers.add("opened_sensor",
+                                                                  self._opened_event))
+        self._gpio.remove_event_detect(self._closed_sensor)
+        self._gpio.add_event_detect(self._closed_sensor, self._gpio.RISING,
+                                    callback=self._debouncers.add("closed_sensor",
+                                                                  self._closed_event))
+
+    def debounce_stats(self):
+        """Get debounce statistics of each GPIO"""
+        return self._debouncers.stats()
 
     def _opened_event(self, gpio_id):
         """Opened mouth event callback"""
         # We have to not consider the first event
-        if time.time() - self._motor_start_time < 0.2:
+        if time.time() - self._motor_start_time < self.config['startup_time']:
             # Maybe we want a debug ?
             self._logger.warning("Startup mouth event detected, ignoring it")
             return
@@ -87,19 +106,15 @@ class Mouth():
             self._logger.error("Bad opened sensor GPIO id")
             raise TuxDroidMouthError("Bad GPIO id when opening")
 
-        self.position = "OPENED"
-        self._move_count += 1
-        if isinstance(self._wanted_moves, int) and self._move_count >= self._wanted_moves:
-            self._wanted_moves = None
+        if self._reached("opened"):
             self.stop()
-        for callback in self._opened_callbacks:
-            self._logger.debug("Calling: %s", callback.__name__)
-            self._thread_pool.submit(callback)
+        self._notify_move()
+        self._callbacks.dispatch("opened", position=self.position)
 
     def _closed_event(self, gpio_id):
         """Closed mouth event callback"""
         # We have to not consider the first event
-        if time.time() - self._motor_start_time < 0.2:
+        if time.time() - self._motor_start_time < self.config['startup_time']:
             # Maybe we want a debug ?
             self._logger.warning("Startup mouth event detected, ignoring it")
             return
@@ -109,74 +124,112 @@ class Mouth():
             self._logger.error("Bad closed sensor GPIO id")
             raise TuxDroidMouthError("Bad GPIO id when closing")
 
-        self.position = "CLOSED"
-        self._move_count += 1
-        if isinstance(self._wanted_moves, int) and self._move_count >= self._wanted_moves:
-            self._wanted_moves = None
+        if self._reached("closed"):
             self.stop()
-        for callback in self._closed_callbacks:
-            self._logger.debug("Calling: %s", callback.__name__)
-            self._thread_pool.submit(callback)
+        self._notify_move()
+        self._callbacks.dispatch("closed", position=self.position)
 
-    def add_callback(self, position: str, callback):
-        """Add callback"""
+    def _reached(self, event: str):
+        """Record a sensor event, return True if wanted moves are done"""
+        def changes(state):
+            """State changes of a movement"""
+            count = state.count + 1
+            wanted_moves = state.wanted_moves
+            if isinstance(wanted_moves, int) and count >= wanted_moves:
+                wanted_moves = None
+            return {"position": self.state_machine.next(state.position, event),
+                    "count": count, "wanted_moves": wanted_moves}
+
+        old, new = self._state.modify(changes)
+        self.state_machine.record(old.position, event, new.position)
+        return old.wanted_moves is not None and new.wanted_moves is None
+
+    def _motor_starting(self):
+        """Reset movement state before the head starts the motor"""
+        self._state.update(motor_start_time=time.time(), count=0)
+
+    def add_callback(self, position: str, callback, inline: bool = False):
+        """Add callback, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument
+        inline: run the callback in the GPIO event thread, it must be short
+                (see `tuxdroid.callbacks.INLINE_BUDGET`)
+        """
         if position not in ("closed", "opened"):
             raise TuxDroidMouthError("Bad position, should be 'closed' or 'opened'")
-        if not isinstance(callback, types.FunctionType):
-            raise TuxDroidMouthError("Callback `%s` is not a function", callback)
-
-        callbacks = getattr(self, "_{}_callbacks".format(position))
-        if callback in callbacks:
-            self._logger.warning("Callback `%s` already registered to `%s` mouth",
-                                 callback.__name__, position)
-        else:
-            self._logger.info("Adding callback `%s` to `%s` mouth", callback.__name__, position)
-            callbacks.add(callback)
+        return self._callbacks.add(position, callback, "`{}` mouth".format(position), inline)
 
     def del_callback(self, position: str, callback):
         """Delete callback"""
         if position not in ("closed", "opened"):
             raise TuxDroidMouthError("Bad position, should be 'closed' or 'opened'")
+        self._callbacks.remove(position, callback, "`{}` mouth".format(position))
 
-        callbacks = getattr(self, "_{}_callbacks".format(position))
-        if callback not in callbacks:
-            self._logger.warning("Callback `%s` not registered to `%s` mouth",
-                                 callback.__name__, position)
-        else:
-            self._logger.info("Deleting callback `%s` to `%s` mouth", callback.__name__, position)
-            callbacks.remove(callback)
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
 
-    def calibrate(self):
-        """Moving mouth until it reaches the closed positiion"""
+    def calibrate(self, strategy: str = None):
+        """Moving mouth until it reaches the closed positiion
+
+        strategy: `fast` or `full`, see `tuxdroid.calibration`, config value by default
+        """
+        strategy = strategy or self.config['calibration']
+        if strategy not in CALIBRATIONS:
+            raise TuxDroidMouthError("Bad calibration, should be one of {}".format(CALIBRATIONS))
         # Calibration
         self._logger.info("Mouth calibration starting")
+        self._calibrating = True
+        start = time.monotonic()
         # Init variables
         mouth_nb_moves = 0
-        # Start moving
-        self.start()
-        # Start init
-        while mouth_nb_moves < 2:
-            # Wait for Rising edge
-            GPIO.wait_for_edge(self._closed_sensor, GPIO.RISING)
-            mouth_nb_moves += 1
-        # Set position
-        self.position = "CLOSED"
-        # Stop moving
-        self.stop()
+        position = None
+        if strategy == "fast":
+            # An active position sensor gives the position without moving
+            position = sensor_position(self._gpio, self._opened_sensor, self._closed_sensor)
+        if position is not None:
+            self.position = position
+        else:
+            # Start moving
+            self.start()
+            # Start init
+            try:
+                while mouth_nb_moves < 2:
+                    # Wait for Rising edge
+                    wait_for_sensor(self._gpio, self._closed_sensor, lambda: self.is_moving,
+                                    TuxDroidMouthError)
+                    mouth_nb_moves += 1
+            except TuxDroidMouthError:
+                self._calibrating = False
+                raise
+            # Set position
+            self.position = Position.CLOSED
+            # Stop moving
+            self.stop()
+        self.calibration = report("mouth", strategy, start, mouth_nb_moves)
         # Mouth should be closed
         self.is_calibrated = True
-        self._logger.info("Mouth calibration done")
+        self._calibrating = False
+        self._logger.info("Mouth calibration done: %.2fs, %d moves saved",
+                          self.calibration.time, self.calibration.moves_saved)
         # Set callbacks
         self._set_callbacks()
         # Set it as ready
         self.is_ready = True
 
+    def _ensure_calibrated(self):
+        """Calibrate mouth on first move if it was not done at startup"""
+        if not self.is_calibrated and not self._calibrating:
+            self.calibrate()
+
     def set_position(self, position):
         """Move mouth to a position"""
-        position = position.upper()
-        if position not in ["OPENED", "CLOSED"]:
+        position = self.state_machine.target(position)
+        if position is None:
             self._logger.error("Bad mouth position")
             raise TuxDroidMouthError("Bad mouth position")
+        self._ensure_calibrated()
         # Do nothing if already in position
         if self.position == position:
             self._logger.info("Mouth already in %s position", position)
@@ -185,10 +238,12 @@ class Mouth():
         self.start()
         # Wait for position
         # TODO add timeout
-        while self.position != position:
-            pass
+        with self._moved:
+            self._moved.wait_for(lambda: self.position == position or not self.is_moving)
         # Stop moving
         self.stop()
+        if self.position != position:
+            raise TuxDroidMouthError("Mouth stopped before reaching %s position" % position)
 
     def close(self):  # pylint: disable=C0103
         """Move head up"""
@@ -205,17 +260,28 @@ class Mouth():
 
         The count is incremented each time head are in OPENED or CLOSED position
         """
-        self._move_count = 0
-        self._wanted_moves = times
+        self._ensure_calibrated()
+        self._state.update(count=0, wanted_moves=times)
         # Start moving
         self.start()
-        while self.is_moving:
+        with self._moved:
             # Wait for the count
-            time.sleep(0.01)
+            self._moved.wait_for(lambda: not self.is_moving)
         # Stop moving
         self.stop()
         self._move_count = 0
 
+    def _notify_move(self, blocking: bool = True):
+        """Wake up threads waiting for a position or a stop
+
+        blocking: if False, give up when another thread holds the condition
+        """
+        if self._moved.acquire(blocking):
+            try:
+                self._moved.notify_all()
+            finally:
+                self._moved.release()
+
     def stop(self):
         """Stop moving mouth"""
         self._head.stop("mouth")
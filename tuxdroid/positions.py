@@ -0,0 +1,116 @@
+"""Module defining TuxDroid actuator positions
+
+Positions of wings, eyes and mouth are enum members, also equal to
+their names as strings ("UP", "OPENED", ...). Sensor events change
+positions through precomputed transition tables shared by components.
+Each component runs its own state machine, which counts transitions
+and calls hooks.
+"""
+import collections
+import enum
+import logging
+import threading
+
+
+class Position(str, enum.Enum):
+    """Actuator position"""
+    UP = "UP"
+    DOWN = "DOWN"
+    OPENED = "OPENED"
+    CLOSED = "CLOSED"
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+
+class Transitions():
+    """Transition table of an actuator
+
+    table: {(position, event): new position}, None is the unknown position
+    """
+    def __init__(self, name: str, table: dict):
+        self.name = name
+        self.table = dict(table)
+        self.events = frozenset(event for _, event in self.table)
+        self.positions = frozenset(position for position in self.table.values())
+
+    def position(self, name):
+        """Get a reachable position from its name, None if not reachable"""
+        try:
+            position = Position(str(name).upper())
+        except ValueError:
+            return None
+        return position if position in self.positions else None
+
+
+WINGS = Transitions("wings", {
+    # Each moving sensor edge flips wings
+    (Position.UP, "moving"): Position.DOWN,
+    (Position.DOWN, "moving"): Position.UP,
+})
+
+# Eyes and mouth sensors give the absolute position
+EYELID = Transitions("eyelid", {
+    (position, event): Position(event.upper())
+    for position in (None, Position.OPENED, Position.CLOSED)
+    for event in ("opened", "closed")
+})
+
+
+class StateMachine():
+    """Position state machine of one component
+
+    error: exception class raised on invalid transitions
+    Hooks are called with (old position, event, new position)
+    after each transition.
+    """
+    def __init__(self, transitions: Transitions, error):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("positions")
+        # Set attributes
+        self.transitions = transitions
+        self.error = error
+        self.invalid = 0
+        # Privates
+        self._table = transitions.table
+        self._counts = collections.Counter()
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def next(self, position, event: str):
+        """Get the position after an event, raise on invalid transitions"""
+        try:
+            return self._table[position, event]
+        except KeyError:
+            with self._lock:
+                self.invalid += 1
+            raise self.error("Bad position: no `{}` transition from {}".format(event, position))
+
+    def target(self, name):
+        """Get a position to move to from its name, None if not reachable"""
+        return self.transitions.position(name)
+
+    def add_hook(self, hook):
+        """Call `hook(old, event, new)` after each transition"""
+        self._hooks.append(hook)
+
+    def del_hook(self, hook):
+        """Remove a transition hook"""
+        self._hooks.remove(hook)
+
+    def record(self, old, event: str, new):
+        """Count a transition done and call hooks"""
+        with self._lock:
+            self._counts[old, event, new] += 1
+        for hook in self._hooks:
+            try:
+                hook(old, event, new)
+            except Exception:  # pylint: disable=W0703
+                self._logger.exception("Transition hook `%s` failed", hook)
+
+    def metrics(self):
+        """Get transition counts: {"OLD -event-> NEW": count}, and invalid transitions"""
+        with self._lock:
+            counts = {"{} -{}-> {}".format(old, event, new): count
+                      for (old, event, new), count in self._counts.items()}
+            return {"transitions": counts, "invalid": self.invalid}
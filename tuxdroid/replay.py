@@ -0,0 +1,278 @@
+"""Module defining TuxDroid GPIO session recording and replay
+
+A recorder wraps a GPIO backend and saves every input edge and output
+write with its timestamp. A replay backend feeds the recorded edges back
+to the components, so hardware incidents become deterministic tests.
+
+.. code-block:: python
+
+    # On the robot
+    gpio = GPIORecorder(GPIO, "session.tuxrec")
+    tux = TuxDroid("config.yaml", gpio=gpio)
+    ...
+    gpio.close()
+
+    # In a test
+    gpio = ReplayGPIO("session.tuxrec")
+    tux = TuxDroid("config.yaml", gpio=gpio, calibrate=False)
+    gpio.play()
+    tux.wings.move(2)
+    gpio.wait()
+    assert not gpio.mismatches
+
+File format: a header (magic, version), then fixed size little endian
+records (time in seconds from the session start, kind, channel, value).
+"""
+import collections
+import logging
+import struct
+import threading
+import time
+
+from tuxdroid.errors import TuxDroidError
+from tuxdroid.gpio import _FakeGPIO
+
+
+MAGIC = b"TUXREC"
+VERSION = 1
+HEADER = struct.Struct("<6sH")
+RECORD = struct.Struct("<dBBB")
+
+# Record kinds
+EDGE = 0
+OUTPUT = 1
+
+Event = collections.namedtuple("Event", ("time", "kind", "channel", "value"))
+
+
+def read_recording(path: str):
+    """Read the events of a recording file"""
+    with open(path, "rb") as fobj:
+        data = fobj.read()
+    if len(data) < HEADER.size:
+        raise TuxDroidError("`{}` is not a TuxDroid recording".format(path))
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise TuxDroidError("`{}` is not a TuxDroid recording".format(path))
+    if version != VERSION:
+        raise TuxDroidError("Unsupported recording version {}".format(version))
+    # A truncated last record (crash while recording) is dropped
+    end = HEADER.size + (len(data) - HEADER.size) // RECORD.size * RECORD.size
+    return [Event(*record) for record in RECORD.iter_unpack(data[HEADER.size:end])]
+
+
+class GPIORecorder():
+    """GPIO backend wrapper saving input edges and output writes to a file
+
+    Other GPIO functions and constants are passed to the wrapped backend.
+    """
+    def __init__(self, backend, path: str):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("replay")
+        # Set attributes
+        self.backend = backend
+        self.path = path
+        self.count = 0
+        # Privates
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _record(self, kind, channel, value):
+        """Append one record"""
+        record = RECORD.pack(time.monotonic() - self._start, kind, channel, value)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(record)
+                self.count += 1
+
+    def _record_edge(self, channel, event_type):
+        """Append an edge record, reading the level of BOTH edges"""
+        if event_type not in (self.backend.RISING, self.backend.FALLING):
+            if self.backend.input(channel) == self.backend.HIGH:
+                event_type = self.backend.RISING
+            else:
+                event_type = self.backend.FALLING
+        self._record(EDGE, channel, event_type)
+
+    def add_event_detect(self, channel, event_type, callback=None, **kwargs):
+        """Add edge detection, recording edges before calling back"""
+        def recorded(gpio_id):
+            """Record the edge and run the callback"""
+            self._record_edge(gpio_id, event_type)
+            if callback is not None:
+                callback(gpio_id)
+
+        self.backend.add_event_detect(channel, event_type, callback=recorded, **kwargs)
+
+    def wait_for_edge(self, channel, event_type, *args, **kwargs):
+        """Wait for an edge and record it"""
+        result = self.backend.wait_for_edge(channel, event_type, *args, **kwargs)
+        if result is not None or not args and not kwargs:
+            # Not timed out
+            self._record_edge(channel, event_type)
+        return result
+
+    def output(self, channel, output_type):
+        """Set GPIO outputs and record them"""
+        self.backend.output(channel, output_type)
+        if isinstance(channel, (list, tuple)):
+            if not isinstance(output_type, (list, tuple)):
+                output_type = [output_type] * len(channel)
+            for sub_channel, sub_output_type in zip(channel, output_type):
+                self._record(OUTPUT, sub_channel, sub_output_type)
+        else:
+            self._record(OUTPUT, channel, output_type)
+
+    def close(self):
+        """Stop recording"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self._logger.info("%d GPIO events recorded in `%s`", self.count, self.path)
+
+
+class ReplayGPIO(_FakeGPIO):
+    """Fake GPIO replaying recorded input edges
+
+    Outputs do not simulate motors, edges come from the recording.
+    When the player reaches a recorded output, it waits for the components
+    to write the same value (up to `sync_timeout` seconds) and times
+    the next edges from it. So edges follow the code under test, not the
+    moment the test started the replay.
+
+    speed: replay speed factor, None to replay without delays.
+           Time thresholds (debounce, startup time, calibration) are not
+           scaled, so accelerate only sessions which do not depend on them
+    """
+    def __init__(self, path_or_events, speed: float = 1., sync_timeout: float = 5.):
+        super().__init__()
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("replay")
+        if isinstance(path_or_events, str):
+            path_or_events = read_recording(path_or_events)
+        # Set attributes
+        self.events = list(path_or_events)
+        self.speed = speed
+        self.sync_timeout = sync_timeout
+        # Recorded outputs the components did not write in time
+        self.mismatches = []
+        # Output writes seen during the replay
+        self.written = []
+        # Privates
+        self._writes = {}
+        self._consumed = {}
+        self._waited = {}
+        self._write_condition = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+        self._both_edges = {event.channel for event in self.events
+                            if event.kind == EDGE and event.value == self.FALLING}
+
+    def output(self, channel, output_type):
+        """Save GPIO outputs, and wake up the player"""
+        if isinstance(channel, (list, tuple)):
+            if not isinstance(output_type, (list, tuple)):
+                output_type = [output_type] * len(channel)
+            for sub_channel, sub_output_type in zip(channel, output_type):
+                self.output(sub_channel, sub_output_type)
+            return
+        self.outputs[channel] = output_type
+        with self._write_condition:
+            self.written.append((channel, output_type))
+            key = (channel, output_type)
+            self._writes[key] = self._writes.get(key, 0) + 1
+            self._write_condition.notify_all()
+
+    def _edge(self, channel, event_type=None):
+        """Replay an edge
+
+        Input levels follow the edges of channels recorded with both edges
+        """
+        if channel in self._both_edges:
+            self.levels[channel] = self.LOW if event_type == self.FALLING else self.HIGH
+        super()._edge(channel, event_type)
+
+    def wait_for_edge(self, channel, event_type, timeout=None):
+        """Wait for the next replayed edge
+
+        Unlike a real GPIO, edges replayed before the call are not missed:
+        the recorded session did see them.
+        timeout: in milliseconds, like RPi.GPIO
+        Return the channel, None on timeout
+        """
+        key = (event_type, channel)
+        with self._edges_condition:
+            if not self._edges_condition.wait_for(
+                    lambda: self._stop.is_set() or
+                    self._edges.get(key, 0) > self._waited.get(key, 0),
+                    None if timeout is None else timeout / 1000.):
+                return None
+            self._waited[key] = self._waited.get(key, 0) + 1
+        return channel
+
+    def _sync(self, channel, value):
+        """Wait for the components to write a recorded output"""
+        key = (channel, value)
+        with self._write_condition:
+            synced = self._write_condition.wait_for(
+                lambda: self._stop.is_set() or
+                self._writes.get(key, 0) > self._consumed.get(key, 0),
+                self.sync_timeout)
+            if synced and not self._stop.is_set():
+                self._consumed[key] = self._consumed.get(key, 0) + 1
+                return True
+        if not self._stop.is_set():
+            self._logger.warning("Recorded output GPIO %s=%s not written", channel, value)
+            self.mismatches.append((channel, value))
+        return False
+
+    def _play(self):
+        """Player thread"""
+        # Wall time of the recording origin
+        origin = time.monotonic()
+        offset = self.events[0].time if self.events else 0.
+        for event in self.events:
+            if self._stop.is_set():
+                return
+            if self.speed and event.kind != OUTPUT:
+                delay = origin + (event.time - offset) / self.speed - time.monotonic()
+                if delay > 0 and self._stop.wait(delay):
+                    return
+            if event.kind == OUTPUT:
+                self._sync(event.channel, event.value)
+                # Next edges are timed from the output
+                origin, offset = time.monotonic(), event.time
+            elif event.kind == EDGE:
+                self._edge(event.channel, event.value)
+
+    def play(self):
+        """Start the replay"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._play, name="tuxdroid-replay",
+                                            daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: float = None):
+        """Wait for the end of the replay, return True if it ended"""
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def cleanup(self):
+        """Stop the replay"""
+        self._stop.set()
+        with self._write_condition:
+            self._write_condition.notify_all()
+        with self._edges_condition:
+            self._edges_condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
@@ -0,0 +1,134 @@
+"""Module defining TuxDroid emergency stop and watchdog
+
+The emergency stop cuts all motor outputs with one batched GPIO write.
+It takes no lock and does no logging, so it can be called from a signal
+handler, even when the interrupted thread holds a component lock.
+
+The watchdog runs in its own thread, not in the shared scheduler,
+so a stuck scheduler callback can not delay it.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+from tuxdroid.gpio import GPIO
+
+
+# Config paths of motor outputs
+MOTOR_PINS = (("wings", "motor_direction_1"),
+              ("wings", "motor_direction_2"),
+              ("head", "mouth", "motor"),
+              ("head", "eyes", "motor"),
+              )
+
+
+def motor_pins(config: dict):
+    """Get motor output GPIOs present in a TuxDroid config"""
+    pins = []
+    for path in MOTOR_PINS:
+        section = config
+        for key in path[:-1]:
+            section = section.get(key) or {}
+        pin = section.get('gpio', {}).get(path[-1])
+        if pin is not None:
+            pins.append(pin)
+    return pins
+
+
+def cut_motors(pins, gpio=None):
+    """Set all motor GPIOs LOW in one write"""
+    gpio = gpio or GPIO
+    if pins:
+        gpio.output(list(pins), gpio.LOW)
+
+
+def install_signal_handlers(tux, signums=(signal.SIGINT, signal.SIGTERM)):
+    """Run TuxDroid emergency stop on signals, then the previous handler"""
+    for signum in signums:
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame, previous=previous):
+            """Emergency stop signal handler"""
+            tux.emergency_stop()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+
+        signal.signal(signum, handler)
+
+
+class Watchdog():
+    """Trigger TuxDroid emergency stop when motors or the control loop misbehave
+
+    max_motor_time: longest time a motor can stay energised
+    heartbeat_timeout: longest time without `heartbeat()` call, 0 disables it
+    interval: check period
+    """
+    def __init__(self, tux, max_motor_time: float = 10., heartbeat_timeout: float = 0.,
+                 interval: float = 0.05):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("watchdog")
+        # Set attributes
+        self.tux = tux
+        self.max_motor_time = max_motor_time
+        self.heartbeat_timeout = heartbeat_timeout
+        self.interval = interval
+        self.tripped = None
+        # Privates
+        self._last_heartbeat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watchdog thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self.heartbeat()
+            self._thread = threading.Thread(target=self._run, name="tuxdroid-watchdog",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop watchdog thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def heartbeat(self):
+        """Tell the watchdog the control loop is alive"""
+        self._last_heartbeat = time.monotonic()
+
+    def reset(self):
+        """Rearm the watchdog after a trip"""
+        self.tripped = None
+        self.heartbeat()
+
+    def check(self):
+        """Return the reason to trip, or None"""
+        if self.heartbeat_timeout and \
+                time.monotonic() - self._last_heartbeat > self.heartbeat_timeout:
+            return "no heartbeat for {}s".format(self.heartbeat_timeout)
+        # Monotonic: clock steps (NTP, date set on a Pi without RTC) do not trip it
+        now = time.monotonic()
+        for name, component in self.tux.moving_components():
+            started_at = component.motor_started_at
+            if started_at is not None and now - started_at > self.max_motor_time:
+                return "{} motor energised for more than {}s".format(
+                    name, self.max_motor_time)
+        return None
+
+    def _run(self):
+        """Watchdog thread"""
+        while not self._stop.wait(self.interval):
+            if self.tripped is not None:
+                continue
+            reason = self.check()
+            if reason is not None:
+                self.tripped = reason
+                self.tux.emergency_stop()
+                self._logger.error("Watchdog emergency stop: %s", reason)
@@ -0,0 +1,141 @@
+"""Module defining TuxDroid timer scheduler
+
+All delayed and periodic actions of a process (gesture timeouts, led blinks,
+fake GPIO motors, ...) share one scheduler thread and one heap of deadlines,
+instead of a sleeping thread per pending timer.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Timer():
+    """Handle of a scheduled call"""
+
+    __slots__ = ("when", "callback", "args", "interval", "cancelled")
+
+    def __init__(self, when: float, callback, args, interval=None):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        # Period of repeated calls
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the call if it did not run yet"""
+        self.cancelled = True
+
+
+class Scheduler():
+    """Run callbacks at given times from a single thread
+
+    Callbacks must be short: a slow callback delays every later timer.
+    The thread is started on the first scheduled call.
+    """
+    def __init__(self, clock=time.monotonic):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("scheduler")
+        # Privates
+        self._clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def time(self):
+        """Scheduler clock"""
+        return self._clock()
+
+    def call_at(self, when: float, callback, *args):
+        """Call `callback(*args)` at scheduler time `when`"""
+        return self._push(Timer(when, callback, args))
+
+    def call_later(self, delay: float, callback, *args):
+        """Call `callback(*args)` in `delay` seconds"""
+        return self.call_at(self._clock() + delay, callback, *args)
+
+    def call_every(self, interval: float, callback, *args):
+        """Call `callback(*args)` every `interval` seconds, starting in `interval`
+
+        Calls are scheduled from the first deadline, so they do not drift.
+        Cancel the returned timer to stop them.
+        """
+        return self._push(Timer(self._clock() + interval, callback, args, interval))
+
+    def _push(self, timer):
+        """Add a timer to the heap"""
+        when = timer.when
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._counter), timer))
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name="tuxdroid-scheduler",
+                                                daemon=True)
+                self._thread.start()
+            elif self._heap[0][2] is timer:
+                # New earliest deadline
+                self._condition.notify()
+        return timer
+
+    def in_thread(self):
+        """True if called from a scheduled callback"""
+        return self._thread is threading.current_thread()
+
+    def pending(self):
+        """Number of timers not run nor cancelled"""
+        with self._condition:
+            return sum(1 for _, _, timer in self._heap if not timer.cancelled)
+
+    def shutdown(self):
+        """Stop the scheduler thread, pending timers are dropped"""
+        with self._condition:
+            self._running = False
+            self._heap = []
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        """Scheduler thread"""
+        while True:
+            with self._condition:
+                while self._running:
+                    if self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    if self._heap:
+                        delay = self._heap[0][0] - self._clock()
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None
+                    self._condition.wait(delay)
+                if not self._running:
+                    return
+                timer = heapq.heappop(self._heap)[2]
+            try:
+                timer.callback(*timer.args)
+            except Exception:  # pylint: disable=W0703
+                self._logger.exception("Timer callback `%s` failed", timer.callback)
+            if timer.interval is not None and not timer.cancelled and self._running:
+                timer.when += timer.interval
+                self._push(timer)
+
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler():
+    """Get the scheduler shared by all components"""
+    global _SCHEDULER  # pylint: disable=W0603
+    if _SCHEDULER is None:
+        with _SCHEDULER_LOCK:
+            if _SCHEDULER is None:
+                _SCHEDULER = Scheduler()
+    return _SCHEDULER
@@ -0,0 +1,561 @@
+"""Module defining TuxDroid speaker
+
+PCM audio (signed 16 bits by default) is streamed from sources (wav files,
+generators of bytes) through a fixed-size ring buffer to a sink:
+ALSA when `pyalsaaudio` is installed, a wav file or nothing for tests.
+
+A feeder thread fills the ring buffer from queued sources, one after the
+other with no gap, while a writer thread sends periods to the sink.
+Playback positions follow what the sink consumed, so mouth moves can
+be synced to the sound:
+
+.. code-block:: python
+
+    playback = tux.speaker.play("hello.wav")
+    playback.add_cue(0.2, tux.head.mouth.open)
+    playback.add_cue(0.6, tux.head.mouth.close)
+    playback.wait()
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import bisect
+import collections
+import array
+import logging
+import math
+import sys
+import threading
+import time
+import wave
+
+from tuxdroid.errors import TuxDroidSpeakerError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+SINKS = ("auto", "alsa", "file", "null")
+
+
+class ByteRing():
+    """Preallocated ring buffer of bytes, between one writer and one reader
+
+    Offsets count bytes since the buffer creation.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self.read_offset = 0
+        self.write_offset = 0
+        self._condition = threading.Condition()
+
+    def available(self):
+        """Bytes which can be read"""
+        return self.write_offset - self.read_offset
+
+    def write(self, data, cancelled=None):
+        """Copy data, waiting for free space
+
+        cancelled: function returning True to give up waiting
+        Return the number of bytes written
+        """
+        view = memoryview(data)
+        done = 0
+        while done < len(view):
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self.available() < self.size or (cancelled and cancelled()))
+                if cancelled and cancelled():
+                    return done
+                count = min(len(view) - done, self.size - self.available())
+                start = self.write_offset % self.size
+                first = min(count, self.size - start)
+                self._buffer[start:start + first] = view[done:done + first]
+                self._buffer[:count - first] = view[done + first:done + count]
+                self.write_offset += count
+                done += count
+                self._condition.notify_all()
+        return done
+
+    def read(self, size: int, timeout: float = None):
+        """Get up to `size` bytes, waiting for some"""
+        data = bytearray(size)
+        return bytes(data[:self.read_into(data, timeout)])
+
+    def read_into(self, buffer, timeout: float = None):
+        """Copy up to `len(buffer)` bytes into a writable buffer, waiting for some
+
+        Return the number of bytes copied, 0 on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.available() > 0, timeout):
+                return 0
+            count = min(len(buffer), self.available())
+            start = self.read_offset % self.size
+            first = min(count, self.size - start)
+            buffer[:first] = self._view[start:start + first]
+            buffer[first:count] = self._view[:count - first]
+            self.read_offset += count
+            self._condition.notify_all()
+            return count
+
+    def discard(self, offset: int):
+        """Drop unread bytes before an offset"""
+        with self._condition:
+            self.read_offset = max(self.read_offset, min(offset, self.write_offset))
+            self._condition.notify_all()
+
+    def wake_up(self):
+        """Wake up waiting threads to check their cancel condition"""
+        with self._condition:
+            self._condition.notify_all()
+
+
+class NullSink():
+    """Sink dropping audio
+
+    realtime: if True, consume audio at its real rate like a sound card
+    """
+    latency = 0.
+
+    def __init__(self, realtime: bool = True):
+        self.realtime = realtime
+        self._byte_rate = None
+        self._deadline = None
+
+    def open(self, rate: int, channels: int, width: int):
+        """Set the audio format"""
+        self._byte_rate = rate * channels * width
+
+    def write(self, data):
+        """Consume audio"""
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        if self._deadline is None or self._deadline < now:
+            # Device was idle
+            self._deadline = now
+        self._deadline += len(data) / self._byte_rate
+        time.sleep(max(0., self._deadline - now))
+
+    def close(self):
+        """Release the sink"""
+        self._deadline = None
+
+
+class FileSink(NullSink):
+    """Sink writing audio to a wav file, as fast as possible"""
+
+    def __init__(self, path: str, realtime: bool = False):
+        super().__init__(realtime)
+        self.path = path
+        self._file = None
+
+    def open(self, rate: int, channels: int, width: int):
+        """Create the wav file"""
+        super().open(rate, channels, width)
+        self._file = wave.open(self.path, "wb")
+        self._file.setnchannels(channels)
+        self._file.setsampwidth(width)
+        self._file.setframerate(rate)
+
+    def write(self, data):
+        """Append audio to the file"""
+        self._file.writeframesraw(data)
+        super().write(data)
+
+    def close(self):
+        """Close the wav file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+class AlsaSink():
+    """Sink playing audio with ALSA"""
+
+    def __init__(self, device: str = "default", period_time: float = 0.02, periods: int = 4):
+        if alsaaudio is None:
+            raise TuxDroidSpeakerError("ALSA sink needs the `pyalsaaudio` package")
+        self.device = device
+        self.period_time = period_time
+        self.periods = periods
+        self.latency = period_time * periods
+        self._pcm = None
+
+    def open(self, rate: int, channels: int, width: int):
+        """Open the ALSA device"""
+        formats = {1: alsaaudio.PCM_FORMAT_S8, 2: alsaaudio.PCM_FORMAT_S16_LE,
+                   4: alsaaudio.PCM_FORMAT_S32_LE}
+        self._pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device=self.device, rate=rate,
+                                  channels=channels, format=formats[width],
+                                  periodsize=int(rate * self.period_time),
+                                  periods=self.periods)
+
+    def write(self, data):
+        """Play audio, blocking while the device buffer is full"""
+        self._pcm.write(data)
+
+    def close(self):
+        """Close the ALSA device"""
+        if self._pcm is not None:
+            self._pcm.close()
+            self._pcm = None
+
+
+def get_sink(name: str = "auto", path: str = None, device: str = "default",
+             period_time: float = 0.02):
+    """Get a sink by name, `auto` is ALSA when available"""
+    if name not in SINKS:
+        raise TuxDroidSpeakerError("Bad sink `{}`, should be in {}".format(name, SINKS))
+    if name == "auto":
+        name = "alsa" if alsaaudio is not None else "null"
+    if name == "alsa":
+        return AlsaSink(device, period_time)
+    if name == "file":
+        if path is None:
+            raise TuxDroidSpeakerError("File sink needs a path")
+        return FileSink(path)
+    return NullSink()
+
+
+def _wav_chunks(wav, chunk_frames):
+    """Read chunks of an open wav file, then close it"""
+    with wav:
+        while True:
+            data = wav.readframes(chunk_frames)
+            if not data:
+                return
+            yield data
+
+
+def wav_source(path: str, rate: int, channels: int, width: int, chunk_frames: int = 1024):
+    """Get PCM chunks of a wav file, raise if it is not in the speaker format"""
+    wav = wave.open(path, "rb")
+    if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (rate, channels, width):
+        wav.close()
+        raise TuxDroidSpeakerError(
+            "`{}` format is {}Hz {}ch {}bits, speaker plays {}Hz {}ch {}bits".format(
+                path, wav.getframerate(), wav.getnchannels(), wav.getsampwidth() * 8,
+                rate, channels, width * 8))
+    return _wav_chunks(wav, chunk_frames)
+
+
+def tone(frequency: float, duration: float, rate: int = 16000, volume: float = 0.5,
+         chunk_frames: int = 1024):
+    """Generate mono signed 16 bits chunks of a sine tone"""
+    frames = int(rate * duration)
+    step = 2 * math.pi * frequency / rate
+    amplitude = volume * 32767
+    for start in range(0, frames, chunk_frames):
+        samples = array.array("h", (int(amplitude * math.sin(step * index))
+                                    for index in range(start, min(frames, start + chunk_frames))))
+        if sys.byteorder == "big":
+            samples.byteswap()
+        yield samples.tobytes()
+
+
+class Playback():
+    """Handle of a queued sound
+
+    `future` result is True once played, False if cancelled.
+    """
+    def __init__(self, owner, source):
+        self.source = source
+        self.future = Future()
+        self.cancelled = False
+        # Stream offsets, set when fed
+        self.start_offset = None
+        self.end_offset = None
+        # Privates
+        self._speaker = owner
+        self._cues = []
+        self._cue_lock = threading.Lock()
+
+    def cancel(self):
+        """Stop or unqueue the sound"""
+        self.cancelled = True
+        self._speaker._wake_up()
+
+    def wait(self, timeout: float = None):
+        """Wait for the end of the sound, return True if it was played"""
+        return self.future.result(timeout)
+
+    def done(self):
+        """True once played or cancelled"""
+        return self.future.done()
+
+    def position(self):
+        """Seconds of the sound played by the sink, None before it starts"""
+        return self._speaker._position(self)
+
+    def add_cue(self, seconds: float, callback):
+        """Call `callback()` when the sound reaches a position"""
+        with self._cue_lock:
+            bisect.insort(self._cues, (seconds, id(callback), callback))
+
+    def _due_cues(self, position: float):
+        """Pop cues reached at a position"""
+        with self._cue_lock:
+            index = bisect.bisect_right(self._cues, (position, float("inf")))
+            due, self._cues = self._cues[:index], self._cues[index:]
+        return [callback for _, _, callback in due]
+
+
+class Speaker():
+    """Speaker component
+
+    sink: audio sink, like `get_sink("null")`
+    buffer_time: ring buffer length in seconds
+    period_time: audio sent to the sink at once, in seconds
+    Set `gain` (0 to 1) to scale 16 bits samples as they are sent to the sink.
+    """
+    def __init__(self, sink, rate: int = 16000, channels: int = 1, width: int = 2,
+                 buffer_time: float = 0.5, period_time: float = 0.02):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("speaker")
+        # Set attributes
+        self.sink = sink
+        self.rate = rate
+        self.channels = channels
+        self.width = width
+        self.frame_size = channels * width
+        self.byte_rate = rate * self.frame_size
+        # Privates
+        self._period_bytes = max(1, int(rate * period_time)) * self.frame_size
+        # Period buffer reused by the writer thread, scaled in place by the gain
+        self._period = bytearray(self._period_bytes)
+        self._period_view = memoryview(self._period)
+        self._gain = 1.
+        if width == 2 and numpy is not None:
+            self._samples = numpy.frombuffer(self._period, dtype="<i2")
+        elif width == 2:
+            self._samples = self._period_view.cast("h")
+        self._ring = ByteRing(max(1, int(rate * buffer_time)) * self.frame_size)
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._feeding = collections.deque()
+        self._pending_condition = threading.Condition(self._lock)
+        # Bytes consumed by the sink and monotonic time of the last write
+        self._played_offset = 0
+        self._played_at = None
+        self._running = False
+        self._threads = []
+        self._thread_pool = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def gain(self):
+        """Amplitude factor between 0 and 1"""
+        return self._gain
+
+    @gain.setter
+    def gain(self, gain: float):
+        if self.width != 2:
+            raise TuxDroidSpeakerError("Gain needs 16 bits samples")
+        if not 0 <= gain <= 1:
+            raise TuxDroidSpeakerError("Gain should be between 0 and 1")
+        self._gain = float(gain)
+
+    def _apply_gain(self, count: int):
+        """Scale the first `count` bytes of the period buffer in place"""
+        gain = self._gain
+        samples = self._samples[:count // 2]
+        if numpy is not None:
+            numpy.multiply(samples, gain, out=samples, casting="unsafe")
+        elif sys.byteorder == "little":
+            for index in range(len(samples)):
+                samples[index] = int(samples[index] * gain)
+        else:
+            swapped = array.array("h", self._period_view[:count])
+            swapped.byteswap()
+            for index in range(len(swapped)):
+                swapped[index] = int(swapped[index] * gain)
+            swapped.byteswap()
+            self._period_view[:count] = swapped.tobytes()
+
+    def start(self):
+        """Open the sink and start the threads, done on the first play"""
+        with self._lock:
+            if self._running:
+                return
+            self.sink.open(self.rate, self.channels, self.width)
+            self._running = True
+            self._threads = [threading.Thread(target=target, name=name, daemon=True)
+                             for target, name in ((self._feed, "tuxdroid-speaker-feed"),
+                                                  (self._write, "tuxdroid-speaker-write"))]
+        for thread in self._threads:
+            thread.start()
+
+    def play(self, source):
+        """Queue a sound, played right after the previous ones
+
+        source: wav file path, or iterable of PCM bytes in the speaker format
+        Return a Playback
+        """
+        if isinstance(source, str):
+            source = wav_source(source, self.rate, self.channels, self.width)
+        playback = Playback(self, source)
+        self.start()
+        with self._lock:
+            self._pending.append(playback)
+            self._pending_condition.notify_all()
+        return playback
+
+    def cancel(self):
+        """Stop the playing sound and drop the queued ones"""
+        with self._lock:
+            playbacks = list(self._pending) + list(self._feeding)
+        for playback in playbacks:
+            playback.cancelled = True
+        self._wake_up()
+
+    def _wake_up(self):
+        """Wake up threads to check cancellations"""
+        with self._lock:
+            self._pending_condition.notify_all()
+        self._ring.wake_up()
+
+    def playing(self):
+        """Get the Playback heard now, None if silent"""
+        with self._lock:
+            for playback in self._feeding:
+                if playback.start_offset is not None and \
+                        playback.start_offset <= self._played_offset and not playback.done():
+                    return playback
+        return None
+
+    def clock(self):
+        """Position in seconds of the sound heard now, None if silent"""
+        playback = self.playing()
+        return None if playback is None else playback.position()
+
+    def _position(self, playback):
+        """Seconds of a playback consumed by the sink"""
+        with self._lock:
+            start = playback.start_offset
+            played, played_at = self._played_offset, self._played_at
+        if start is None or played <= start or played_at is None:
+            return None
+        position = (played - start) / self.byte_rate
+        # Interpolate within the current period
+        position += min(time.monotonic() - played_at, self._period_bytes / self.byte_rate)
+        position -= getattr(self.sink, "latency", 0.)
+        if playback.end_offset is not None:
+            position = min(position, (playback.end_offset - start) / self.byte_rate)
+        return max(0., position)
+
+    def _feed(self):
+        """Feeder thread: copy queued sources into the ring buffer"""
+        while True:
+            with self._lock:
+                self._pending_condition.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+                playback = self._pending.popleft()
+                playback.start_offset = self._ring.write_offset
+                self._feeding.append(playback)
+
+            def cancelled(playback=playback):
+                """Stop feeding a cancelled sound"""
+                return playback.cancelled or not self._running
+
+            try:
+                for data in playback.source:
+                    if cancelled():
+                        break
+                    # Keep whole frames
+                    data = data[:len(data) - len(data) % self.frame_size]
+                    self._ring.write(data, cancelled)
+            except Exception:  # pylint: disable=W0703
+                self._logger.exception("Audio source failed")
+                playback.cancelled = True
+            with self._lock:
+                playback.end_offset = self._ring.write_offset
+            self._ring.wake_up()
+
+    def _write(self):
+        """Writer thread: send ring buffer periods to the sink"""
+        while self._running:
+            self._finish()
+            count = self._ring.read_into(self._period, timeout=0.1)
+            if not count:
+                continue
+            if self._gain != 1.:
+                self._apply_gain(count)
+            self.sink.write(self._period_view[:count])
+            with self._lock:
+                self._played_offset += count
+                self._played_at = time.monotonic()
+            self._run_cues()
+
+    def _finish(self):
+        """Skip cancelled sounds and resolve finished ones"""
+        with self._lock:
+            feeding = list(self._feeding)
+            for playback in list(self._pending):
+                if playback.cancelled:
+                    self._pending.remove(playback)
+                    playback.future.set_result(False)
+        for playback in feeding:
+            if playback.cancelled:
+                # Drop its unread audio, the next sound starts right away
+                self._ring.discard(playback.end_offset if playback.end_offset is not None
+                                   else self._ring.write_offset)
+                if playback.end_offset is None:
+                    # Still fed, finish it later
+                    return
+                with self._lock:
+                    self._played_offset = max(self._played_offset, playback.end_offset)
+                result = False
+            elif playback.end_offset is not None and self._played_offset >= playback.end_offset:
+                result = True
+            else:
+                return
+            with self._lock:
+                self._feeding.remove(playback)
+            if not playback.future.done():
+                playback.future.set_result(result)
+
+    def _run_cues(self):
+        """Call cues of sounds reached by the sink"""
+        with self._lock:
+            feeding = list(self._feeding)
+        for playback in feeding:
+            position = self._position(playback)
+            if position is None:
+                break
+            for callback in playback._due_cues(position):
+                self._thread_pool.submit(callback)
+
+    def stop(self):
+        """Cancel sounds, stop the threads and close the sink"""
+        self.cancel()
+        with self._lock:
+            self._running = False
+            self._pending_condition.notify_all()
+            threads, self._threads = self._threads, []
+        self._ring.wake_up()
+        for thread in threads:
+            thread.join()
+        self._finish()
+        for playback in list(self._feeding) + list(self._pending):
+            if not playback.future.done():
+                playback.future.set_result(False)
+        self._feeding.clear()
+        self._pending.clear()
+        if threads:
+            self.sink.close()
+
+
+def speaker(config: dict):
+    """Get a speaker from a `speaker` config section"""
+    sink = get_sink(config['sink'], period_time=config['period_time'])
+    return Speaker(sink, buffer_time=config['buffer_time'], period_time=config['period_time'])
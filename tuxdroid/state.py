@@ -0,0 +1,96 @@
+"""Module defining TuxDroid component state
+
+Component state is an immutable snapshot replaced as a whole under a lock.
+GPIO callback threads serialize their updates, while readers only
+fetch the current snapshot: they never take the lock, so polling
+the state does not slow the callback path down.
+"""
+import collections
+import threading
+import time
+
+
+ComponentState = collections.namedtuple("ComponentState", (
+    "position",
+    "is_moving",
+    # Movements since the last start
+    "count",
+    # Movements to do before stopping, None for no limit
+    "wanted_moves",
+    # Wall time of the last motor start
+    "motor_start_time",
+    # Monotonic time of the last update
+    "updated_at",
+    # Number of updates
+    "version",
+))
+
+TuxDroidState = collections.namedtuple("TuxDroidState", (
+    "wings", "eyes", "mouth", "led_left", "led_right"))
+
+
+class StateCell():
+    """Hold the current state of a component"""
+
+    def __init__(self, **fields):
+        values = dict.fromkeys(ComponentState._fields)
+        values.update(is_moving=False, count=0, updated_at=time.monotonic(), version=0)
+        values.update(fields)
+        self._state = ComponentState(**values)
+        # Reentrant, so a signal handler interrupting a locked section
+        # of its thread can still take it
+        self._lock = threading.RLock()
+        # Locked sections running, more than one inside a signal handler
+        self._depth = 0
+        # Changes made by a signal handler while a locked section ran
+        self._forced = {}
+
+    def snapshot(self):
+        """Get the current state, without locking"""
+        return self._state
+
+    def update(self, **changes):
+        """Change some fields at once, return the new state
+
+        It can run in a signal handler: changes made while the interrupted
+        thread held the lock are applied again when its section ends
+        """
+        return self.modify(lambda state: changes)[1]
+
+    def modify(self, function):
+        """Change fields computed from the current state at once
+
+        function: gets the current state and returns the changes as a dict
+        Return (old state, new state)
+        """
+        with self._lock:
+            # Nested in a section of this thread, which would write back its older state
+            forced = self._depth > 0
+            self._depth += 1
+            try:
+                old = self._state
+                changes = function(old)
+                if forced:
+                    self._forced.update(changes)
+                new = old._replace(updated_at=time.monotonic(), version=old.version + 1,
+                                   **changes)
+                self._state = new
+                if self._forced and not forced:
+                    new = new._replace(**self._forced)
+                    self._state = new
+                return old, new
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self._forced = {}
+
+
+def state_property(field: str, doc: str = None):
+    """Component attribute stored in its `_state` cell"""
+    def getter(self):
+        return getattr(self._state.snapshot(), field)
+
+    def setter(self, value):
+        self._state.update(**{field: value})
+
+    return property(getter, setter, doc=doc)
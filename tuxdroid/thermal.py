@@ -0,0 +1,186 @@
+"""Module defining TuxDroid motor thermal protection
+
+Each motor gets a thermal budget: the longest time it can be energised
+in a sliding window. Start and stop times are recorded, and:
+
+* a running motor is stopped when its budget runs out
+* a start without budget left waits for the motor to cool down
+  (``wait`` policy) or raises an error (``reject`` policy)
+
+Waits are bounded by `max_wait`, and a start from a thread which must not
+block (a running event loop or the shared scheduler) is rejected instead.
+"""
+import collections
+import logging
+import threading
+import time
+
+from tuxdroid.callbacks import running_loop
+from tuxdroid.errors import TuxDroidThermalError
+from tuxdroid.scheduler import get_scheduler
+
+
+POLICIES = ("wait", "reject")
+
+
+class MotorBudget():
+    """On-time accounting of one motor
+
+    window: sliding window length in seconds
+    budget: longest energised time in the window
+    min_run: budget needed to start the motor
+    max_wait: longest cooldown waited by the `wait` policy, longer ones are rejected
+    on_exhausted: function called when the running motor runs out of budget
+    """
+    def __init__(self, name: str, window: float = 60., budget: float = 40.,
+                 min_run: float = 1., policy: str = "wait", on_exhausted=None,
+                 clock=time.monotonic, max_wait: float = 10.):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("thermal")
+        if policy not in POLICIES:
+            raise TuxDroidThermalError("Bad thermal policy `{}`, should be in {}".format(
+                policy, POLICIES))
+        # Set attributes
+        self.name = name
+        self.window = window
+        self.budget = budget
+        self.min_run = min(min_run, budget)
+        self.policy = policy
+        self.max_wait = max_wait
+        self.on_exhausted = on_exhausted
+        self.throttled = 0
+        # Privates
+        self._clock = clock
+        # [start, stop] times, stop is None while running
+        self._intervals = collections.deque()
+        # Reentrant, so an emergency stop in a signal handler can record the stop
+        self._lock = threading.RLock()
+        self._cutoff = None
+        # Recorded stops, tells a start interrupted by a stop
+        self._stops = 0
+
+    def _prune(self, now):
+        """Drop intervals ended before the window"""
+        while self._intervals and self._intervals[0][1] is not None and \
+                self._intervals[0][1] <= now - self.window:
+            self._intervals.popleft()
+
+    def _on_time(self, now):
+        """Energised time in the window ending at `now`"""
+        start_window = now - self.window
+        total = 0.
+        for start, stop in self._intervals:
+            stop = now if stop is None else min(stop, now)
+            if stop > start_window:
+                total += stop - max(start, start_window)
+        return total
+
+    def on_time(self):
+        """Energised time in the current window"""
+        with self._lock:
+            now = self._clock()
+            self._prune(now)
+            return self._on_time(now)
+
+    def remaining(self):
+        """Energised time left in the current window"""
+        return max(0., self.budget - self.on_time())
+
+    def cooldown(self, amount: float = None):
+        """Seconds to wait, motor off, before `amount` of budget is available"""
+        amount = self.min_run if amount is None else amount
+        with self._lock:
+            now = self._clock()
+            if self.budget - self._on_time(now) >= amount:
+                return 0.
+            # On time only decreases while the motor is off
+            low, high = now, now + self.window
+            for _ in range(32):
+                middle = (low + high) / 2
+                if self.budget - self._on_time(middle) >= amount:
+                    high = middle
+                else:
+                    low = middle
+            return high - now
+
+    def acquire(self):
+        """Wait for or check the budget needed to start the motor"""
+        wait = self.cooldown()
+        if not wait:
+            return
+        self.throttled += 1
+        if self.policy == "reject":
+            raise TuxDroidThermalError("{} motor is cooling down, retry in {:.1f}s".format(
+                self.name, wait))
+        if wait > self.max_wait:
+            raise TuxDroidThermalError("{} motor is cooling down for {:.1f}s, longer than "
+                                       "{:.1f}s".format(self.name, wait, self.max_wait))
+        if running_loop() is not None or get_scheduler().in_thread():
+            raise TuxDroidThermalError("{} motor is cooling down, retry in {:.1f}s, it can "
+                                       "not be waited for in this thread".format(self.name,
+                                                                                 wait))
+        self._logger.warning("%s motor is cooling down, waiting %.1fs", self.name, wait)
+        deadline = self._clock() + self.max_wait
+        while wait:
+            if self._clock() + wait > deadline:
+                raise TuxDroidThermalError("{} motor is still cooling down after {:.1f}s"
+                                           .format(self.name, self.max_wait))
+            time.sleep(wait)
+            wait = self.cooldown()
+
+    def motor_on(self):
+        """Record motor start and arm the budget cutoff"""
+        with self._lock:
+            now = self._clock()
+            if self._intervals and self._intervals[-1][1] is None:
+                # Already running
+                return
+            stops = self._stops
+            self._prune(now)
+            remaining = max(0., self.budget - self._on_time(now))
+            self._intervals.append([now, None])
+            if self.on_exhausted is not None:
+                self._cutoff = get_scheduler().call_later(remaining, self._exhausted)
+            if self._stops != stops:
+                # Stopped by a signal handler meanwhile
+                self._motor_off()
+
+    def motor_off(self):
+        """Record motor stop
+
+        It can run in a signal handler which interrupted `motor_on`
+        """
+        with self._lock:
+            self._stops += 1
+            self._motor_off()
+
+    def _motor_off(self):
+        """Close the running interval, the caller should hold the lock"""
+        if self._intervals and self._intervals[-1][1] is None:
+            self._intervals[-1][1] = self._clock()
+        if self._cutoff is not None:
+            self._cutoff.cancel()
+            self._cutoff = None
+
+    def _exhausted(self):
+        """Stop the running motor"""
+        self.throttled += 1
+        self._logger.warning("%s motor thermal budget exhausted, stopping it", self.name)
+        self.on_exhausted()
+
+    def state(self):
+        """Get budget state"""
+        on_time = self.on_time()
+        return {"on_time": on_time,
+                "budget": self.budget,
+                "window": self.window,
+                "remaining": max(0., self.budget - on_time),
+                "running": bool(self._intervals) and self._intervals[-1][1] is None,
+                "throttled": self.throttled,
+                }
+
+
+def motor_budget(name: str, config: dict, on_exhausted=None):
+    """Get a motor budget from a `thermal` config section"""
+    return MotorBudget(name, config['window'], config['budget'], config['min_run'],
+                       config['policy'], on_exhausted, max_wait=config['max_wait'])
@@ -1,46 +1,178 @@
 """Module defining TuxDroid robot"""
 import logging
 import os
+import threading
 
-import yaml
-
-from tuxdroid.gpio import GPIO, FAKE_GPIO
-from tuxdroid.wings import Wings
-from tuxdroid.head import Head
+from tuxdroid.config import load_config, validate
+from tuxdroid.gpio import GPIO
 from tuxdroid.errors import TuxDroidError
+from tuxdroid.gestures import GestureRecognizer
+from tuxdroid.safety import Watchdog, cut_motors
+from tuxdroid.state import TuxDroidState
+
+
+PARTS = ('wings', 'head')
 
 
 class TuxDroid():
-    """TuxDroid main class"""
+    """TuxDroid main class
 
-    def __init__(self, config, logging_level=logging.INFO):
+    lazy: if True, `head` and `wings` are built on first access
+          instead of in the constructor
+    parts: subset of parts to use, ('wings', 'head') by default,
+           accessing another part raises an error
+    calibrate: if False, motors are not moved when parts are built,
+               each actuator calibrates itself on its first move
+    config_cache: if `config` is a yaml file, keep a pre-parsed copy of it
+    gpio: GPIO backend of this robot, the module `GPIO` by default.
+          Give each robot its own backend (like `new_fake_gpio()`)
+          to drive several robots from one process
+    """
+
+    def __init__(self, config, logging_level=logging.INFO, lazy=False,
+                 parts=None, calibrate=True, config_cache=False, gpio=None):
         # Get logger
         self.logging_level = logging_level
         self._logger = None
         self._get_logger()
         # Set GPIO
-        GPIO.setmode(GPIO.BCM)
+        self.gpio = gpio or GPIO
+        self.gpio.setmode(self.gpio.BCM)
 
-        self._parts = ('wings', 'head')
+        self._parts = PARTS if parts is None else tuple(parts)
+        for part in self._parts:
+            if part not in PARTS:
+                raise TuxDroidError("Bad part `{}`, should be in {}".format(part, PARTS))
+        self._calibrate = calibrate
+        self._head = None
+        self._wings = None
+        self._speaker = None
+        self._volume = None
+        # Input bit layout and GPIO registers, set on first read_inputs()
+        self._input_map = None
+        self._register_reader = None
+        self.microphone = None
+        self._parts_lock = threading.RLock()
+        # Functions called with the name of each built part
+        self._build_callbacks = []
+        self.watchdog = None
         # Configuration
         self._config = config
+        self._config_cache = config_cache
         self._check_config()
         # Handle fake GPIO
-        if FAKE_GPIO:
-            GPIO.set_config_(self.config)
-        # Head
-        self.head = Head(self.config['head'])
-        # Set left eye on
-        self.head.eyes.led_on("left")
-        # Wings
-        self.wings = Wings(self.config['wings'])
-        # Set eyes on
-        self.head.eyes.led_on()
+        if hasattr(self.gpio, "set_config_"):
+            self.gpio.set_config_(self.config)
+        # Button gestures of all parts
+        self.gestures = GestureRecognizer(**self.config['gestures'])
+        if not lazy:
+            if 'head' in self._parts:
+                self._build_head()
+            if 'wings' in self._parts:
+                self._build_wings()
+
+    @classmethod
+    def led_only(cls, config, logging_level=logging.INFO):
+        """Get a TuxDroid driving only the head button and eye leds
+
+        No motor is moved, so it starts in a few milliseconds
+        """
+        return cls(config, logging_level, parts=('head',), calibrate=False)
+
+    @property
+    def parts(self):
+        """Enabled parts"""
+        return self._parts
+
+    def _check_part(self, part):
+        """Raise if the part is not enabled"""
+        if part not in self._parts:
+            raise TuxDroidError("Part `{}` is not enabled".format(part))
+
+    def _build_head(self):
+        """Build and calibrate head"""
+        with self._parts_lock:
+            if self._head is None:
+                self._check_part('head')
+                from tuxdroid.head import Head
+                head = Head(self.config['head'], calibrate=self._calibrate, gpio=self.gpio)
+                head.set_gesture_recognizer(self.gestures)
+                # Set left eye on
+                head.eyes.led_on("left")
+                self._head = head
+                self._built('head')
+        return self._head
+
+    def _build_wings(self):
+        """Build and calibrate wings"""
+        with self._parts_lock:
+            if self._wings is None:
+                self._check_part('wings')
+                from tuxdroid.wings import Wings
+                wings = Wings(self.config['wings'], calibrate=self._calibrate, gpio=self.gpio)
+                wings.set_gesture_recognizer(self.gestures)
+                self._wings = wings
+                if self._head is not None:
+                    # Set eyes on
+                    self._head.eyes.led_on()
+                self._built('wings')
+        return self._wings
+
+    def is_built(self, part: str):
+        """Return True if a part was built"""
+        return getattr(self, "_" + part, None) is not None
+
+    def _built(self, part):
+        """Run build callbacks of a new part, the caller should hold the parts lock"""
+        for callback in self._build_callbacks:
+            callback(part)
+
+    def on_build(self, callback):
+        """Call `callback(part)` for each part already built, then for each new part
+
+        Unlike accessing `head` or `wings`, no part is built
+        """
+        with self._parts_lock:
+            for part in PARTS:
+                if self.is_built(part):
+                    callback(part)
+            self._build_callbacks.append(callback)
+
+    @property
+    def head(self):
+        """Head component, built on first access"""
+        return self._head or self._build_head()
+
+    @property
+    def wings(self):
+        """Wings component, built on first access"""
+        return self._wings or self._build_wings()
+
+    @property
+    def speaker(self):
+        """Speaker, built on first access"""
+        with self._parts_lock:
+            if self._speaker is None:
+                from tuxdroid.speaker import speaker
+                self._speaker = speaker(self.config['speaker'])
+        return self._speaker
+
+    @property
+    def volume(self):
+        """Volume buttons driving the speaker gain, built on first access"""
+        with self._parts_lock:
+            if self._volume is None:
+                from tuxdroid.volume import Volume
+                self._volume = Volume(self.config['volume'], self.speaker, gpio=self.gpio)
+        return self._volume
 
     def _get_logger(self):
         """Get logger"""
         self._logger = logging.getLogger("tuxdroid")
         self._logger.setLevel(self.logging_level)
+        if self._logger.handlers:
+            # Already set by another robot of the process
+            return
         console_handler = logging.StreamHandler()
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
         console_handler.setFormatter(formatter)
@@ -49,22 +181,176 @@ class TuxDroid():
     def _check_config(self):
         """Validate config"""
         if isinstance(self._config, str) and os.path.isfile(self._config):
-            with open(self._config) as fhc:
-                self.config = yaml.load(fhc)
+            config = load_config(self._config, cache=self._config_cache)
         elif isinstance(self._config, dict):
-            self.config = self._config
+            config = self._config
         else:
             raise TuxDroidError("`config` argument should be a string (yaml file path) or a dict")
-        for part in self._parts:
-            if part not in self.config:
-                raise TuxDroidError("Part %s is missing from configuration", part)
+        # Report all errors and pin collisions between parts at once
+        self.config = validate(config, parts=self._parts)
+
+    def moving_components(self):
+        """Get (name, component) of built components with a running motor"""
+        components = []
+        if self._wings is not None and self._wings.is_moving:
+            components.append(("wings", self._wings))
+        if self._head is not None:
+            for name in ("eyes", "mouth"):
+                component = getattr(self._head, name)
+                if component.is_moving:
+                    components.append((name, component))
+        return components
+
+    def state(self):
+        """Get an immutable snapshot of all parts, parts not built are None
+
+        No lock is taken, it can be polled from many threads
+        """
+        wings = self._wings
+        head = self._head
+        if head is None:
+            return TuxDroidState(wings.state() if wings is not None else None,
+                                 None, None, None, None)
+        eyes = head.eyes
+        return TuxDroidState(wings.state() if wings is not None else None,
+                             eyes.state(), head.mouth.state(), eyes.led_left, eyes.led_right)
+
+    def thermal_state(self):
+        """Get motor thermal budget state of built components"""
+        state = {}
+        if self._wings is not None:
+            state["wings"] = self._wings.thermal.state()
+        if self._head is not None:
+            state["eyes"] = self._head.eyes.thermal.state()
+            state["mouth"] = self._head.mouth.thermal.state()
+        return state
+
+    def calibration_report(self):
+        """Get the last CalibrationReport of built components, None if not calibrated yet"""
+        report = {}
+        if self._wings is not None:
+            report["wings"] = self._wings.calibration
+        if self._head is not None:
+            report["eyes"] = self._head.eyes.calibration
+            report["mouth"] = self._head.mouth.calibration
+        return report
+
+    def read_inputs(self):
+        """Read the levels of all configured inputs in one pass
+
+        Return an `Inputs` snapshot: `bits` is a bitfield where bit i
+        is the level of the input `names[i]`, like "wings.moving_sensor"
+        """
+        if self._input_map is None:
+            from tuxdroid.inputs import InputMap, open_register_reader
+            if self.gpio is GPIO and not GPIO.is_fake_():
+                # Only the local RPi.GPIO pins are in the local registers
+                self._register_reader = open_register_reader()
+            self._input_map = InputMap(self.config, self._parts)
+        return self._input_map.read(self.gpio, self._register_reader)
+
+    def input_levels(self):
+        """Get the levels of all configured inputs by name, True for HIGH"""
+        return self.read_inputs().as_dict()
+
+    def emergency_stop(self):
+        """Cut all motors in one GPIO write
+
+        No lock is taken and nothing is logged, so it can be called
+        from a signal handler. Running movements are interrupted.
+        """
+        parts = [part for part in (self._wings, self._head) if part is not None]
+        cut_motors([pin for part in parts for pin in part.motor_pins], self.gpio)
+        for part in parts:
+            part.halt()
+
+    def start_watchdog(self):
+        """Start a watchdog configured by the `safety` config section
+
+        Call `tux.watchdog.heartbeat()` from the control loop
+        if a heartbeat timeout is set
+        """
+        if self.watchdog is None:
+            safety = self.config['safety']
+            self.watchdog = Watchdog(self, safety['max_motor_time'],
+                                     safety['heartbeat_timeout'],
+                                     safety['watchdog_interval'])
+        self.watchdog.start()
+        return self.watchdog
+
+    def start_microphone(self, source=None, react: bool = True):
+        """Start voice detection configured by the `microphone` config section
+
+        source: block source, ALSA capture by default
+        react: light both eyes while speech is heard
+        """
+        if self.microphone is None:
+            from tuxdroid.microphone import microphone
+            self.microphone = microphone(self.config['microphone'], source)
+            if react:
+                self._add_speech_reactions(self.microphone)
+        self.microphone.start()
+        return self.microphone
+
+    def _add_speech_reactions(self, mic):
+        """Light eyes on speech, then restore them"""
+        eyes = self.head.eyes
+        leds = {}
+
+        def speech_start():
+            """Save and light eye leds"""
+            leds.update(left=eyes.led_left, right=eyes.led_right)
+            eyes.led_on()
+
+        def speech_stop():
+            """Restore eye leds"""
+            for side, lit in leds.items():
+                if not lit:
+                    eyes.led_off(side)
+
+        mic.add_callback("speech_start", speech_start)
+        mic.add_callback("speech_stop", speech_stop)
+
+    def stop_motors(self):
+        """Stop the motors of built parts, GPIOs stay set up
+
+        Return a future done when the wings brake ends, None without wings
+        """
+        done = None
+        if self._wings is not None:
+            done = self._wings.stop()
+        if self._head is not None:
+            self._head.stop()
+        return done
 
     def stop(self):
-        """Stop all TuxDroid parts"""
-        self.wings.stop()
-        self.wings.down()
-        self.head.stop()
-        self.head.mouth.close()
-        self.head.eyes.close()
-        self.head.eyes.led_off()
-        GPIO.cleanup()
+        """Stop all TuxDroid parts
+
+        Parts which were never built are not built to be stopped
+        and actuators which were never calibrated are not moved
+        """
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.microphone is not None:
+            self.microphone.stop()
+        if self._volume is not None:
+            self._volume.stop()
+        if self._speaker is not None:
+            self._speaker.stop()
+        if self._wings is not None:
+            self._wings.stop()
+            if self._wings.is_calibrated:
+                self._wings.down()
+        if self._head is not None:
+            self._head.stop()
+            if self._head.mouth.is_calibrated:
+                self._head.mouth.close()
+            if self._head.eyes.is_calibrated:
+                self._head.eyes.close()
+            self._head.eyes.led_off()
+            if self._head.eyes.light is not None:
+                self._head.eyes.light.stop()
+        if self._wings is not None:
+            # Let the last brake pulse end before releasing GPIOs
+            self._wings.stop().result()
+        self.gpio.cleanup()
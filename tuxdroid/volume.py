@@ -0,0 +1,158 @@
+"""Module defining TuxDroid Volume
+
+Volume button presses are coalesced: presses within one frame add up
+to a single volume change, applied to the speaker gain and reported
+to callbacks once per frame instead of once per edge.
+
+Callback events come from `volume.up` or `volume.down`, their position
+is the new volume level.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from tuxdroid.callbacks import CallbackRegistry, callbacks_property
+from tuxdroid.config import validate
+from tuxdroid.debounce import DebouncerSet, button_held
+from tuxdroid.gpio import GPIO
+from tuxdroid.errors import TuxDroidVolumeError
+from tuxdroid.scheduler import get_scheduler
+
+
+class Volume():
+    """Volume Component
+
+    speaker: Speaker whose gain follows the volume level, if any
+    gpio: GPIO backend, the module `GPIO` by default
+    """
+    # Registered callbacks
+    _volume_callbacks = callbacks_property("volume")
+
+    def __init__(self, config: dict, speaker=None, gpio=None, scheduler=None):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("volume")
+        # Privates
+        self._gpio = gpio or GPIO
+        self._gpio_names = ('up_button', 'down_button')
+        self._scheduler = scheduler or get_scheduler()
+        # Validate config
+        self.config = config
+        self._check_config()
+        # Set attributes
+        self.speaker = speaker
+        self.step = self.config['step']
+        self.frame_time = self.config['frame_time']
+        self.level = self.config['level']
+        self.presses = 0
+        self.frames = 0
+        # Set GPIO
+        self._gpio.setmode(self._gpio.BCM)
+        self._up_button = self.config['gpio']['up_button']
+        self._down_button = self.config['gpio']['down_button']
+        for button in self._gpio_names:
+            self._gpio.setup(getattr(self, "_" + button), self._gpio.IN,
+                             pull_up_down=self._gpio.PUD_UP)
+        # Thread pool
+        self._thread_pool = ThreadPoolExecutor(max_workers=1)
+        # Presses of the current frame
+        self._delta = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._callbacks = CallbackRegistry("volume", ("volume",), TuxDroidVolumeError,
+                                           self._thread_pool, self._logger)
+        # Set callbacks
+        self._debouncers = DebouncerSet(self.config['debounce'])
+        self._set_callbacks()
+        self._apply()
+
+    def _check_config(self):
+        """Validate config and set timing defaults"""
+        self.config = validate(self.config, "volume")
+        for button in self._gpio_names:
+            if self.config['gpio'][button] is None:
+                raise TuxDroidVolumeError("Missing `gpio.{}` in volume config".format(button))
+
+    def _set_callbacks(self):
+        """Set button callbacks"""
+        for button in self._gpio_names:
+            pin = getattr(self, "_" + button)
+            # Remove previous callbak if needed
+            self._gpio.remove_event_detect(pin)
+            # Add standard callbacks
+            debouncer = self._debouncers.add(button, self._button_detected,
+                                             button_held(self._gpio, pin))
+            self._gpio.add_event_detect(pin, self._gpio.RISING, callback=debouncer)
+
+    def debounce_stats(self):
+        """Get debounce statistics of each GPIO"""
+        return self._debouncers.stats()
+
+    def _button_detected(self, gpio_id):
+        """Count a press, the frame is flushed by the scheduler"""
+        if gpio_id == self._up_button:
+            direction = 1
+        elif gpio_id == self._down_button:
+            direction = -1
+        else:
+            # Should be impossible
+            self._logger.error("Bad button")
+            raise TuxDroidVolumeError("Bad GPIO id when button pressed")
+        with self._lock:
+            self._delta += direction
+            self.presses += 1
+            if self._timer is None:
+                self._timer = self._scheduler.call_later(self.frame_time, self._flush)
+
+    def _flush(self):
+        """Apply the presses of a frame at once"""
+        with self._lock:
+            delta, self._delta = self._delta, 0
+            self._timer = None
+        level = min(1., max(0., self.level + delta * self.step))
+        if level == self.level:
+            # Presses cancelled each other or volume is at a limit
+            return
+        self.level = level
+        self.frames += 1
+        self._logger.info("Volume %.2f (%+d)", level, delta)
+        self._apply()
+        self._callbacks.dispatch("volume", "volume.up" if delta > 0 else "volume.down", level)
+
+    def _apply(self):
+        """Set the speaker gain from the volume level"""
+        if self.speaker is not None:
+            self.speaker.gain = self.level
+
+    def set_level(self, level: float):
+        """Set the volume level, between 0 and 1"""
+        if not 0 <= level <= 1:
+            raise TuxDroidVolumeError("Volume level should be between 0 and 1")
+        self.level = float(level)
+        self._apply()
+
+    def add_callback(self, callback, inline: bool = False):
+        """Add callback called once per frame, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument
+        inline: run the callback in the scheduler thread, it must be short
+        """
+        return self._callbacks.add("volume", callback, "volume", inline)
+
+    def del_callback(self, callback):
+        """Delete callback"""
+        self._callbacks.remove("volume", callback, "volume")
+
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
+
+    def stop(self):
+        """Stop handling buttons, pending presses are applied"""
+        for button in self._gpio_names:
+            self._gpio.remove_event_detect(getattr(self, "_" + button))
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            self._flush()
@@ -0,0 +1,353 @@
+"""Module defining TuxDroid HTTP and WebSocket API
+
+The server is based on asyncio and only uses the standard library,
+all clients are handled by one event loop thread. Blocking commands
+(motor movements) are run in a small thread pool.
+
+Routes:
+
+* ``GET /state``: current positions of all parts
+* ``GET /commands``: list of available commands
+* ``POST /command/<name>``: run a command, the body is a JSON list of arguments
+* ``GET /events``: WebSocket, component events are pushed as
+  ``{"event": "wings.left"}``, commands can be sent as
+  ``{"id": 1, "cmd": "wings.up", "args": []}`` and get
+  ``{"id": 1, "ok": true, "result": null}`` responses.
+
+Identical commands (same name and arguments) received while one is running
+are coalesced: they wait for the running one and share its result.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+
+from tuxdroid.commands import COMMANDS, Dispatcher
+from tuxdroid.daemon import format_error
+from tuxdroid.errors import TuxDroidError
+
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Events waiting for a slow WebSocket client before dropping the oldest
+EVENT_QUEUE_SIZE = 64
+MAX_BODY_SIZE = 65536
+
+_REASONS = {200: "OK", 101: "Switching Protocols", 400: "Bad Request",
+            404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error"}
+
+
+class _HTTPError(Exception):
+    """HTTP error sent back to the client"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def websocket_accept(key: str):
+    """Compute `Sec-WebSocket-Accept` header from `Sec-WebSocket-Key`"""
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def websocket_frame(payload: bytes, opcode: int = 0x1):
+    """Build an unmasked (server) WebSocket frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def websocket_unmask(mask: bytes, payload: bytes):
+    """Unmask a client WebSocket payload"""
+    length = len(payload)
+    if not length:
+        return payload
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+    return (int.from_bytes(payload, "big") ^ key).to_bytes(length, "big")
+
+
+async def read_websocket_frame(reader):
+    """Read one WebSocket frame and return (opcode, payload)"""
+    head = await reader.readexactly(2)
+    opcode = head[0] & 0x0f
+    masked = head[1] & 0x80
+    length = head[1] & 0x7f
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_BODY_SIZE:
+        raise _HTTPError(413, "WebSocket frame too large")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = websocket_unmask(mask, payload)
+    return opcode, payload
+
+
+def _enqueue(queue, item):
+    """Put item in a bounded queue, dropping the oldest item if full"""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+class WebAPIServer():
+    """TuxDroid HTTP and WebSocket server
+
+    .. code-block:: python
+
+        loop = asyncio.get_event_loop()
+        server = WebAPIServer(tux, port=8080)
+        loop.run_until_complete(server.start())
+        loop.run_forever()
+    """
+    def __init__(self, tux, host: str = "127.0.0.1", port: int = 8080,
+                 workers: int = 4, loop=None):
+        # Get logger
+        self._logger = logging.getLogger("tuxdroid").getChild("webapi")
+        # Set attributes
+        self.tux = tux
+        self.host = host
+        self.port = port
+        self.dispatcher = Dispatcher(tux)
+        self.stats = {"requests": 0, "commands": 0, "coalesced": 0, "events": 0}
+        # Privates
+        self._loop = loop or asyncio.get_event_loop()
+        self._thread_pool = ThreadPoolExecutor(max_workers=workers)
+        self._server = None
+        self._inflight = {}
+        self._websockets = set()
+
+    async def start(self):
+        """Start listening"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.dispatcher.subscribe(self._event_listener)
+        self._logger.info("Web API listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        """Stop listening and close WebSockets"""
+        self.dispatcher.unsubscribe(self._event_listener)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for queue in tuple(self._websockets):
+            _enqueue(queue, None)
+        self._thread_pool.shutdown(wait=False)
+
+    # Commands
+    async def run_command(self, name: str, args=()):
+        """Run a command, coalescing it with an identical running one"""
+        key = (name, json.dumps(args))
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        self.stats["commands"] += 1
+        if self.dispatcher.is_quick(name):
+            # Fast commands are run in the event loop
+            return self.dispatcher.call(name, args)
+        future = self._loop.run_in_executor(self._thread_pool, self.dispatcher.call,
+                                            name, args)
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    # Events
+    def _event_listener(self, event: str):
+        """Forward component event to the event loop"""
+        self._loop.call_soon_threadsafe(self._broadcast, event)
+
+    def _broadcast(self, event: str):
+        """Send event to all WebSocket clients"""
+        self.stats["events"] += 1
+        frame = websocket_frame(json.dumps({"event": event}).encode())
+        for queue in self._websockets:
+            # Slow clients lose their oldest events
+            _enqueue(queue, frame)
+
+    # HTTP
+    async def _handle_client(self, reader, writer):
+        """Handle one HTTP connection (keep-alive)"""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                self.stats["requests"] += 1
+                method, path, headers, body = request
+                if path == "/events" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._handle_websocket(reader, writer, headers)
+                    break
+                try:
+                    status, payload = await self._route(method, path, body)
+                except _HTTPError as exp:
+                    status, payload = exp.status, {"ok": False, "error": str(exp)}
+                self._write_response(writer, status, payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except _HTTPError as exp:
+            self._write_response(writer, exp.status, {"ok": False, "error": str(exp)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        """Read an HTTP request, return None on connection end"""
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, path, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise _HTTPError(400, "Bad request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_SIZE:
+            raise _HTTPError(413, "Body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    @staticmethod
+    def _write_response(writer, status: int, payload):
+        """Write a JSON response"""
+        body = json.dumps(payload).encode()
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                     "Content-Length: {}\r\n\r\n".format(status, _REASONS.get(status, ""),
+                                                         len(body)).encode() + body)
+
+    async def _route(self, method: str, path: str, body: bytes):
+        """Run the request and return (status, payload)"""
+        if path == "/state":
+            return 200, self.dispatcher.state()
+        if path == "/commands":
+            return 200, sorted(COMMANDS)
+        if path.startswith("/command/"):
+            if method != "POST":
+                raise _HTTPError(405, "Commands should use POST")
+            name = path[len("/command/"):]
+            if name not in COMMANDS:
+                raise _HTTPError(404, "Unknown command `{}`".format(name))
+            try:
+                args = json.loads(body.decode()) if body else []
+            except ValueError:
+                args = None
+            if not isinstance(args, list):
+                raise _HTTPError(400, "Body should be a JSON list")
+            return 200, await self._command_response(name, args)
+        raise _HTTPError(404, "Not found")
+
+    async def _command_response(self, name: str, args):
+        """Run a command and build its response payload"""
+        try:
+            result = await self.run_command(name, args)
+        except TuxDroidError as exp:
+            return {"ok": False, "error": format_error(exp)}
+        except Exception as exp:  # pylint: disable=W0703
+            self._logger.exception("Command `%s` failed", name)
+            return {"ok": False, "error": repr(exp)}
+        return {"ok": True, "result": result}
+
+    # WebSocket
+    async def _handle_websocket(self, reader, writer, headers):
+        """Handle WebSocket connection on /events"""
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise _HTTPError(400, "Missing Sec-WebSocket-Key")
+        writer.write("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     "Connection: Upgrade\r\nSec-WebSocket-Accept: {}\r\n\r\n"
+                     .format(websocket_accept(key)).encode())
+        queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self._websockets.add(queue)
+        sender = asyncio.ensure_future(self._websocket_sender(writer, queue))
+        try:
+            while True:
+                opcode, payload = await read_websocket_frame(reader)
+                if opcode == 0x8:
+                    break
+                elif opcode == 0x9:
+                    _enqueue(queue, websocket_frame(payload, 0xA))
+                elif opcode == 0x1:
+                    asyncio.ensure_future(self._websocket_command(queue, payload))
+        finally:
+            self._websockets.discard(queue)
+            _enqueue(queue, websocket_frame(b"", 0x8))
+            _enqueue(queue, None)
+            await sender
+
+    async def _websocket_command(self, queue, payload: bytes):
+        """Run a command received from a WebSocket"""
+        try:
+            request = json.loads(payload.decode())
+            req_id = request.get("id")
+            name = request["cmd"]
+            args = request.get("args", [])
+            if not isinstance(args, list):
+                raise ValueError("args should be a list")
+        except (ValueError, KeyError, AttributeError):
+            response = {"id": None, "ok": False, "error": "Bad request"}
+        else:
+            response = await self._command_response(name, args)
+            response["id"] = req_id
+        _enqueue(queue, websocket_frame(json.dumps(response).encode()))
+
+    @staticmethod
+    async def _websocket_sender(writer, queue):
+        """Write queued frames to the WebSocket"""
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                break
+            writer.write(frame)
+            try:
+                await writer.drain()
+            except ConnectionError:
+                break
+
+
+def main(argv=None):
+    """Run TuxDroid web API"""
+    from tuxdroid.tuxdroid import TuxDroid
+
+    parser = argparse.ArgumentParser(description="TuxDroid HTTP and WebSocket API")
+    parser.add_argument("config", help="yaml configuration file")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="listen address, commands are not authenticated")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    tux = TuxDroid(args.config)
+    loop = asyncio.get_event_loop()
+    server = WebAPIServer(tux, args.host, args.port, loop=loop)
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+        tux.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,140 +1,185 @@
 """Module defining TuxDroid Wings"""
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
+import threading
 import time
-import types
 
+from tuxdroid.calibration import CALIBRATIONS, report, wait_for_sensor
+from tuxdroid.callbacks import CallbackRegistry, callbacks_property
+from tuxdroid.config import validate
+from tuxdroid.debounce import DebouncerSet, button_held
 from tuxdroid.gpio import GPIO
 from tuxdroid.errors import TuxDroidWingsError
+from tuxdroid.positions import WINGS, Position, StateMachine
+from tuxdroid.scheduler import get_scheduler
+from tuxdroid.state import StateCell, state_property
+from tuxdroid.thermal import motor_budget
 
 
-# Bounce time for rising edge detection: 100ms
-BOUNCE_TIME = 0.1
-# TODO Improve button bounce time
-BUTTON_BOUNCE_TIME = 0.25
+def _resolved(result):
+    """Get a future already done"""
+    future = Future()
+    future.set_result(result)
+    return future
 
 
 class Wings():
     """Wings Component
 
     .. todo:: Missing wings speed control (using PWM, need to find PWN frequency/duty cycle)
+
+    calibrate: if False, wings are calibrated on their first move
+    gpio: GPIO backend, the module `GPIO` by default
     """
-    def __init__(self, config: dict):
+    # Attributes stored in the state snapshot
+    position = state_property("position")
+    is_moving = state_property("is_moving")
+    _count = state_property("count")
+    _motor_start_time = state_property("motor_start_time")
+    # Registered callbacks
+    _left_callbacks = callbacks_property("left")
+    _right_callbacks = callbacks_property("right")
+
+    def __init__(self, config: dict, calibrate: bool = True, gpio=None):
         # Get logger
         self._logger = logging.getLogger("tuxdroid").getChild("wings")
         # Set attributes
+        self._state = StateCell()
+        self.state_machine = StateMachine(WINGS, TuxDroidWingsError)
         self.is_ready = False
-        self.is_moving = False
         self.is_calibrated = False
-        self.position = None
+        # CalibrationReport of the last calibration
+        self.calibration = None
+        # Monotonic time of the last motor start
+        self.motor_started_at = None
         # Privates
-        self._count = 0
-        self._motor_start_time = None
-        self._gpio_names = ('left_button', 'right_button', 'moving_sensor',
-                            'motor_direction_1', 'motor_direction_2')
+        self._gpio = gpio or GPIO
+        self._calibrating = False
         # Validate config
         self.config = config
         self._check_config()
         # Set GPUIO
-        GPIO.setmode(GPIO.BCM)
-        self._left_button = int(config.get("gpio").get('left_button'))
-        GPIO.setup(self._left_button, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._right_button = int(config.get("gpio").get('right_button'))
-        GPIO.setup(self._right_button, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._moving_sensor = int(config.get("gpio").get('moving_sensor'))
-        GPIO.setup(self._moving_sensor, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        self._motor_direction_1 = int(config.get("gpio").get('motor_direction_1'))
-        GPIO.setup(self._motor_direction_1, GPIO.OUT)
-        self._motor_direction_2 = int(config.get("gpio").get('motor_direction_2'))
-        GPIO.setup(self._motor_direction_2, GPIO.OUT)
+        self._gpio.setmode(self._gpio.BCM)
+        self._left_button = self.config['gpio']['left_button']
+        self._gpio.setup(self._left_button, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._right_button = self.config['gpio']['right_button']
+        self._gpio.setup(self._right_button, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._moving_sensor = self.config['gpio']['moving_sensor']
+        self._gpio.setup(self._moving_sensor, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._motor_direction_1 = self.config['gpio']['motor_direction_1']
+        self._gpio.setup(self._motor_direction_1, self._gpio.OUT)
+        self._motor_direction_2 = self.config['gpio']['motor_direction_2']
+        self._gpio.setup(self._motor_direction_2, self._gpio.OUT)
+        self.motor_pins = (self._motor_direction_1, self._motor_direction_2)
         # Callbacks
-        self._right_callbacks = set()
-        self._left_callbacks = set()
+        self._debouncers = DebouncerSet(self.config['debounce'])
+        self._gestures = None
+        # Notified on each position change and stop
+        self._moved = threading.Condition()
+        # Brake sequence
+        self._brake_lock = threading.Lock()
+        self._brake_timer = None
+        self._brake_done = _resolved(True)
+        self._halted = False
         # Thread pool
         self._thread_pool = ThreadPoolExecutor()
+        self._callbacks = CallbackRegistry("wings", ("left", "right"), TuxDroidWingsError,
+                                           self._thread_pool, self._logger)
+        # Motor on-time accounting
+        self.thermal = motor_budget("wings", self.config['thermal'], self.stop)
         # Calibration
-        self._logger.info("Wings calibration starting")
-        self.calibrate()
-        self._logger.info("Wings calibration done")
+        if calibrate:
+            self.calibrate()
         # Set callbacks
         self._set_callbacks()
         # Set it as ready
         self.is_ready = True
 
     def _check_config(self):
-        """Validate config"""
-        if not self.config.get('gpio'):
-            raise TuxDroidWingsError("Missing `gpio` section in wings config")
-        for gpio_name in self._gpio_names:
-            if gpio_name not in self.config.get('gpio'):
-                raise TuxDroidWingsError("Missing `%s` section in `gpio` section "
-                                         "in wings config", gpio_name)
-            try:
-                int(self.config.get('gpio').get(gpio_name))
-            except ValueError:
-                raise TuxDroidWingsError("`gpio.%s` should be a integer", gpio_name)
+        """Validate config and set timing defaults"""
+        self.config = validate(self.config, "wings")
+
+    def state(self):
+        """Get an immutable snapshot of the wings state"""
+        return self._state.snapshot()
 
     def _button_detected(self, gpio_id):
         """Callback for all buttons"""
         self._logger.info("Button %s pressed", gpio_id)
         # callbacks
         if gpio_id == self._right_button:
-            for callback in self._right_callbacks:
-                self._logger.debug("Calling: %s", callback.__name__)
-                self._thread_pool.submit(callback)
+            self._callbacks.dispatch("right", "wings.right", self.position)
+            if self._gestures is not None:
+                self._gestures.press("wings.right")
         elif gpio_id == self._left_button:
-            for callback in self._left_callbacks:
-                self._logger.debug("Calling: %s", callback.__name__)
-                self._thread_pool.submit(callback)
+            self._callbacks.dispatch("left", "wings.left", self.position)
+            if self._gestures is not None:
+                self._gestures.press("wings.left")
         else:
             # Should be impossible
             self._logger.error("Bad button")
             raise TuxDroidWingsError("Bad GPIO id when button pressed")
 
+    def set_gesture_recognizer(self, recognizer):
+        """Feed button presses to a gesture recognizer"""
+        for name, pin in (("wings.left", self._left_button),
+                          ("wings.right", self._right_button)):
+            recognizer.add_button(name, lambda pin=pin: self._gpio.input(pin) == self._gpio.HIGH)
+        self._gestures = recognizer
+
     def _set_callbacks(self):
         """Set button callbacks"""
-        for button in ("_left_button", "_right_button"):
+        for button in ("left_button", "right_button"):
+            pin = getattr(self, "_" + button)
             # Remove previous callbak if needed
-            GPIO.remove_event_detect(getattr(self, button))
+            self._gpio.remove_event_detect(pin)
             # Add standard callbacks
-            GPIO.add_event_detect(getattr(self, button), GPIO.RISING,
-                                  callback=self._button_detected,
-                                  bouncetime=int(BUTTON_BOUNCE_TIME * 1000))
+            debouncer = self._debouncers.add(button, self._button_detected,
+                                             button_held(self._gpio, pin))
+            self._gpio.add_event_detect(pin, self._gpio.RISING, callback=debouncer)
+
+    def debounce_stats(self):
+        """Get debounce statistics of each GPIO"""
+        return self._debouncers.stats()
 
-    def add_callback(self, side: str, callback):
-        """Add callback"""
+    def add_callback(self, side: str, callback, inline: bool = False):
+        """Add callback, return its subscription
+
+        callback: any callable or coroutine function, called with an `Event`
+                  if it has a required argument
+        inline: run the callback in the GPIO event thread, it must be short
+                (see `tuxdroid.callbacks.INLINE_BUDGET`)
+        """
         if side not in ("left", "right"):
             raise TuxDroidWingsError("Bad side, should be 'left' or 'right'")
-        if not isinstance(callback, types.FunctionType):
-            raise TuxDroidWingsError("Callback `%s` is not a function", callback)
-
-        callbacks = getattr(self, "_{}_callbacks".format(side))
-        if callback in callbacks:
-            self._logger.warning("Callback `%s` already registered to `%s` wing",
-                                 callback.__name__, side)
-        else:
-            self._logger.info("Adding callback `%s` to `%s` wing", callback.__name__, side)
-            callbacks.add(callback)
+        return self._callbacks.add(side, callback, "`{}` wing".format(side), inline)
 
     def del_callback(self, side: str, callback):
         """Delete callback"""
         if side not in ("left", "right"):
             raise TuxDroidWingsError("Bad side, should be 'left' or 'right'")
+        self._callbacks.remove(side, callback, "`{}` wing".format(side))
 
-        callbacks = getattr(self, "_{}_callbacks".format(side))
-        if callback not in callbacks:
-            self._logger.warning("Callback `%s` not registered to `%s` wing",
-                                 callback.__name__, side)
-        else:
-            self._logger.info("Deleting callback `%s` to `%s` wing", callback.__name__, side)
-            callbacks.remove(callback)
+    def callback_stats(self):
+        """Get run time statistics of inline callbacks"""
+        return self._callbacks.stats()
 
-    def calibrate(self):
+    def calibrate(self, strategy: str = None):
         """Moving Wings 3 times and try to put them down
 
         Wings goes UP more quickly then they goes DOWN
         That's while we time between each detection
+
+        strategy: `fast` or `full`, see `tuxdroid.calibration`, config value by default
         """
+        strategy = strategy or self.config['calibration']
+        if strategy not in CALIBRATIONS:
+            raise TuxDroidWingsError("Bad calibration, should be one of {}".format(CALIBRATIONS))
+        self._logger.info("Wings calibration starting")
+        self._calibrating = True
+        start = time.monotonic()
+        # The moving sensor gives no absolute position, fast calibration only moves less
+        least_moves = 2 if strategy == "fast" else 4
         # Init variables
         wings_dectection = None
         last_wings_detection = None
@@ -144,16 +189,21 @@ class Wings():
         # Start moving
         self.start()
         # Start init
-        while wings_nb_moves < 4 or self.position == "UP":
+        while wings_nb_moves < least_moves or self.position == Position.UP:
             # Wait for Rising edge
-            GPIO.wait_for_edge(self._moving_sensor, GPIO.RISING)
+            try:
+                wait_for_sensor(self._gpio, self._moving_sensor, lambda: self.is_moving,
+                                TuxDroidWingsError)
+            except TuxDroidWingsError:
+                self._calibrating = False
+                raise
             # Time between each detection
             wings_dectection = time.time()
             # We need at least one another detection
             if last_wings_detection:
                 dectection_time = wings_dectection - last_wings_detection
                 # Remove too short detections (bad detections)
-                if dectection_time > BOUNCE_TIME:
+                if dectection_time > self.config['debounce']['moving_sensor']['time']:
                     # New move detected (UP OR DOWN)
                     wings_nb_moves += 1
                     if last_dectection_time is None:
@@ -161,21 +211,25 @@ class Wings():
                         last_dectection_time = dectection_time
                     elif last_dectection_time > dectection_time:
                         # Position UP detected
-                        self.position = "UP"
+                        self.position = Position.UP
                     else:
                         # Position DOWN detected
-                        self.position = "DOWN"
+                        self.position = Position.DOWN
                     last_dectection_time = dectection_time
             last_wings_detection = wings_dectection
         # Stop moving
         self.stop()
+        self.calibration = report("wings", strategy, start, wings_nb_moves)
         # Wings should be down
         self.is_calibrated = True
+        self._calibrating = False
+        self._logger.info("Wings calibration done: %.2fs, %d moves saved",
+                          self.calibration.time, self.calibration.moves_saved)
         # Set callback for wings move detection
-        GPIO.remove_event_detect(self._moving_sensor)
-        GPIO.add_event_detect(self._moving_sensor, GPIO.RISING,
-                              callback=self._wings_rotation_callback,
-                              bouncetime=int(BOUNCE_TIME * 1000))
+        self._gpio.remove_event_detect(self._moving_sensor)
+        self._gpio.add_event_detect(self._moving_sensor, self._gpio.RISING,
+                                    callback=self._debouncers.add("moving_sensor",
+                                                                  self._wings_rotation_callback))
 
     def _wings_rotation_callback(self, gpio_id):
         """Callback method detecting wings movement
@@ -183,7 +237,7 @@ class Wings():
         The method is called each time wings are up or down
         """
         # We have to not consider the first event
-        if time.time() - self._motor_start_time < 0.1:
+        if time.time() - self._motor_start_time < self.config['startup_time']:
             # Maybe we want a debug ?
             self._logger.warning("Startup wings event detected, ignoring it")
             return
@@ -202,36 +256,58 @@ class Wings():
         if not self.is_calibrated:
             self._logger.error("Wings are not calibrated")
             return
-        self._logger.debug("Moving detection - Current position: %s", self.position)
-        if self.position == "UP":
-            self.position = "DOWN"
-            self._count += 1
-            self._logger.info("Position DOWN")
-        elif self.position == "DOWN":
-            self.position = "UP"
-            self._count += 1
-            self._logger.info("Position UP")
-        else:
-            raise TuxDroidWingsError("Bad position")
+        old, new = self._state.modify(self._flip)
+        self.state_machine.record(old.position, "moving", new.position)
+        self._logger.info("Position %s", new.position)
+        self._notify_move()
+
+    def _flip(self, state):
+        """State changes of a wings movement"""
+        return {"position": self.state_machine.next(state.position, "moving"),
+                "count": state.count + 1}
+
+    def _notify_move(self, blocking: bool = True):
+        """Wake up threads waiting for a position or a stop
+
+        blocking: if False, give up when another thread holds the condition
+        """
+        if self._moved.acquire(blocking):
+            try:
+                self._moved.notify_all()
+            finally:
+                self._moved.release()
+
+    def _ensure_calibrated(self):
+        """Calibrate wings on first move if it was not done at startup"""
+        if not self.is_calibrated and not self._calibrating:
+            self.calibrate()
 
     def start(self):
         """Start moving wings"""
+        self._ensure_calibrated()
+        # Interrupt a running brake, both directions must never be HIGH
+        self._cancel_brake()
+        self._halted = False
         if not self.is_moving:
             # If we pressed on right wing button when wings are down
             # the moving_sensor will stay ON (1)
             # So we don't need remove the first bad detection
-            self._motor_start_time = time.time()
+            self.thermal.acquire()
+            self._state.update(motor_start_time=time.time())
             # Starting wings
             self._logger.info("Starting moving wings")
-            GPIO.output(self._motor_direction_1, GPIO.HIGH)
+            self._gpio.output(self._motor_direction_1, self._gpio.HIGH)
+            self.motor_started_at = time.monotonic()
+            self.thermal.motor_on()
             self.is_moving = True
 
     def set_position(self, position):
         """Move wings to a position"""
-        position = position.upper()
-        if position not in ["UP", "DOWN"]:
+        position = self.state_machine.target(position)
+        if position is None:
             self._logger.error("Bad wings position")
             raise TuxDroidWingsError("Bad position")
+        self._ensure_calibrated()
         # Do nothing if already in position
         if self.position == position:
             self._logger.info("Wings already in %s position", position)
@@ -240,10 +316,12 @@ class Wings():
         self.start()
         # Wait for position
         # TODO add timeout
-        while self.position != position:
-            pass
+        with self._moved:
+            self._moved.wait_for(lambda: self.position == position or not self.is_moving)
         # Stop moving
         self.stop()
+        if self.position != position:
+            raise TuxDroidWingsError("Wings stopped before reaching %s position" % position)
 
     def up(self):  # pylint: disable=C0103
         """Move wings up"""
@@ -260,22 +338,90 @@ class Wings():
 
         The count is incremented each time wings are in UP or DOWN position
         """
+        self._ensure_calibrated()
         self._count = 0
         # Start moving
         self.start()
-        while self._count != times:
+        with self._moved:
             # Wait for the count
-            pass
+            self._moved.wait_for(lambda: self._count >= times or not self.is_moving)
         # Stop moving
         self.stop()
         self._count = 0
 
     def stop(self):
-        """Stop moving wings"""
-        if self.is_moving:
+        """Stop moving wings
+
+        The motor is braked by a reverse pulse run by the scheduler,
+        so the call returns right away.
+        Return a future done when the brake ends, its result is False
+        if the brake was interrupted by a new start.
+        """
+        if self._halted:
+            # Brake cancelled by an emergency stop
+            self._cancel_brake()
+        with self._brake_lock:
+            if not self.is_moving:
+                return self._brake_done
             self._logger.info("Stop wings")
             self.is_moving = False
-            GPIO.output(self._motor_direction_1, GPIO.LOW)
-            GPIO.output(self._motor_direction_2, GPIO.HIGH)
-            time.sleep(0.03)
-            GPIO.output(self._motor_direction_2, GPIO.LOW)
+            self._gpio.output(self._motor_direction_1, self._gpio.LOW)
+            self.thermal.motor_off()
+            done = Future()
+            self._brake_done = done
+            brake = self.config['brake']
+            if brake['time'] > 0:
+                # Dead time lets the motor driver switch off before reversing
+                self._brake_timer = get_scheduler().call_later(
+                    brake['dead_time'], self._brake_pulse, done)
+            else:
+                done.set_result(True)
+        self._notify_move()
+        return done
+
+    def _brake_pulse(self, done):
+        """Start reverse brake pulse"""
+        with self._brake_lock:
+            if self._halted or self._brake_done is not done or done.done():
+                return
+            self._gpio.output(self._motor_direction_2, self._gpio.HIGH)
+            self._brake_timer = get_scheduler().call_later(
+                self.config['brake']['time'], self._brake_end, done)
+
+    def _brake_end(self, done):
+        """End reverse brake pulse"""
+        with self._brake_lock:
+            if self._brake_done is not done or done.done():
+                return
+            self._gpio.output(self._motor_direction_2, self._gpio.LOW)
+            self._brake_timer = None
+            # Claim the future, it is resolved out of the lock for its callbacks
+            self._brake_done = _resolved(True)
+        done.set_result(True)
+
+    def halt(self):
+        """Forget the running movement after an emergency stop cut the motor
+
+        Only reentrant locks are taken, so it can run in a signal handler
+        """
+        self._halted = True
+        timer = self._brake_timer
+        if timer is not None:
+            timer.cancel()
+        self.thermal.motor_off()
+        self._state.update(is_moving=False)
+        self._notify_move(blocking=False)
+
+    def _cancel_brake(self):
+        """Interrupt a running brake sequence"""
+        with self._brake_lock:
+            done = self._brake_done
+            if done.done():
+                return
+            if self._brake_timer is not None:
+                self._brake_timer.cancel()
+            self._brake_timer = None
+            self._gpio.output(self._motor_direction_2, self._gpio.LOW)
+            self._brake_done = _resolved(False)
+        self._logger.debug("Brake interrupted")
+        done.set_result(False)